@@ -0,0 +1,91 @@
+"""
+Measures what a shared, long-lived AIClient saves over creating one per document, by importing the
+same document many times against a local fake OpenAI server:
+
+    python -m benchmarks.client_reuse --documents 50 --latency 0.05
+
+'per-document' mimics the old behaviour (a new OpenAI client and instructor wrapper for every
+DocumentProcessor); 'shared' uses one client with a keep-alive pool, as get_ai_client() does.
+The fake server speaks plain HTTP, so saved TLS handshakes against the real API come on top of this.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+
+_cache_root = tempfile.mkdtemp(prefix="dmaze-client-reuse-")
+os.environ["DMAZE_CONVERSION_CACHE_DIR"] = os.path.join(_cache_root, "conversions")
+os.environ["DMAZE_RESOLUTION_CACHE_PATH"] = os.path.join(_cache_root, "entity_resolution.sqlite")
+
+from openai import OpenAI
+
+from src.ai_client import AIClient, create_openai_client
+from src.document_processor import DocumentProcessor
+from src.fake_openai_server import FakeOpenAIState, create_fake_openai_server
+from src.resolution_cache import get_resolution_cache
+from src.schema_processor import process_template_hierarchically
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DOCUMENT = os.path.join(REPO_DIR, "input_documents", "Mom_sample_4.txt")
+DEFAULT_TEMPLATE = os.path.join(REPO_DIR, "input-schemas", "Minutes of Meeting.json")
+
+
+def run_documents(count: int, document_bytes: bytes, filename: str, schema_content: dict, make_client) -> float:
+    schema_package = process_template_hierarchically(schema_content)
+    start = time.perf_counter()
+    for _ in range(count):
+        get_resolution_cache().clear()
+        processor = DocumentProcessor(schema_content=schema_content, document=document_bytes, document_filename=filename,
+                                      ai_client=make_client(), schema_package=schema_package)
+        processor.run()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-document versus shared AIClient over a local fake server.")
+    parser.add_argument("--documents", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds the fake server takes per request.")
+    parser.add_argument("--document", default=DEFAULT_DOCUMENT)
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE)
+    args = parser.parse_args()
+
+    with open(args.document, 'rb') as f:
+        document_bytes = f.read()
+    with open(args.template, 'r', encoding='utf-8') as f:
+        schema_content = json.load(f)
+
+    state = FakeOpenAIState(latency=args.latency, seed=1)
+    server = create_fake_openai_server(port=0, state=state)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    shared_client = AIClient(create_openai_client(api_key="fake", base_url=base_url))
+    modes = {
+        "per-document": lambda: AIClient(OpenAI(api_key="fake", base_url=base_url)),
+        "shared": lambda: shared_client,
+    }
+    # One untimed import first, so one-off costs (converter start-up, caches) do not count against either mode
+    run_documents(1, document_bytes, os.path.basename(args.document), schema_content, lambda: shared_client)
+    report = {}
+    for mode, make_client in modes.items():
+        requests_before, connections_before = state.requests, state.connections
+        seconds = run_documents(args.documents, document_bytes, os.path.basename(args.document), schema_content, make_client)
+        report[mode] = {
+            "wallSeconds": round(seconds, 3),
+            "secondsPerDocument": round(seconds / args.documents, 4),
+            "requests": state.requests - requests_before,
+            "connectionsOpened": state.connections - connections_before,
+        }
+    server.shutdown()
+
+    saved = report["per-document"]["wallSeconds"] - report["shared"]["wallSeconds"]
+    report["savedSeconds"] = round(saved, 3)
+    report["savedPercent"] = round(saved / report["per-document"]["wallSeconds"] * 100, 1)
+    print(json.dumps(report, indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
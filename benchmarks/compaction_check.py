@@ -0,0 +1,224 @@
+"""
+Checks that markdown compaction (src/markdown_compactor.py) does not change what the pipeline can extract,
+over every document in input_documents/:
+
+    python -m benchmarks.compaction_check           # offline guarantees, no network access
+    python -m benchmarks.compaction_check --live    # also extracts each suite case with and without compaction
+
+Offline, each rule is applied in turn and must satisfy its guarantee:
+  - no word of the document is lost, except image and bookmark link targets;
+    repeated boilerplate is only removed within a heading section, so every section keeps all of its words;
+  - page furniture removal keeps every line of every page, in order, except lines removed at a page edge:
+    a bare page number on a page's first or last line, or a repeated header or footer whose first occurrence remains;
+  - table and whitespace normalization lose no words at all;
+  - the heading structure, the local pre-classification and the local heading split are unchanged.
+With --live (needs OPENAI_API_KEY), the extracted items (per object type, by title or name) must be the same.
+The exit status is 1 when any check fails.
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import tempfile
+from collections import Counter
+
+_cache_root = tempfile.mkdtemp(prefix="dmaze-compaction-check-")
+os.environ["DMAZE_CONVERSION_CACHE_DIR"] = os.path.join(_cache_root, "conversions")
+os.environ["DMAZE_SCHEMA_CACHE_DIR"] = os.path.join(_cache_root, "schema_packages")
+
+from src.batch_processor import discover_input_files
+from src.document_classifier import analyze_document_structure
+from src.document_converter import convert_file_to_markdown
+from src.document_splitter import find_headings, split_document_by_headings
+from src.entity_resolver import normalize_text
+from src.markdown_compactor import (DEFAULT_COMPACTION_RULES, PAGE_FURNITURE_EDGE_LINES, _PAGE_NUMBER_PATTERN,
+                                    compact_markdown)
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+SUITE_PATH = os.path.join(BENCHMARK_DIR, "suite.json")
+DOCUMENTS_DIR = os.path.join(REPO_DIR, "input_documents")
+TEMPLATES_DIR = os.path.join(REPO_DIR, "input-schemas")
+
+_IMAGE_TARGET_PATTERN = re.compile(r'!\[([^\]]*)\]\(((?:[^()]|\([^()]*\))*)\)')
+_BOOKMARK_TARGET_PATTERN = re.compile(r'\]\((#[^)\s]*)\)')
+
+# A value that repeats inside a page's body must survive even when the same value is removed at the edge
+FURNITURE_CASE = '\f'.join(['Title\nbody\n1', 'Risiko\nSannsynlighet\n2\nKonsekvens\n4\n2', 'Tiltak\nx\n3'])
+# Sections that share a long paragraph (here the measures of each risk) must each keep their copy
+_MEASURES = ("Tiltak: Kommunen skal gjennomgå beredskapsplanen årlig, øve på varsling av innbyggere, holde "
+             "oppdatert oversikt over sårbare grupper og sørge for at kritisk infrastruktur har reservestrøm og "
+             "alternative kommunikasjonsløsninger.")
+BOILERPLATE_CASE = "\n\n".join(f"## Risiko {n}\n\nBeskrivelse av risiko {n}.\n\n{_MEASURES}" for n in (1, 2, 3))
+
+
+def words(text: str) -> Counter:
+    return Counter(re.findall(r'\w+', text.lower()))
+
+
+def section_words(text: str) -> list[Counter]:
+    """Word counts of the text before the first heading and of each heading's section."""
+    boundaries = [0] + [offset for offset, _, _ in find_headings(text)] + [len(text)]
+    return [words(text[start:end]) for start, end in zip(boundaries, boundaries[1:])]
+
+
+def check_section_words(rule_name: str, text: str, compacted: str) -> list[str]:
+    """Every word of a heading section remains in that section (repeats within it may be removed)."""
+    sections, compacted_sections = section_words(text), section_words(compacted)
+    if len(sections) != len(compacted_sections):
+        return [f"{rule_name} changed the number of heading sections: {len(sections)} -> {len(compacted_sections)}"]
+    failures = []
+    for index, (before, after) in enumerate(zip(sections, compacted_sections)):
+        lost = sorted(word for word in before if word not in after)
+        if lost:
+            failures.append(f"{rule_name} lost words of section {index}: {', '.join(lost[:10])}")
+    return failures
+
+
+def check_page_lines(text: str, compacted: str) -> list[str]:
+    """Every line of every page is kept in order, except the edge lines page furniture removal may drop."""
+    pages, compacted_pages = text.split('\f'), compacted.split('\f')
+    if len(pages) != len(compacted_pages):
+        return [f"strip_page_furniture changed the page count: {len(pages)} -> {len(compacted_pages)}"]
+    remaining = Counter(line.strip() for line in compacted.split('\n') if line.strip())
+    failures = []
+    for page_number, (page, compacted_page) in enumerate(zip(pages, compacted_pages), start=1):
+        lines = [line.strip() for line in page.split('\n') if line.strip()]
+        kept = [line.strip() for line in compacted_page.split('\n') if line.strip()]
+        # Lines not matched, in order, by a kept line are the removed ones; the last copies of a value are
+        # taken as removed, so a value removed from the bottom edge does not count as removed from the body
+        removed = []
+        position = len(kept) - 1
+        for i in range(len(lines) - 1, -1, -1):
+            if position >= 0 and lines[i] == kept[position]:
+                position -= 1
+            else:
+                removed.append(i)
+        if position >= 0:
+            failures.append(f"strip_page_furniture changed lines on page {page_number}")
+            continue
+        for i in removed:
+            edge_index = min(i, len(lines) - 1 - i)
+            if edge_index >= PAGE_FURNITURE_EDGE_LINES:
+                failures.append(f"strip_page_furniture removed a body line on page {page_number}: {lines[i]!r}")
+            elif not (edge_index == 0 and _PAGE_NUMBER_PATTERN.match(lines[i])) and not remaining[lines[i]]:
+                failures.append(f"strip_page_furniture removed every occurrence of {lines[i]!r}")
+    return failures
+
+
+def check_rules(markdown: str) -> list[str]:
+    """Applies the rules one at a time and returns a description of every guarantee that does not hold."""
+    failures = []
+    text = markdown
+    for rule_name in DEFAULT_COMPACTION_RULES:
+        compacted, _ = compact_markdown(text, {rule_name: True})
+        lost = words(text) - words(compacted)
+        if rule_name == "drop_images":
+            allowed = words(" ".join(target + " " + alt for alt, target in _IMAGE_TARGET_PATTERN.findall(text)))
+            unexpected = lost - allowed
+        elif rule_name == "unlink_internal_references":
+            unexpected = lost - words(" ".join(_BOOKMARK_TARGET_PATTERN.findall(text)))
+        elif rule_name == "strip_page_furniture":
+            failures += check_page_lines(text, compacted)
+            unexpected = Counter()
+        elif rule_name == "dedupe_boilerplate":
+            failures += check_section_words(rule_name, text, compacted)
+            unexpected = Counter()
+        else:
+            unexpected = lost
+        if unexpected:
+            failures.append(f"{rule_name} lost words: {', '.join(sorted(unexpected)[:10])}")
+        text = compacted
+    return failures
+
+
+def check_structure(markdown: str) -> list[str]:
+    compacted, _ = compact_markdown(markdown)
+    failures = []
+    if [title for _, _, title in find_headings(markdown)] != [title for _, _, title in find_headings(compacted)]:
+        failures.append("heading structure changed")
+    before, after = analyze_document_structure(markdown), analyze_document_structure(compacted)
+    if (before.document_type, before.needs_model) != (after.document_type, after.needs_model):
+        failures.append(f"pre-classification changed: {before.document_type}/{before.needs_model} -> {after.document_type}/{after.needs_model}")
+    split_before, split_after = split_document_by_headings(markdown), split_document_by_headings(compacted)
+    titles_before = [chunk.item_title for chunk in split_before] if split_before else None
+    titles_after = [chunk.item_title for chunk in split_after] if split_after else None
+    if titles_before != titles_after:
+        failures.append("local heading split changed")
+    return failures
+
+
+def extracted_items(nested_data: dict, schema_node: dict, path: str = "") -> Counter:
+    """Items per object type, identified by their normalized title or name."""
+    items = Counter()
+    if not isinstance(nested_data, dict):
+        return items
+    for child in schema_node.get('children', []):
+        for item in nested_data.get(child['name']) or []:
+            identity = next((normalize_text(item[field]) for field in ("title", "name") if isinstance(item.get(field), str)), "")
+            items[f"{path}{child['name']}:{identity}"] += 1
+            items.update(extracted_items(item, child, f"{path}{child['name']}/"))
+    return items
+
+
+def check_extraction(case: dict) -> list[str]:
+    from src.ai_client import get_ai_client
+    from src.openai_extractor import extract_data_windowed
+    from src.schema_processor import process_template_hierarchically
+
+    with open(os.path.join(TEMPLATES_DIR, case["template"]), 'r', encoding='utf-8') as f:
+        package = process_template_hierarchically(json.load(f))
+    with open(os.path.join(DOCUMENTS_DIR, case["document"]), 'rb') as f:
+        markdown = convert_file_to_markdown(f.read(), case["document"], use_cache=False)
+    tree = package['schema_tree']
+    ai_client = get_ai_client()
+    results = {}
+    for variant, text in (("raw", markdown), ("compacted", compact_markdown(markdown)[0])):
+        nested = extract_data_windowed(ai_client, text, package)
+        if "error" in nested:
+            return [f"{variant} extraction failed: {nested['error']}"]
+        results[variant] = extracted_items(nested.get(tree['name']), tree)
+    missing, added = results["raw"] - results["compacted"], results["compacted"] - results["raw"]
+    failures = []
+    if missing:
+        failures.append(f"items only extracted without compaction: {', '.join(sorted(missing)[:10])}")
+    if added:
+        failures.append(f"items only extracted with compaction: {', '.join(sorted(added)[:10])}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that markdown compaction does not change extraction results.")
+    parser.add_argument("--live", action="store_true", help="Also compare model extractions of the benchmark suite (costs API calls).")
+    args = parser.parse_args()
+
+    failed = False
+    for case_name, case in (("page furniture case", FURNITURE_CASE), ("boilerplate case", BOILERPLATE_CASE)):
+        failures = check_rules(case)
+        failed = failed or bool(failures)
+        print(f"{case_name}: {'; '.join(failures) or 'ok'}", file=sys.stderr)
+    print(f"{'document':<50} {'tokens':>8} {'compacted':>10} {'saved':>7}  result", file=sys.stderr)
+    for path in discover_input_files(DOCUMENTS_DIR):
+        with open(path, 'rb') as f:
+            markdown = convert_file_to_markdown(f.read(), os.path.basename(path), use_cache=False)
+        _, stats = compact_markdown(markdown)
+        failures = check_rules(markdown) + check_structure(markdown)
+        failed = failed or bool(failures)
+        saved = stats["tokensRemoved"] / stats["tokensBefore"] if stats["tokensBefore"] else 0.0
+        print(f"{os.path.basename(path)[:50]:<50} {stats['tokensBefore']:>8} {stats['tokensAfter']:>10} {saved:>6.1%}  "
+              f"{'; '.join(failures) or 'ok'}", file=sys.stderr)
+
+    if args.live:
+        with open(SUITE_PATH, 'r', encoding='utf-8') as f:
+            cases = json.load(f)["cases"]
+        for case in cases:
+            failures = check_extraction(case)
+            failed = failed or bool(failures)
+            print(f"{case['document'][:40]} x {case['template'][:30]}: {'; '.join(failures) or 'same items'}", file=sys.stderr)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
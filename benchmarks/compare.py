@@ -0,0 +1,72 @@
+"""
+Compares two benchmark result files (see benchmarks/run.py), case by case:
+
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+
+Times of repeated runs are reduced to their median before comparing.
+"""
+import sys
+import json
+import argparse
+from statistics import median
+
+METRICS = ("wallSeconds", "cpuSeconds", "peakMemoryBytes")
+
+
+def load_cases(path: str) -> tuple:
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    cases = {}
+    for run in data["runs"]:
+        key = (run["document"], run["template"])
+        case = cases.setdefault(key, {"stages": {}, "steps": {}, "dmazeObjectCount": run["dmazeObjectCount"]})
+        for group in ("stages", "steps"):
+            for name, stats in run.get(group, {}).items():
+                for metric in METRICS:
+                    if metric in stats:
+                        case[group].setdefault(name, {}).setdefault(metric, []).append(stats[metric])
+    for case in cases.values():
+        for group in ("stages", "steps"):
+            case[group] = {name: {metric: median(values) for metric, values in stats.items()} for name, stats in case[group].items()}
+    return data, cases
+
+
+def format_change(old: float, new: float) -> str:
+    if not old:
+        return "n/a"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--steps", action="store_true", help="Also compare the individual pipeline steps.")
+    args = parser.parse_args()
+
+    baseline_data, baseline = load_cases(args.baseline)
+    candidate_data, candidate = load_cases(args.candidate)
+    print(f"baseline  {baseline_data.get('gitCommit') or '?'}  ({baseline_data['createdAt']})")
+    print(f"candidate {candidate_data.get('gitCommit') or '?'}  ({candidate_data['createdAt']})\n")
+
+    for key in sorted(baseline.keys() & candidate.keys()):
+        old_case, new_case = baseline[key], candidate[key]
+        print(f"{key[0]}  [{key[1]}]")
+        if old_case["dmazeObjectCount"] != new_case["dmazeObjectCount"]:
+            print(f"  ! object count changed: {old_case['dmazeObjectCount']} -> {new_case['dmazeObjectCount']}")
+        groups = ("stages", "steps") if args.steps else ("stages",)
+        for group in groups:
+            for name in sorted(old_case[group].keys() & new_case[group].keys()):
+                old_stats, new_stats = old_case[group][name], new_case[group][name]
+                parts = [f"{metric} {old_stats[metric]:.4g} -> {new_stats[metric]:.4g} ({format_change(old_stats[metric], new_stats[metric])})"
+                         for metric in METRICS if metric in old_stats and metric in new_stats]
+                print(f"  {name:<40} " + "  ".join(parts))
+        print()
+
+    missing = sorted(baseline.keys() ^ candidate.keys())
+    if missing:
+        print(f"Cases present in only one file: {', '.join(document for document, _ in missing)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Checks how per-window extractions (openai_extractor.merge_window_results) and the section extractions of an
+incremental import (incremental_import.merge_section_results) are combined, offline:
+
+    python -m benchmarks.merge_check
+
+  - distinct items that share a title, within one window or across windows, all survive with their own children;
+  - an item repeated in the text two adjacent windows share is merged into one, keeping the children of both copies;
+  - same-titled items repeated in the shared text are matched one to one;
+  - same-titled items of different top-level sections are all kept;
+  - an item split across the sub-sections of a large section is merged into one, its children under it.
+The exit status is 1 when any check fails.
+"""
+import sys
+import copy
+
+from src.incremental_import import merge_section_results
+from src.openai_extractor import merge_window_results
+
+SCHEMA_TREE = {
+    "name": "ros",
+    "fields": [{"fieldname": "title"}],
+    "children": [{
+        "name": "risks",
+        "fields": [{"fieldname": "title"}, {"fieldname": "description"}],
+        "children": [{"name": "measures", "fields": [{"fieldname": "title"}], "children": []}],
+    }],
+}
+
+
+def risk(title: str, description: str, *measures: str) -> dict:
+    return {"title": title, "description": description, "measures": [{"title": measure} for measure in measures]}
+
+
+def window(*risks: dict, title: str = None) -> dict:
+    return {"ros": {"title": title, "risks": list(risks)}}
+
+
+def summarize(merged: dict) -> list:
+    return [(item["description"], [measure["title"] for measure in item["measures"]]) for item in merged["ros"]["risks"]]
+
+
+def section(*heading_path: str) -> dict:
+    return {"heading": heading_path[-1] if heading_path else None, "headingPath": list(heading_path)}
+
+
+def check(name: str, windows: list, overlap_texts: list, expected: list, sections: list = None) -> list[str]:
+    if sections is None:
+        merged = merge_window_results(copy.deepcopy(windows), SCHEMA_TREE, overlap_texts)
+    else:
+        merged = merge_section_results(copy.deepcopy(windows), sections, SCHEMA_TREE)
+    actual = summarize(merged)
+    return [] if actual == expected else [f"{name}: expected {expected}, got {actual}"]
+
+
+def main():
+    failures = []
+    failures += check(
+        "same-titled siblings outside the overlap",
+        [window(risk("Flom", "Flom i sentrum", "Voll"), risk("Flom", "Flom i Ottestad", "Pumpe")),
+         window(risk("Flom", "Flom ved skolen", "Varsling"))],
+        [None, "Skred\nRasfare langs fylkesvegen."],
+        [("Flom i sentrum", ["Voll"]), ("Flom i Ottestad", ["Pumpe"]), ("Flom ved skolen", ["Varsling"])])
+    failures += check(
+        "same-titled siblings without overlap texts",
+        [window(risk("Flom", "Flom i sentrum", "Voll"), risk("Flom", "Flom i Ottestad", "Pumpe")),
+         window(risk("Flom", "Flom ved skolen", "Varsling"))],
+        None,
+        [("Flom i sentrum", ["Voll"]), ("Flom i Ottestad", ["Pumpe"]), ("Flom ved skolen", ["Varsling"])])
+    failures += check(
+        "item repeated in the shared text",
+        [window(risk("Brann", "Brann i skolen", "Sprinkler"), risk("Skred", "Rasfare", "Sikring")),
+         window(risk("Skred", "", "Sikring", "Overvaking"), risk("Storm", "Vindskade", "Varsling"))],
+        [None, "## Skred\nRasfare langs fylkesvegen. Tiltak: Sikring."],
+        [("Brann i skolen", ["Sprinkler"]), ("Rasfare", ["Sikring", "Overvaking"]), ("Vindskade", ["Varsling"])])
+    failures += check(
+        "same-titled items repeated in the shared text",
+        [window(risk("Flom", "Flom i sentrum", "Voll"), risk("Flom", "Flom i Ottestad", "Pumpe")),
+         window(risk("Flom", "", "Voll"), risk("Flom", "", "Pumpe"), risk("Flom", "Flom ved skolen", "Varsling"))],
+        [None, "Flom i sentrum: Voll. Flom i Ottestad: Pumpe."],
+        [("Flom i sentrum", ["Voll"]), ("Flom i Ottestad", ["Pumpe"]), ("Flom ved skolen", ["Varsling"])])
+    failures += check(
+        "same-titled items in different sections",
+        [window(risk("Flom", "Flom i sentrum", "Voll"), title="ROS"),
+         window(risk("Flom", "Flom i Ottestad", "Voll"), risk("Skred", "Rasfare", "Sikring")),
+         window(risk("Flom", "Flom ved skolen", "Voll"), title="Other")],
+        None,
+        [("Flom i sentrum", ["Voll"]), ("Flom i Ottestad", ["Voll"]), ("Rasfare", ["Sikring"]), ("Flom ved skolen", ["Voll"])],
+        sections=[section("Flom"), section("Flom"), section("Skred")])
+    failures += check(
+        "item split across two sub-sections",
+        [window(risk("Flom", "Flom i sentrum"), title="ROS"),
+         window(risk("Flom", None, "Voll", "Pumpe")),
+         window(risk("Flom", None, "Varsling"), risk("Skred", "Rasfare", "Sikring")),
+         window(risk("Storm", "Vindskade", "Varsling"))],
+        None,
+        [("Flom i sentrum", ["Voll", "Pumpe", "Varsling"]), ("Rasfare", ["Sikring"]), ("Vindskade", ["Varsling"])],
+        sections=[section("Risiko 1: Flom"), section("Risiko 1: Flom", "Tiltak"), section("Risiko 1: Flom", "Varsling"),
+                  section("Risiko 2: Storm")])
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    print(f"merge checks: {'ok' if not failures else f'{len(failures)} failed'}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
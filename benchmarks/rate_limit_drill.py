@@ -0,0 +1,79 @@
+"""
+Drives many concurrent AIClient calls against a local fake OpenAI server that injects 429s and latency,
+and reports how the request scheduler coped (throttles, backoff, queue wait versus model latency):
+
+    python -m benchmarks.rate_limit_drill --calls 200 --workers 32 --throttle-rate 0.2 --latency 0.3
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from openai import OpenAI
+
+from src.ai_client import AIClient
+from src.models import DocumentAnalysis
+from src.fake_openai_server import FakeOpenAIState, create_fake_openai_server
+from src.rate_limiter import AdaptiveConcurrencyLimiter, RequestScheduler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rate limiting drill against a fake OpenAI server.")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=32, help="Threads issuing calls at the same time.")
+    parser.add_argument("--throttle-rate", type=float, default=0.2)
+    parser.add_argument("--retry-after", type=float, default=0.5)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--requests-per-minute", type=int, default=3000)
+    parser.add_argument("--tokens-per-minute", type=int, default=2_000_000)
+    parser.add_argument("--initial-concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    state = FakeOpenAIState(throttle_rate=args.throttle_rate, retry_after=args.retry_after, latency=args.latency,
+                            latency_jitter=args.latency / 2, seed=1)
+    server = create_fake_openai_server(port=0, state=state)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    limits = {"default": {"requestsPerMinute": args.requests_per_minute, "tokensPerMinute": args.tokens_per_minute}}
+    scheduler = RequestScheduler(limits, backoff_base_seconds=0.25,
+                                 concurrency=AdaptiveConcurrencyLimiter(initial=args.initial_concurrency, maximum=64))
+    ai_client = AIClient(OpenAI(api_key="fake", base_url=base_url), scheduler=scheduler)
+
+    def call(i: int):
+        try:
+            ai_client.get_structured_response(system_prompt="Classify the document.", user_prompt=f"Document {i}: " + "text " * 200,
+                                              response_model=DocumentAnalysis, step_name="drill")
+            return True
+        except Exception:
+            return False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        outcomes = list(executor.map(call, range(args.calls)))
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    totals = ai_client.usage.snapshot()["totals"]
+    report = {
+        "calls": args.calls,
+        "succeeded": sum(outcomes),
+        "failed": args.calls - sum(outcomes),
+        "wallSeconds": round(elapsed, 3),
+        "serverRequests": state.requests,
+        "serverThrottled": state.throttled,
+        "serverMaxInFlight": state.max_in_flight,
+        "finalConcurrencyLimit": round(scheduler.concurrency.limit, 2),
+        "throttlesSeen": totals["throttles"],
+        "validationRetries": totals["retries"],
+        "modelLatencySeconds": totals["latencySeconds"],
+        "queueWaitSeconds": totals["queueWaitSeconds"],
+        "backoffSeconds": totals["backoffSeconds"],
+    }
+    print(json.dumps(report, indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Offline benchmark of the import pipeline over the documents and templates listed in benchmarks/suite.json.
+
+Model responses come from cassettes (benchmarks/cassettes/<document>__<template>.json):
+
+    python -m benchmarks.run --mode record    # once, with OPENAI_API_KEY set: runs against the API and stores responses
+    python -m benchmarks.run                  # replay: deterministic, no network access
+    python -m benchmarks.compare old.json new.json
+
+For each case the harness reports wall time, CPU time and peak traced memory for template compilation,
+document conversion and the full pipeline, plus wall/CPU time per pipeline step (from the trace spans)
+and object counts. Results are written as JSON to benchmarks/results/.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from datetime import datetime
+
+# Persistent caches would make runs depend on earlier runs, so every benchmark process gets its own
+_cache_root = tempfile.mkdtemp(prefix="dmaze-benchmark-")
+os.environ["DMAZE_CONVERSION_CACHE_DIR"] = os.path.join(_cache_root, "conversions")
+os.environ["DMAZE_SCHEMA_CACHE_DIR"] = os.path.join(_cache_root, "schema_packages")
+os.environ["DMAZE_RESOLUTION_CACHE_PATH"] = os.path.join(_cache_root, "entity_resolution.sqlite")
+
+from src.cassette import Cassette, CassetteAIClient
+from src.document_converter import convert_file_to_markdown
+from src.document_processor import DocumentProcessor
+from src.resolution_cache import get_resolution_cache
+from src.result_writer import sanitize_filename
+from src.schema_processor import compile_template, process_template_hierarchically
+from src.tracing import Tracer
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+SUITE_PATH = os.path.join(BENCHMARK_DIR, "suite.json")
+CASSETTE_DIR = os.path.join(BENCHMARK_DIR, "cassettes")
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+DOCUMENTS_DIR = os.path.join(REPO_DIR, "input_documents")
+TEMPLATES_DIR = os.path.join(REPO_DIR, "input-schemas")
+
+
+def measure(function_to_run, trace_memory: bool = True) -> tuple:
+    """Runs the function once and returns (result, {wallSeconds, cpuSeconds, peakMemoryBytes})."""
+    if trace_memory:
+        tracemalloc.start()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        result = function_to_run()
+    finally:
+        stats = {"wallSeconds": round(time.perf_counter() - wall_start, 4), "cpuSeconds": round(time.process_time() - cpu_start, 4)}
+        if trace_memory:
+            stats["peakMemoryBytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return result, stats
+
+
+def step_times_from_trace(tracer: Tracer) -> dict:
+    """Sums wall and CPU time per span name; per-chunk step names are reduced to the step itself."""
+    steps = {}
+    for span in tracer.spans:
+        name = span.name.split(" for '")[0].strip()
+        step = steps.setdefault(name, {"count": 0, "wallSeconds": 0.0, "cpuSeconds": 0.0})
+        step["count"] += 1
+        step["wallSeconds"] += span.duration_seconds
+        step["cpuSeconds"] += span.cpu_seconds
+    return {name: {**step, "wallSeconds": round(step["wallSeconds"], 4), "cpuSeconds": round(step["cpuSeconds"], 4)}
+            for name, step in steps.items()}
+
+
+def cassette_path(document: str, template: str) -> str:
+    name = f"{sanitize_filename(os.path.splitext(document)[0])}__{sanitize_filename(os.path.splitext(template)[0])}.json"
+    return os.path.join(CASSETTE_DIR, name)
+
+
+def run_case(case: dict, mode: str, openai_client, trace_memory: bool) -> dict:
+    document, template = case["document"], case["template"]
+    with open(os.path.join(TEMPLATES_DIR, template), 'r', encoding='utf-8') as f:
+        schema_content = json.load(f)
+    document_path = os.path.join(DOCUMENTS_DIR, document)
+    report = {"document": document, "template": template, "inputBytes": os.path.getsize(document_path), "stages": {}}
+
+    _, report["stages"]["templateCompilation"] = measure(lambda: compile_template(schema_content), trace_memory)
+    markdown, report["stages"]["conversion"] = measure(
+        lambda: convert_file_to_markdown(document_path, document, use_cache=False), trace_memory)
+    report["markdownChars"] = len(markdown)
+
+    cassette = Cassette(cassette_path(document, template))
+    ai_client = CassetteAIClient(cassette, mode=mode, client=openai_client)
+    get_resolution_cache().clear()
+    tracer = Tracer()
+    processor = DocumentProcessor(
+        schema_content=schema_content,
+        document=document_path,
+        document_filename=document,
+        use_conversion_cache=False,
+        ai_client=ai_client,
+        schema_package=process_template_hierarchically(schema_content),
+        tracer=tracer
+    )
+    results, report["stages"]["pipeline"] = measure(processor.run, trace_memory)
+    if mode == "record":
+        cassette.save()
+
+    summaries = [result["summary"] for result in results]
+    report["steps"] = step_times_from_trace(tracer)
+    report["results"] = len(results)
+    report["statuses"] = [summary["overallStatus"] for summary in summaries]
+    report["dmazeObjectCount"] = sum(summary.get("dmazeObjectCount", 0) for summary in summaries)
+    report["warningCount"] = sum(len(summary.get("warningsEncountered", [])) for summary in summaries)
+    report["errors"] = sorted({error for summary in summaries for error in summary.get("errorsEncountered", [])})
+    report["llmUsage"] = ai_client.usage.snapshot()["totals"]
+    return report
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the document import pipeline.")
+    parser.add_argument("--mode", choices=("replay", "record"), default="replay",
+                        help="'record' calls the OpenAI API and stores the responses; 'replay' serves them from the cassettes.")
+    parser.add_argument("--only", default=None, help="Only run cases whose document name contains this text.")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of times each case is run (replay mode).")
+    parser.add_argument("--no-memory", action="store_true", help="Skip tracemalloc, which slows Python code down noticeably.")
+    parser.add_argument("--output", default=None, help="Result file (default: benchmarks/results/<timestamp>.json).")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with open(SUITE_PATH, 'r', encoding='utf-8') as f:
+        cases = [case for case in json.load(f)["cases"] if not args.only or args.only in case["document"]]
+
+    openai_client = None
+    if args.mode == "record":
+        from src.ai_client import create_openai_client
+        openai_client = create_openai_client()
+    repeat = 1 if args.mode == "record" else max(1, args.repeat)
+
+    runs = []
+    for case in cases:
+        for iteration in range(repeat):
+            print(f"=== {case['document']} x {case['template']} (run {iteration + 1}/{repeat}) ===", file=sys.stderr)
+            report = run_case(case, args.mode, openai_client, trace_memory=not args.no_memory)
+            report["iteration"] = iteration + 1
+            runs.append(report)
+
+    output = {
+        "createdAt": datetime.now().isoformat(),
+        "gitCommit": git_commit(),
+        "mode": args.mode,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "memoryTraced": not args.no_memory,
+        "runs": runs,
+    }
+    output_path = args.output or os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(output, f, indent=2, ensure_ascii=False)
+
+    print(f"\n{'document':<50} {'pipeline s':>10} {'cpu s':>8} {'peak MB':>8} {'objects':>8}", file=sys.stderr)
+    for report in runs:
+        pipeline = report["stages"]["pipeline"]
+        peak = pipeline.get("peakMemoryBytes")
+        print(f"{report['document'][:50]:<50} {pipeline['wallSeconds']:>10.3f} {pipeline['cpuSeconds']:>8.3f} "
+              f"{(peak / 1e6 if peak is not None else float('nan')):>8.1f} {report['dmazeObjectCount']:>8}", file=sys.stderr)
+    print(f"\nResults written to '{output_path}'.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
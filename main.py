@@ -1,65 +1,110 @@
 import os
 import json
-import re
+import argparse
+from contextlib import nullcontext
 
+from src.ai_client import bypass_response_cache, load_environment
 from src.document_processor import DocumentProcessor
+from src.batch_processor import process_batch
+from src.markdown_compactor import DEFAULT_COMPACTION_RULES
+from src.import_service import DEFAULT_SERVICE_WORKERS, serve
+from src.tracing import Tracer
+from src.result_writer import OUTPUT_FORMATS, save_results_as_json, ndjson_writer_factory, finish_ndjson_results
 
-def sanitize_filename(name: str) -> str:
-    """Sanitize a string so it is a valid file name."""
-    if not name:
-        return ""
-    name = re.sub(r'[<>:"/\\|?*]', '', name)
-    return name[:100].strip()
+DEFAULT_INPUT_PATH = "input_documents/ROS-Analyse_Stange_kommune_2023-2027__word.docx"
+DEFAULT_TEMPLATE_PATH = "input-schemas/Risk Assessment - Enterprise Risk Assessment.json"
 
-if __name__ == "__main__":
-    # --- Part 1: Define input files ---
-    input_doc_path = "input_documents/ROS-Analyse_Stange_kommune_2023-2027__word.docx"
-    template_path = "input-schemas/Risk Assessment - Enterprise Risk Assessment.json"
-    output_dir = "output"
-    os.makedirs(output_dir, exist_ok=True)
-    
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import documents into the Dmaze format.")
+    parser.add_argument("--input", default=DEFAULT_INPUT_PATH,
+                        help="A document, a directory of documents or a glob pattern (quote it in the shell).")
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE_PATH, help="Path to the template JSON file.")
+    parser.add_argument("--output-dir", default="output", help="Folder the results are written to.")
+    parser.add_argument("--workers", type=int, default=4, help="Number of documents processed in parallel in batch mode.")
+    parser.add_argument("--manifest", default=None, help="Batch manifest path (default: <output-dir>/manifest.json).")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="json",
+                        help="'json' writes one pretty-printed file per result; 'ndjson' (optionally gzip-compressed) "
+                             "streams one Dmaze object per line with the summary as the last line.")
+    parser.add_argument("--trace-dir", default=None,
+                        help="Write a Chrome trace (.trace.json) and an OTLP JSON trace (.otlp.json) per document to this folder.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Re-extract only the sections that changed since the previous import of the same file with the same template.")
+    parser.add_argument("--no-compaction", action="store_true",
+                        help="Send the converted markdown to the model as is, without the compaction stage.")
+    parser.add_argument("--speculative-extraction", action="store_true",
+                        help="Start extracting a document as a single item while the model classifies it; "
+                             "the summary reports the time saved and the tokens wasted.")
+    parser.add_argument("--llm-cache", action="store_true",
+                        help="Answer repeated model requests from the on-disk response cache (same as DMAZE_LLM_CACHE=1).")
+    parser.add_argument("--refresh-llm-cache", action="store_true",
+                        help="Send every request to the model even if a cached response exists, and update the cache.")
+    parser.add_argument("--serve", action="store_true",
+                        help="Run the resident import service (see src/import_service.py) instead of processing --input.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address the import service listens on.")
+    parser.add_argument("--port", type=int, default=8080, help="Port the import service listens on.")
+    parser.add_argument("--service-workers", type=int, default=DEFAULT_SERVICE_WORKERS,
+                        help="Number of documents the import service processes in parallel.")
+    return parser.parse_args()
+
+
+def run_single(input_doc_path: str, template_path: str, output_dir: str, output_format: str = "json", trace_dir: str = None,
+               incremental: bool = False, compaction: bool = True, speculative_extraction: bool = False):
     print("--- Running in CLI test mode ---")
 
-    # --- Part 2: Read files into memory ---
+    # --- Part 1: Read the template; the document is converted straight from disk ---
     try:
         with open(template_path, 'r', encoding='utf-8') as f:
             schema_data = json.load(f)
-        with open(input_doc_path, 'rb') as f:
-            doc_bytes = f.read()
+        os.stat(input_doc_path)
     except FileNotFoundError as e:
         print(f"ERROR: {e}")
         exit()
 
-    # --- Part 3: Create and run the processor ---
+    # --- Part 2: Create and run the processor ---
     print(f"Processing document '{input_doc_path}'...")
     processor = DocumentProcessor(
         schema_content=schema_data,
-        document_bytes=doc_bytes,
-        document_filename=os.path.basename(input_doc_path)
+        document=input_doc_path,
+        document_filename=os.path.basename(input_doc_path),
+        tracer=Tracer() if trace_dir else None,
+        incremental=incremental,
+        compaction_rules=DEFAULT_COMPACTION_RULES if compaction else None,
+        speculative_extraction=speculative_extraction
     )
-    results = processor.run()  # Now receives a LIST of results
+    if output_format == "json":
+        results = processor.run()  # Now receives a LIST of results
 
-    # --- Part 4: Handle and save results ---
-    print(f"\n--- Processing returned {len(results)} result(s). Saving to output folder... ---")
-    
-    for i, result in enumerate(results):
-        summary = result.get("summary", {})
-        item_title = summary.get("itemTitle")
-        
-        # Build a unique and safe filename
-        base_name = sanitize_filename(item_title) if item_title else os.path.splitext(os.path.basename(input_doc_path))[0]
-        # Add a counter if there are multiple results or no title
-        if len(results) > 1 and not item_title:
-             output_filename = f"{base_name}_item_{i+1}_dmaze_import.json"
-        elif len(results) > 1:
-            output_filename = f"{base_name}_{i+1}_dmaze_import.json"
-        else:
-            output_filename = f"{base_name}_dmaze_import.json"
+        # --- Part 3: Handle and save results ---
+        print(f"\n--- Processing returned {len(results)} result(s). Saving to output folder... ---")
+        save_results_as_json(results, input_doc_path, output_dir)
+    else:
+        # Results are streamed to disk while they are produced
+        compress = output_format == "ndjson.gz"
+        results = processor.run(result_writer_factory=ndjson_writer_factory(input_doc_path, output_dir, compress))
+        finish_ndjson_results(results, input_doc_path, output_dir, compress)
+
+    if trace_dir:
+        trace_paths = processor.tracer.export(trace_dir, os.path.basename(input_doc_path))
+        print(f"  - Trace written to '{trace_paths['chrome']}' and '{trace_paths['otlp']}'")
 
-        output_path = os.path.join(output_dir, output_filename)
-        
-        print(f"  - Saving result to '{output_path}'")
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(result, f, indent=4, ensure_ascii=False)
+    print("\n--- Processing is complete. ---")
 
-    print("\n--- Processing is complete. ---")
\ No newline at end of file
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.llm_cache:
+        os.environ["DMAZE_LLM_CACHE"] = "1"
+    load_environment()
+    if args.serve:
+        serve(args.host, args.port, args.service_workers, speculative_extraction=args.speculative_extraction)
+        exit()
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    with bypass_response_cache() if args.refresh_llm_cache else nullcontext():
+        if os.path.isfile(args.input):
+            run_single(args.input, args.template, args.output_dir, args.format, args.trace_dir, args.incremental,
+                       not args.no_compaction, args.speculative_extraction)
+        else:
+            process_batch(args.input, args.template, args.output_dir, workers=args.workers, manifest_path=args.manifest,
+                          output_format=args.format, trace_dir=args.trace_dir, incremental=args.incremental,
+                          compaction=not args.no_compaction, speculative_extraction=args.speculative_extraction)
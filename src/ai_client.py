@@ -1,16 +1,172 @@
+import os
 import instructor
 import json
+import time
+import hashlib
+import threading
+import httpx
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dotenv import load_dotenv
 from openai import OpenAI
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
+from tenacity import Retrying, retry_if_exception_type, stop_after_attempt
 from typing import Type, Optional, Dict, Any
 
+from .disk_cache import LruDiskCache
+from .llm_usage import UsageRecorder, current_step, estimate_cost, record_call
+from .rate_limiter import RequestScheduler, get_request_scheduler
+from .token_counter import count_tokens
+from .tracing import span, set_span_attributes
+
+# Output tokens reserved in the rate limiter per call, on top of the counted prompt
+EXPECTED_COMPLETION_TOKENS = 1000
+
+# HTTP settings of the shared OpenAI client. Extraction calls on large documents can run for minutes.
+# Overridden by DMAZE_OPENAI_TIMEOUT_SECONDS, DMAZE_OPENAI_CONNECT_TIMEOUT_SECONDS, DMAZE_OPENAI_MAX_CONNECTIONS and
+# DMAZE_OPENAI_KEEPALIVE_SECONDS, read when the client is created so that values from .env apply.
+DEFAULT_OPENAI_TIMEOUT_SECONDS = 600.0
+DEFAULT_OPENAI_CONNECT_TIMEOUT_SECONDS = 10.0
+DEFAULT_OPENAI_MAX_CONNECTIONS = 64
+DEFAULT_OPENAI_KEEPALIVE_SECONDS = 120.0
+
+# Opt-in cache of validated model responses, for re-importing unchanged documents (e.g. while tuning templates).
+# Bump the version when the stored format or the meaning of a cached response changes.
+# Location and size are overridden by DMAZE_LLM_CACHE_DIR and DMAZE_LLM_CACHE_MAX_BYTES, read when the cache is created.
+LLM_RESPONSE_CACHE_VERSION = "1"
+DEFAULT_LLM_RESPONSE_CACHE_DIR = os.path.join(".cache", "llm_responses")
+DEFAULT_LLM_RESPONSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Set inside bypass_response_cache(): calls skip the cache lookup but still store their fresh result
+_response_cache_bypassed: ContextVar[bool] = ContextVar("ai_client_response_cache_bypassed", default=False)
+
+# Set inside cancel_calls_on(event): once the event is set, calls of this context are no longer sent
+_cancel_event: ContextVar[Optional[threading.Event]] = ContextVar("ai_client_cancel_event", default=None)
+
+# Usage of the call in progress in this context, one entry per attempt (filled in by the instructor hooks)
+_attempt_usages: ContextVar[Optional[list]] = ContextVar("ai_client_attempt_usages", default=None)
+
+
+def _usage_from_completion(completion) -> dict:
+    usage = getattr(completion, "usage", None)
+    if usage is None:
+        return {"promptTokens": 0, "completionTokens": 0, "cachedTokens": 0}
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "promptTokens": usage.prompt_tokens or 0,
+        "completionTokens": usage.completion_tokens or 0,
+        "cachedTokens": (getattr(details, "cached_tokens", None) or 0) if details else 0,
+    }
+
+def request_key(system_prompt: str, user_prompt: str, model: str, response_model: Optional[Type[BaseModel]],
+                response_format_options: Optional[Dict[str, Any]], version: str = None) -> str:
+    """
+    Hash of everything that determines a model response: model, prompts and the response model schema or response
+    format. Keys both the response cache and recorded cassettes; `version` (if given) separates stored formats.
+    """
+    request = {
+        "model": model,
+        "system": system_prompt,
+        "user": user_prompt,
+        "responseModel": [response_model.__name__, response_model.model_json_schema()] if response_model else None,
+        "responseFormat": response_format_options,
+    }
+    if version is not None:
+        request["version"] = version
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def response_cache_key(system_prompt: str, user_prompt: str, model: str, response_model: Optional[Type[BaseModel]],
+                       response_format_options: Optional[Dict[str, Any]]) -> str:
+    """The request_key of a response in the response cache."""
+    return request_key(system_prompt, user_prompt, model, response_model, response_format_options, LLM_RESPONSE_CACHE_VERSION)
+
+
+@contextmanager
+def bypass_response_cache():
+    """Calls made inside the block go to the model even if a cached response exists; the cache is refreshed with the result."""
+    token = _response_cache_bypassed.set(True)
+    try:
+        yield
+    finally:
+        _response_cache_bypassed.reset(token)
+
+
+class CallCancelledError(Exception):
+    """Raised instead of sending a model call whose cancellation event (see cancel_calls_on) is set."""
+
+
+@contextmanager
+def cancel_calls_on(event: threading.Event):
+    """
+    Model calls made inside the block, including work handed to pools in a copied context, fail with
+    CallCancelledError once `event` is set, instead of being sent. Calls already sent are completed.
+    """
+    token = _cancel_event.set(event)
+    try:
+        yield
+    finally:
+        _cancel_event.reset(token)
+
+
+def _cancellation_requested() -> bool:
+    event = _cancel_event.get()
+    return event is not None and event.is_set()
+
+
+def _unless_cancelled(call):
+    """Wraps a model call so that it is checked for cancellation right before each attempt is sent."""
+    def checked_call():
+        if _cancellation_requested():
+            raise CallCancelledError("The model call was cancelled before it was sent.")
+        return call()
+    return checked_call
+
+
 class AIClient:
     """General client wrapper for handling OpenAI interactions that return structured responses."""
-    def __init__(self, client: OpenAI):
-        """Initialize by patching the provided OpenAI client with `instructor` to support structured Pydantic models."""
-        # We now store both the patched and original clients
-        self.instructor_client = instructor.patch(client)
-        self.native_client = client
+    def __init__(self, client: OpenAI, usage_recorder: UsageRecorder = None, scheduler: RequestScheduler = None,
+                 response_cache: LruDiskCache = None, keep_usage: bool = True):
+        """
+        Initialize by wrapping the provided OpenAI client with `instructor` to support structured Pydantic models.
+        Every call is recorded (model, tokens, retries, latency, estimated cost) in `usage_recorder`, which
+        covers all calls made through this client, and in any recorder activated with llm_usage.track_usage.
+        A long-lived client shared by unrelated work (see get_ai_client) is created with `keep_usage=False`:
+        it keeps no records of its own (`usage` is None) and callers collect theirs with track_usage.
+        Calls are admitted and retried by `scheduler` (rate limits, backoff, adaptive concurrency), by default
+        the process-wide one, so the OpenAI client's own retries are switched off.
+        With a `response_cache`, validated responses are stored by response_cache_key and identical
+        requests are answered from it without a model call (see bypass_response_cache).
+        """
+        # We store both the instructor-wrapped and the original client
+        self.native_client = client.with_options(max_retries=0)
+        self.instructor_client = instructor.from_openai(self.native_client)
+        self.usage = (usage_recorder or UsageRecorder()) if keep_usage else None
+        self.scheduler = scheduler or get_request_scheduler()
+        self.response_cache = response_cache
+
+        # Each attempt, including validation retries, is reported through these hooks
+        self.instructor_client.on("completion:kwargs", self._on_attempt_started)
+        self.instructor_client.on("completion:response", self._on_completion_response)
+
+    @staticmethod
+    def _on_attempt_started(*args, **kwargs):
+        attempts = _attempt_usages.get()
+        if attempts is not None:
+            attempts.append({})
+
+    @staticmethod
+    def _on_completion_response(completion):
+        attempts = _attempt_usages.get()
+        if attempts:
+            attempts[-1].update(_usage_from_completion(completion))
+
+    def _create_native(self, **kwargs):
+        self._on_attempt_started()
+        response = self.native_client.chat.completions.create(**kwargs)
+        self._on_completion_response(response)
+        return response
 
     def get_structured_response(
         self,
@@ -19,7 +175,8 @@ class AIClient:
         response_model: Optional[Type[BaseModel]] = None,
         response_format_options: Optional[Dict[str, Any]] = None,
         model: str = "gpt-4o",
-        max_retries: int = 1
+        max_retries: int = 1,
+        step_name: Optional[str] = None
     ) -> Any:
         """
         Perform a general AI call and return a structured response.
@@ -37,6 +194,7 @@ class AIClient:
             response_format_options: The response_format dictionary for native OpenAI JSON mode.
             model: Which OpenAI model to use.
             max_retries: How many times `instructor` should retry if validation fails.
+            step_name: Pipeline step the call is accounted to. Defaults to the step set with llm_usage.track_usage.
 
         Returns:
             An instance of the Pydantic model, or a dictionary if using native JSON mode.
@@ -49,32 +207,183 @@ class AIClient:
             raise ValueError("You must provide either 'response_model' or 'response_format_options'.")
         if response_model and response_format_options:
             raise ValueError("You cannot provide both 'response_model' and 'response_format_options'.")
+        if _cancellation_requested():
+            # Recorded without usage, so callers can see how many calls the cancellation saved
+            self._record_call(model, step_name or current_step(), [], 0.0, "Cancelled")
+            raise CallCancelledError("The model call was cancelled before it was sent.")
+
+        with span("llm.call", step=step_name or current_step(), model=model,
+                  mode="response_model" if response_model else "json_schema"):
+            cache_key, cache_outcome = None, None
+            if self.response_cache is not None:
+                cache_key = response_cache_key(system_prompt, user_prompt, model, response_model, response_format_options)
+                if _response_cache_bypassed.get():
+                    cache_outcome = "bypass"
+                else:
+                    cached = self._get_cached_response(cache_key, response_model)
+                    if cached is not None:
+                        self._record_call(model, step_name or current_step(), [], 0.0, "Success", cache="hit")
+                        return cached
+                    cache_outcome = "miss"
 
+            attempts = []
+            attempts_token = _attempt_usages.set(attempts)
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ]
+            estimated_tokens = count_tokens(system_prompt, model) + count_tokens(user_prompt, model) + EXPECTED_COMPLETION_TOKENS
+            scheduling = {}
+            status = "Failure"
+            try:
+                # Mode 1: Pydantic model with instructor
+                if response_model:
+                    # instructor only re-asks on invalid output; rate limits and API errors are left to the scheduler
+                    validation_retries = Retrying(stop=stop_after_attempt(max_retries),
+                                                  retry=retry_if_exception_type((ValidationError, json.JSONDecodeError)))
+                    result = self.scheduler.execute(model, estimated_tokens, _unless_cancelled(lambda: self.instructor_client.chat.completions.create(
+                        model=model,
+                        response_model=response_model,
+                        messages=messages,
+                        max_retries=validation_retries
+                    )), scheduling)
+                # Mode 2: Native JSON format
+                else:
+                    response = self.scheduler.execute(model, estimated_tokens, _unless_cancelled(lambda: self._create_native(
+                        model=model,
+                        response_format=response_format_options,
+                        messages=messages
+                    )), scheduling)
+                    # The native client returns a string that needs to be parsed
+                    result = json.loads(response.choices[0].message.content)
+                status = "Success"
+                if cache_key is not None:
+                    self._store_cached_response(cache_key, result, response_model)
+                return result
+
+            except CallCancelledError:
+                status = "Cancelled"
+                raise
+            except Exception as e:
+                print(f"  - [AI_CLIENT] CRITICAL ERROR during API call: {e}")
+                raise
+            finally:
+                _attempt_usages.reset(attempts_token)
+                record = self._record_call(model, step_name or current_step(), attempts, scheduling.get("modelSeconds", 0.0), status,
+                                           scheduling, cache_outcome)
+                self.scheduler.settle(model, estimated_tokens, record["promptTokens"] + record["completionTokens"])
+
+    def _get_cached_response(self, cache_key: str, response_model: Optional[Type[BaseModel]]) -> Any:
+        cached, _ = self.response_cache.get_with_tier(cache_key)
+        if cached is None:
+            return None
         try:
-            # Mode 1: Pydantic model with instructor
-            if response_model:
-                return self.instructor_client.chat.completions.create(
-                    model=model,
-                    response_model=response_model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    max_retries=max_retries
-                )
-            # Mode 2: Native JSON format
-            else:
-                response = self.native_client.chat.completions.create(
-                    model=model,
-                    response_format=response_format_options,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ]
-                )
-                # The native client returns a string that needs to be parsed
-                return json.loads(response.choices[0].message.content)
-
-        except Exception as e:
-            print(f"  - [AI_CLIENT] CRITICAL ERROR during API call: {e}")
-            raise
\ No newline at end of file
+            response = json.loads(cached)["response"]
+            return response_model.model_validate(response) if response_model else response
+        except (ValueError, KeyError, ValidationError):
+            # An entry the current response model no longer accepts is treated as a miss and overwritten
+            return None
+
+    def _store_cached_response(self, cache_key: str, result: Any, response_model: Optional[Type[BaseModel]]):
+        response = result.model_dump(mode="json") if response_model else result
+        self.response_cache.set(cache_key, json.dumps({"response": response}, ensure_ascii=False))
+
+    def _record_call(self, model: str, step_name: Optional[str], attempts: list, latency: float, status: str,
+                     scheduling: dict = None, cache: Optional[str] = None) -> dict:
+        """
+        Sums the usage of all attempts of one call and stores the record. `latency` is time spent in the model
+        calls only; time queued in the scheduler and backing off after errors is reported separately.
+        `cache` is the response cache outcome ('hit', 'miss' or 'bypass'), or None without a cache.
+        """
+        scheduling = scheduling or {}
+        usages = [usage for usage in attempts if usage]
+        prompt_tokens = sum(usage.get("promptTokens", 0) for usage in usages)
+        completion_tokens = sum(usage.get("completionTokens", 0) for usage in usages)
+        cached_tokens = sum(usage.get("cachedTokens", 0) for usage in usages)
+        cost = estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens)
+        record = {
+            "step": step_name,
+            "model": model,
+            "status": status,
+            "promptTokens": prompt_tokens,
+            "completionTokens": completion_tokens,
+            "cachedTokens": cached_tokens,
+            # Validation re-asks only: every scheduler attempt (see `throttles`) starts one attempt of its own
+            "retries": max(0, len(attempts) - max(scheduling.get("attempts", 0), 1)),
+            "latencySeconds": round(latency, 3),
+            "queueWaitSeconds": round(scheduling.get("queueWaitSeconds", 0.0), 3),
+            "backoffSeconds": round(scheduling.get("backoffSeconds", 0.0), 3),
+            "throttles": scheduling.get("throttles", 0),
+            "estimatedCostUsd": round(cost, 6) if cost is not None else None,
+            "cache": cache,
+        }
+        if self.usage is not None:
+            self.usage.add(record)
+        record_call(record)
+        set_span_attributes(promptTokens=prompt_tokens, completionTokens=completion_tokens, cachedTokens=cached_tokens,
+                            retries=record["retries"], throttles=record["throttles"], queueWaitSeconds=record["queueWaitSeconds"],
+                            estimatedCostUsd=record["estimatedCostUsd"], cache=cache)
+        return record
+
+
+_environment_loaded = False
+_environment_lock = threading.Lock()
+
+def load_environment():
+    """Loads .env into the process environment once; later calls do nothing."""
+    global _environment_loaded
+    with _environment_lock:
+        if not _environment_loaded:
+            load_dotenv()
+            _environment_loaded = True
+
+
+def create_openai_client(api_key: str = None, base_url: str = None, timeout: float = None, max_connections: int = None) -> OpenAI:
+    """
+    Creates an OpenAI client with a keep-alive connection pool sized for concurrent chunks and documents,
+    so connections (and their TLS sessions) are reused between calls.
+    """
+    load_environment()
+    timeout = timeout or float(os.getenv("DMAZE_OPENAI_TIMEOUT_SECONDS", DEFAULT_OPENAI_TIMEOUT_SECONDS))
+    connect_timeout = float(os.getenv("DMAZE_OPENAI_CONNECT_TIMEOUT_SECONDS", DEFAULT_OPENAI_CONNECT_TIMEOUT_SECONDS))
+    max_connections = max_connections or int(os.getenv("DMAZE_OPENAI_MAX_CONNECTIONS", DEFAULT_OPENAI_MAX_CONNECTIONS))
+    keepalive_seconds = float(os.getenv("DMAZE_OPENAI_KEEPALIVE_SECONDS", DEFAULT_OPENAI_KEEPALIVE_SECONDS))
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                            keepalive_expiry=keepalive_seconds),
+        timeout=httpx.Timeout(timeout, connect=connect_timeout),
+    )
+    return OpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"), base_url=base_url or os.getenv("OPENAI_BASE_URL"),
+                  http_client=http_client)
+
+
+_shared_ai_client = None
+_shared_ai_client_lock = threading.Lock()
+
+_llm_response_cache = None
+
+def get_llm_response_cache() -> LruDiskCache:
+    global _llm_response_cache
+    load_environment()
+    with _shared_ai_client_lock:
+        if _llm_response_cache is None:
+            _llm_response_cache = LruDiskCache(os.getenv("DMAZE_LLM_CACHE_DIR", DEFAULT_LLM_RESPONSE_CACHE_DIR),
+                                               max_disk_bytes=int(os.getenv("DMAZE_LLM_CACHE_MAX_BYTES", DEFAULT_LLM_RESPONSE_CACHE_MAX_BYTES)),
+                                               memory_items=64, suffix=".json")
+        return _llm_response_cache
+
+
+def get_ai_client() -> AIClient:
+    """
+    The process-wide AIClient, created on first use. DocumentProcessor uses it unless it is given a client.
+    The response cache is switched on with DMAZE_LLM_CACHE=1 (in the environment or .env).
+    It lives as long as the process, so it keeps no usage records; collect them with llm_usage.track_usage.
+    """
+    global _shared_ai_client
+    load_environment()
+    cache_enabled = os.getenv("DMAZE_LLM_CACHE", "").lower() in ("1", "true", "yes")
+    response_cache = get_llm_response_cache() if cache_enabled else None
+    with _shared_ai_client_lock:
+        if _shared_ai_client is None:
+            _shared_ai_client = AIClient(create_openai_client(), response_cache=response_cache, keep_usage=False)
+        return _shared_ai_client
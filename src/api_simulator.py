@@ -1,4 +1,8 @@
 # --- START OF FILE api_simulator.py ---
+import json
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
 
 # This dictionary simulates the entire Dmaze database with example data.
 SIMULATED_DATABASE = {
@@ -132,4 +136,71 @@ def get_entity_schema_from_api(entity_type: str) -> dict | None:
         "id_field": "id",
         "dmaze_format_wrapper": None
     }
-    return SIMULATED_META_DATABASE.get(entity_type.lower(), default_schema)
\ No newline at end of file
+    return SIMULATED_META_DATABASE.get(entity_type.lower(), default_schema)
+
+
+# --- Local HTTP stand-in for the Dmaze API ---
+# Serves the simulated data over HTTP so the entity catalog client can be tested without the real API.
+#   GET /entities/{type}, GET /meta/{type}      -> single type, with ETag / If-None-Match (304) support
+#   GET /entities?types=a,b&known=a:<version>   -> bulk fetch; types whose version matches 'known' are
+#   GET /meta?types=a,b&known=...                  listed under "notModified" instead of being resent
+
+def get_resource_version(resource: str, entity_type: str) -> str:
+    """Version tag of one type's entity list or metadata, derived from its content."""
+    value = get_entities_from_api(entity_type) if resource == "entities" else get_entity_schema_from_api(entity_type)
+    canonical = json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+class ApiSimulatorRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        if not parts or parts[0] not in ("entities", "meta"):
+            return self._send_json(404, {"error": f"Unknown path '{url.path}'"})
+        resource = parts[0]
+        lookup = get_entities_from_api if resource == "entities" else get_entity_schema_from_api
+
+        if len(parts) == 2:
+            entity_type = parts[1]
+            version = get_resource_version(resource, entity_type)
+            if self.headers.get("If-None-Match") == f'"{version}"':
+                return self._send_json(304, None, etag=version)
+            return self._send_json(200, lookup(entity_type), etag=version)
+
+        query = parse_qs(url.query)
+        types = [t for t in ",".join(query.get("types", [])).split(",") if t]
+        known = dict(item.split(":", 1) for item in ",".join(query.get("known", [])).split(",") if ":" in item)
+        body = {"items": {}, "versions": {}, "notModified": []}
+        for entity_type in types:
+            version = get_resource_version(resource, entity_type)
+            body["versions"][entity_type] = version
+            if known.get(entity_type) == version:
+                body["notModified"].append(entity_type)
+            else:
+                body["items"][entity_type] = lookup(entity_type)
+        return self._send_json(200, body)
+
+    def _send_json(self, status: int, body, etag: str = None):
+        payload = b"" if status == 304 else json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        if etag:
+            self.send_header("ETag", f'"{etag}"')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_api_simulator_server(host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    """Creates (but does not start) the local HTTP server. Use port 0 to pick a free port."""
+    return ThreadingHTTPServer((host, port), ApiSimulatorRequestHandler)
+
+
+if __name__ == "__main__":
+    server = create_api_simulator_server()
+    print(f"Dmaze API simulator listening on http://{server.server_address[0]}:{server.server_address[1]}")
+    server.serve_forever()
@@ -0,0 +1,186 @@
+import os
+import glob
+import json
+import time
+import hashlib
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from .ai_client import AIClient, get_ai_client
+from .document_processor import DocumentProcessor, summarize_speculation
+from .llm_usage import UsageRecorder, track_usage
+from .markdown_compactor import DEFAULT_COMPACTION_RULES
+from .schema_processor import process_template_hierarchically
+from .tracing import Tracer
+from .result_writer import sanitize_filename, save_results_as_json, ndjson_writer_factory, finish_ndjson_results
+
+MANIFEST_FILENAME = "manifest.json"
+USAGE_SNAPSHOT_FILENAME = "llm_usage.json"
+
+def discover_input_files(input_spec: str) -> list[str]:
+    """Expands a directory (non-recursive) or a glob pattern into a sorted list of document paths."""
+    if os.path.isdir(input_spec):
+        candidates = [os.path.join(input_spec, name) for name in os.listdir(input_spec)]
+    else:
+        candidates = glob.glob(input_spec)
+    # Skip hidden files and Office lock files such as '~$mple_4.docx'
+    return sorted(
+        path for path in candidates
+        if os.path.isfile(path) and not os.path.basename(path).startswith(('.', '~$'))
+    )
+
+
+def file_content_hash(path: str, block_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file, read in blocks."""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+class BatchManifest:
+    """
+    A JSON manifest with one entry per input file (status, content hash, durations, output paths).
+    Every update is written to disk immediately, so an interrupted batch can be resumed.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.data = {"files": {}}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+            self.data.setdefault("files", {})
+
+    def is_done(self, input_path: str, content_hash: str) -> bool:
+        entry = self.data["files"].get(os.path.abspath(input_path))
+        return bool(entry) and entry.get("status") == "done" and entry.get("contentHash") == content_hash
+
+    def update(self, input_path: str, **fields):
+        with self._lock:
+            entry = self.data["files"].setdefault(os.path.abspath(input_path), {})
+            entry.update(fields)
+            self._write()
+
+    def set_metadata(self, **fields):
+        with self._lock:
+            self.data.update(fields)
+            self._write()
+
+    def _write(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=2, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+
+
+def _process_one_file(input_path: str, content_hash: str, schema_content: dict, schema_package: dict, ai_client: AIClient,
+                      output_dir: str, manifest: BatchManifest, output_format: str = "json", trace_dir: str = None,
+                      incremental: bool = False, compaction: bool = True, speculative_extraction: bool = False) -> str:
+    """Processes one document and records the outcome in the manifest. Returns the final status."""
+    started_at = datetime.now().isoformat()
+    manifest.update(input_path, status="running", contentHash=content_hash, startedAt=started_at)
+    start_time = time.perf_counter()
+    try:
+        processor = DocumentProcessor(
+            schema_content=schema_content,
+            document=input_path,
+            document_filename=os.path.basename(input_path),
+            ai_client=ai_client,
+            schema_package=schema_package,
+            tracer=Tracer() if trace_dir else None,
+            incremental=incremental,
+            compaction_rules=DEFAULT_COMPACTION_RULES if compaction else None,
+            speculative_extraction=speculative_extraction
+        )
+        # One output folder per input file keeps titles from different documents from colliding
+        file_output_dir = os.path.join(output_dir, sanitize_filename(os.path.basename(input_path)))
+        if output_format == "json":
+            results = processor.run()
+            output_paths = save_results_as_json(results, input_path, file_output_dir)
+        else:
+            compress = output_format == "ndjson.gz"
+            results = processor.run(result_writer_factory=ndjson_writer_factory(input_path, file_output_dir, compress))
+            output_paths = finish_ndjson_results(results, input_path, file_output_dir, compress)
+
+        if trace_dir:
+            processor.tracer.export(trace_dir, sanitize_filename(os.path.basename(input_path)))
+
+        result_statuses = [result.get("summary", {}).get("overallStatus") for result in results]
+        status = "failed" if not results or "Failure" in result_statuses else "done"
+        manifest.update(input_path, status=status, finishedAt=datetime.now().isoformat(),
+                        durationSeconds=round(time.perf_counter() - start_time, 3),
+                        outputPaths=output_paths, resultStatuses=result_statuses, error=None,
+                        speculativeExtraction=processor.speculation_stats)
+        return status
+    except Exception as e:
+        print(f"  - ERROR: Processing '{input_path}' failed: {e}")
+        manifest.update(input_path, status="failed", finishedAt=datetime.now().isoformat(),
+                        durationSeconds=round(time.perf_counter() - start_time, 3), error=str(e))
+        return "failed"
+
+
+def process_batch(input_spec: str, template_path: str, output_dir: str, workers: int = 4, manifest_path: str = None,
+                  output_format: str = "json", trace_dir: str = None, incremental: bool = False,
+                  compaction: bool = True, speculative_extraction: bool = False) -> dict:
+    """
+    Processes every document matching `input_spec` against one template on a thread pool.
+    The template is loaded and processed once and a single AIClient is shared by all workers.
+    Files the manifest already marks as done (with an unchanged content hash) are skipped.
+    With `trace_dir`, a Chrome and an OTLP JSON trace are written there for every document.
+    `compaction` switches the markdown compaction stage (see markdown_compactor) on or off.
+    With `incremental`, only the sections that changed since a document's previous import are re-extracted.
+    With `speculative_extraction`, documents are extracted while they are classified (see DocumentProcessor); the
+    outcome of every document is recorded in its manifest entry and the totals of the run in the manifest metadata.
+    Model usage of the whole batch is written to `output_dir`/llm_usage.json when it finishes.
+    Returns a count of files per final status.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = BatchManifest(manifest_path or os.path.join(output_dir, MANIFEST_FILENAME))
+
+    with open(template_path, 'r', encoding='utf-8') as f:
+        schema_content = json.load(f)
+    schema_package = process_template_hierarchically(schema_content)
+    if "error" in schema_package:
+        raise ValueError(f"Template '{template_path}' could not be processed: {schema_package['error']}")
+
+    ai_client = get_ai_client()
+
+    input_files = discover_input_files(input_spec)
+    manifest.set_metadata(template=os.path.abspath(template_path), lastRunStartedAt=datetime.now().isoformat())
+    print(f"--- Batch: {len(input_files)} file(s) found for '{input_spec}' ---")
+
+    counts = {"done": 0, "failed": 0, "skipped": 0}
+    # The shared client serves other work too; only the calls made for this batch are counted
+    batch_usage = UsageRecorder()
+    batch_start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="batch") as executor, track_usage(batch_usage):
+        futures = {}
+        for input_path in input_files:
+            content_hash = file_content_hash(input_path)
+            if manifest.is_done(input_path, content_hash):
+                print(f"  - Skipping '{input_path}' (already done according to the manifest).")
+                counts["skipped"] += 1
+                continue
+            # Run in a copy of the caller's context so settings such as bypass_response_cache() reach the workers
+            future = executor.submit(contextvars.copy_context().run, _process_one_file, input_path, content_hash, schema_content,
+                                     schema_package, ai_client, output_dir, manifest, output_format, trace_dir, incremental, compaction,
+                                     speculative_extraction)
+            futures[future] = input_path
+
+        for future in as_completed(futures):
+            counts[future.result()] += 1
+
+    batch_duration = round(time.perf_counter() - batch_start_time, 3)
+    usage_snapshot = batch_usage.write_snapshot(os.path.join(output_dir, USAGE_SNAPSHOT_FILENAME),
+                                                    generatedAt=datetime.now().isoformat(), files=counts, durationSeconds=batch_duration)
+    manifest.set_metadata(lastRunFinishedAt=datetime.now().isoformat(),
+                          lastRunDurationSeconds=batch_duration, lastRunCounts=counts, lastRunLlmUsage=usage_snapshot["totals"])
+    if speculative_extraction:
+        outcomes = [manifest.data["files"][os.path.abspath(input_path)].get("speculativeExtraction") for input_path in futures.values()]
+        manifest.set_metadata(lastRunSpeculation=summarize_speculation([outcome for outcome in outcomes if outcome]))
+    print(f"\n--- Batch complete: {counts['done']} done, {counts['failed']} failed, {counts['skipped']} skipped. ---")
+    return counts
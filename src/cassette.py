@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import threading
+from typing import Any, Dict, Optional, Type
+
+from openai import OpenAI
+from pydantic import BaseModel
+
+from .ai_client import AIClient, request_key
+from .llm_usage import UsageRecorder, current_step, track_usage
+from .tracing import span
+
+CASSETTE_FORMAT_VERSION = 1
+
+
+class CassetteMissError(KeyError):
+    """Raised in replay mode for a request that was not recorded."""
+
+
+class Cassette:
+    """
+    A JSON file of recorded model responses keyed by ai_client.request_key, a hash of the full request
+    (model, prompts and response model schema or response format), so lookups do not depend on call order.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.entries = data.get("entries", {})
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            return self.entries.get(key)
+
+    def put(self, key: str, entry: dict):
+        with self._lock:
+            self.entries[key] = entry
+
+    def save(self):
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": CASSETTE_FORMAT_VERSION, "entries": self.entries}, f, indent=1, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+
+
+class CassetteAIClient(AIClient):
+    """
+    An AIClient that records real responses into a Cassette ('record' mode, needs an OpenAI client)
+    or serves them from it without any network access ('replay' mode).
+    Replayed calls are accounted like real ones, with the recorded token usage and zero retries.
+    """
+    def __init__(self, cassette: Cassette, mode: str = "replay", client: OpenAI = None, usage_recorder: UsageRecorder = None):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode '{mode}'.")
+        if mode == "record":
+            if client is None:
+                raise ValueError("Record mode needs an OpenAI client.")
+            super().__init__(client, usage_recorder)
+        else:
+            self.usage = usage_recorder or UsageRecorder()
+        self.cassette = cassette
+        self.mode = mode
+
+    def get_structured_response(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        response_model: Optional[Type[BaseModel]] = None,
+        response_format_options: Optional[Dict[str, Any]] = None,
+        model: str = "gpt-4o",
+        max_retries: int = 1,
+        step_name: Optional[str] = None
+    ) -> Any:
+        key = request_key(system_prompt, user_prompt, model, response_model, response_format_options)
+
+        if self.mode == "record":
+            call_usage = UsageRecorder()
+            with track_usage(call_usage):
+                result = super().get_structured_response(system_prompt, user_prompt, response_model, response_format_options,
+                                                         model, max_retries, step_name)
+            record = call_usage.records[-1]
+            self.cassette.put(key, {
+                "step": record["step"],
+                "model": model,
+                "response": result.model_dump(mode="json") if response_model else result,
+                "usage": {field: record[field] for field in ("promptTokens", "completionTokens", "cachedTokens")},
+                "recordedLatencySeconds": record["latencySeconds"],
+            })
+            return result
+
+        entry = self.cassette.get(key)
+        step_name = step_name or current_step()
+        if entry is None:
+            raise CassetteMissError(f"No recorded response for this {step_name or 'model'} request (key {key[:12]}). Re-record the cassette.")
+        with span("llm.call", step=step_name, model=model, replayed=True):
+            start_time = time.perf_counter()
+            result = response_model.model_validate(entry["response"]) if response_model else json.loads(json.dumps(entry["response"]))
+            self._record_call(model, step_name, [entry.get("usage", {})], time.perf_counter() - start_time, "Success")
+        return result
@@ -0,0 +1,97 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+class LruDiskCache:
+    """
+    Two-tier text cache: a small in-memory LRU in front of a directory of files.
+    The on-disk tier is bounded by total size; the least recently used files are evicted first.
+    Keys must be safe to use as file names (e.g. hex digests).
+    """
+    def __init__(self, directory: str, max_disk_bytes: int = 512 * 1024 * 1024, memory_items: int = 32, suffix: str = ".txt"):
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.memory_items = memory_items
+        self.suffix = suffix
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def get_with_tier(self, key: str) -> tuple[Optional[str], Optional[str]]:
+        """Return (value, tier) where tier is 'memory', 'disk' or None on a miss."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key], "memory"
+
+        path = self._path_for(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = f.read()
+        except (FileNotFoundError, OSError):
+            return None, None
+
+        # Touch the file so disk eviction sees it as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self._remember(key, value)
+        return value, "disk"
+
+    def get(self, key: str) -> Optional[str]:
+        return self.get_with_tier(key)[0]
+
+    def set(self, key: str, value: str):
+        self._remember(key, value)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path_for(key)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(value)
+            os.replace(temp_path, path)
+            self._evict_disk()
+        except OSError as e:
+            # The disk tier is best-effort; the memory tier still holds the value.
+            print(f"  - WARNING: Could not write cache entry to '{self.directory}': {e}")
+
+    def _remember(self, key: str, value: str):
+        if self.memory_items <= 0:
+            return
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        """Delete least recently used files until the directory fits within max_disk_bytes."""
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.directory):
+            if not entry.is_file() or not entry.name.endswith(self.suffix):
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size += stat.st_size
+
+        if total_size <= self.max_disk_bytes:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total_size -= size
+            except OSError:
+                pass
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
@@ -1,5 +1,73 @@
+import re
+import statistics
+from collections import Counter
 from .ai_client import AIClient
-from .models import DocumentAnalysis, DocumentStructureType
+from .models import DocumentAnalysis, DocumentStructureType, StructuralAnalysis
+from .document_splitter import find_headings
+
+# Scores (probability of 'multiple_items') inside this band are handed to the model.
+UNCERTAIN_BAND = (0.3, 0.7)
+# Items of a multi-item document are separated by top-level headings, so a document without them is one item.
+NO_HEADINGS_SCORE = 0.1
+# Top-level headings that share no pattern read as the chapters of one document.
+UNREPEATED_HEADINGS_SCORE = 0.25
+
+def _heading_pattern(title: str) -> str:
+    """Reduces a heading to a coarse pattern: the first two words with digits masked."""
+    words = re.sub(r'\d+', '#', title.lower()).split()
+    return " ".join(words[:2])
+
+
+def analyze_document_structure(markdown_content: str, uncertain_band: tuple = UNCERTAIN_BAND) -> StructuralAnalysis:
+    """
+    Classifies the document locally from its heading structure.
+    Uses the number of top-level headings, how many of them share a repeated pattern
+    (e.g. 'Meeting 1', 'Meeting 2') and how evenly the document is divided between them.
+    Documents without top-level headings, or whose headings share no pattern, are single items.
+    Sets `needs_model` when the resulting score falls inside `uncertain_band`.
+    """
+    top_level = [(offset, title) for offset, level, title in find_headings(markdown_content, max_level=1)]
+    num_headings = len(top_level)
+    repeated_share = 0.0
+    size_cv = 0.0
+
+    if num_headings == 0:
+        score, reasoning = NO_HEADINGS_SCORE, "No top-level headings to separate items."
+    elif num_headings == 1:
+        score, reasoning = 0.15, "Exactly one top-level heading."
+    else:
+        pattern_counts = Counter(_heading_pattern(title) for _, title in top_level)
+        most_common_count = pattern_counts.most_common(1)[0][1]
+        repeated_share = most_common_count / num_headings if most_common_count > 1 else 0.0
+
+        boundaries = [offset for offset, _ in top_level] + [len(markdown_content)]
+        section_sizes = [end - start for start, end in zip(boundaries, boundaries[1:])]
+        mean_size = statistics.mean(section_sizes)
+        size_cv = statistics.pstdev(section_sizes) / mean_size if mean_size else 0.0
+
+        # Only a repeated pattern points to separate items; evenly sized sections make that more likely
+        score = UNREPEATED_HEADINGS_SCORE + 0.6 * repeated_share
+        if repeated_share and size_cv < 0.75:
+            score += 0.1
+        if statistics.median(section_sizes) < 200:
+            # Many tiny sections look like chapter headings of one document, not separate items
+            score -= 0.2
+        score = min(max(score, 0.0), 1.0)
+        reasoning = (f"{num_headings} top-level headings, {repeated_share:.0%} share a repeated pattern, "
+                     f"section size variation {size_cv:.2f}.")
+
+    document_type = "multiple_items" if score >= 0.5 else "single_item"
+    return StructuralAnalysis(
+        document_type=document_type,
+        confidence=round(max(score, 1.0 - score), 3),
+        multiple_items_score=round(score, 3),
+        needs_model=uncertain_band[0] < score < uncertain_band[1],
+        top_level_headings=num_headings,
+        repeated_heading_share=round(repeated_share, 3),
+        section_size_cv=round(size_cv, 3),
+        reasoning=reasoning
+    )
+
 
 def classify_document_type(ai_client: AIClient, markdown_content: str, root_object_name: str) -> DocumentStructureType:
     """
@@ -33,7 +101,8 @@ def classify_document_type(ai_client: AIClient, markdown_content: str, root_obje
             system_prompt=system_prompt,
             user_prompt=user_prompt,
             response_model=DocumentAnalysis,
-            model="gpt-4o"
+            model="gpt-4o",
+            step_name="classification"
         )
         print(f"  - Document classified as: {analysis.document_type}. Reasoning: {analysis.reasoning}")
         return analysis.document_type
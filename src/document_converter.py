@@ -1,39 +1,366 @@
+import io
 import os
+import re
+import time
+import hashlib
 import tempfile
-from markitdown import MarkItDown
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from importlib.metadata import version, PackageNotFoundError
+from typing import BinaryIO, Iterator, Optional, Union
 
-def convert_file_to_markdown(document_bytes: bytes, filename: str) -> str:
+from .disk_cache import LruDiskCache
+from .tracing import span, start_span, end_span
+
+# Bump this when our own conversion logic changes so old cache entries are not reused.
+CONVERSION_PIPELINE_VERSION = "1"
+
+CONVERSION_CACHE_DIR = os.getenv("DMAZE_CONVERSION_CACHE_DIR", os.path.join(".cache", "conversions"))
+CONVERSION_CACHE_MAX_BYTES = int(os.getenv("DMAZE_CONVERSION_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+_conversion_cache = LruDiskCache(CONVERSION_CACHE_DIR, max_disk_bytes=CONVERSION_CACHE_MAX_BYTES, memory_items=16, suffix=".md")
+
+# PDFs are converted in page ranges by a pool of worker processes (pdfminer is pure Python, so threads would not help).
+# With one worker the ranges are converted in this process, one after the other.
+PDF_CONVERSION_WORKERS = int(os.getenv("DMAZE_PDF_WORKERS", str(os.cpu_count() or 1)))
+PDF_MAX_PAGES_PER_RANGE = int(os.getenv("DMAZE_PDF_PAGES_PER_RANGE", "8"))
+
+# A document to convert: its bytes, the path of a file on disk, or a binary stream (e.g. an upload)
+DocumentSource = Union[bytes, str, os.PathLike, BinaryIO]
+SPOOL_BLOCK_BYTES = 1024 * 1024
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+# One warm converter per process; MarkItDown() registers all its converters on construction.
+_converter = None
+_converter_lock = threading.Lock()
+
+
+def _get_converter():
+    global _converter
+    with _converter_lock:
+        if _converter is None:
+            # Imported on first use: the PDF worker processes import this module and only need pdfminer
+            from markitdown import MarkItDown
+            _converter = MarkItDown()
+        return _converter
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # 'spawn' rather than fork: the parent runs thread pools and HTTP clients that a forked child would inherit mid-use
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_CONVERSION_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pdf_pool
+
+
+def _discard_pdf_pool():
+    """Drops a pool whose worker died so the next PDF starts a new one."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is not None:
+            _pdf_pool.shutdown(wait=False, cancel_futures=True)
+            _pdf_pool = None
+
+
+def _warm_up_pdf_worker():
+    import pdfminer.high_level  # noqa: F401
+
+
+def warm_up_converter():
+    """
+    Creates the shared converter ahead of the first document, e.g. when a long-running service starts,
+    and starts the PDF worker processes.
     """
-    Converts in-memory bytes to Markdown using the 'markitdown' library.
-    Writes the bytes to a temporary file because the library expects a file path.
+    _get_converter()
+    if PDF_CONVERSION_WORKERS > 1:
+        pool = _get_pdf_pool()
+        for future in [pool.submit(_warm_up_pdf_worker) for _ in range(PDF_CONVERSION_WORKERS)]:
+            future.result()
+
+
+def get_converter_version() -> str:
+    """Version string that, together with the content hash, identifies a conversion result."""
+    try:
+        markitdown_version = version("markitdown")
+    except PackageNotFoundError:
+        markitdown_version = "unknown"
+    return f"markitdown-{markitdown_version}+pipeline-{CONVERSION_PIPELINE_VERSION}"
+
+
+def spool_stream(stream: BinaryIO, suffix: str = "", length: int = None) -> str:
+    """
+    Copies a binary stream (at most `length` bytes when given) to a temporary file block by block, without
+    holding the whole content in memory, and returns the file's path. The caller removes the file.
     """
-    print(f"  - Converting '{filename}' using the MarkItDown library...")
+    fd, path = tempfile.mkstemp(prefix="dmaze-document-", suffix=suffix)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            remaining = length
+            while remaining is None or remaining > 0:
+                block = stream.read(SPOOL_BLOCK_BYTES if remaining is None else min(SPOOL_BLOCK_BYTES, remaining))
+                if not block:
+                    break
+                f.write(block)
+                if remaining is not None:
+                    remaining -= len(block)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
 
-    # tempfile creates a temporary directory which is removed after use.
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # 1. Create a full path to a temporary file INSIDE the temporary directory.
-        # Keep the original filename so markitdown can detect the type.
-        temp_input_path = os.path.join(temp_dir, filename)
 
+@contextmanager
+def spooled_document(document: DocumentSource, filename: str):
+    """Yields the document as bytes or as a file path; a stream is spooled to a temporary file that is removed afterwards."""
+    if isinstance(document, bytes):
+        yield document
+    elif isinstance(document, (str, os.PathLike)):
+        yield os.fspath(document)
+    else:
+        path = spool_stream(document, os.path.splitext(filename)[1].lower())
         try:
-            # 2. Write the in-memory bytes to the temporary file.
-            with open(temp_input_path, 'wb') as f:
-                f.write(document_bytes)
-
-            # 3. Create an instance of the converter.
-            md_converter = MarkItDown()
-
-            # 4. Call convert() with the PATH to the temporary file.
-            result = md_converter.convert(temp_input_path)
-            
-            # 5. Extract the final Markdown content.
-            markdown_content = result.text_content
-            
-            print(f"  - Conversion of '{filename}' successful.")
-            return markdown_content
+            yield path
+        finally:
+            os.remove(path)
+
+
+def get_document_size(document: DocumentSource) -> Optional[int]:
+    """Size in bytes of a document given as bytes or a path; None for a stream or a file that cannot be read."""
+    if isinstance(document, bytes):
+        return len(document)
+    if isinstance(document, (str, os.PathLike)):
+        try:
+            return os.path.getsize(document)
+        except OSError:
+            return None
+    return None
+
+
+def _open_document(document: Union[bytes, str]) -> BinaryIO:
+    return io.BytesIO(document) if isinstance(document, bytes) else open(document, 'rb')
+
+
+def get_conversion_cache_key(document: Union[bytes, str], filename: str) -> str:
+    """
+    Content-addressed key: the document content (bytes, or a file read in blocks), its extension
+    (drives converter choice) and the converter version.
+    """
+    hasher = hashlib.sha256()
+    hasher.update(get_converter_version().encode("utf-8"))
+    hasher.update(os.path.splitext(filename)[1].lower().encode("utf-8"))
+    if isinstance(document, bytes):
+        hasher.update(document)
+    else:
+        with open(document, 'rb') as f:
+            for block in iter(lambda: f.read(SPOOL_BLOCK_BYTES), b''):
+                hasher.update(block)
+    return hasher.hexdigest()
+
+
+def _convert_with_markitdown(document: Union[bytes, str], filename: str) -> str:
+    """
+    Converts a document to Markdown using the 'markitdown' library: a file on disk in place, bytes as an
+    in-memory stream. The original filename tells markitdown the type, whatever the path is called.
+    """
+    from markitdown import StreamInfo
+    stream_info = StreamInfo(extension=os.path.splitext(filename)[1].lower(), filename=filename)
+    if isinstance(document, bytes):
+        result = _get_converter().convert_stream(io.BytesIO(document), stream_info=stream_info)
+    else:
+        result = _get_converter().convert_local(document, stream_info=stream_info)
+    return result.text_content
 
+
+def _extract_pdf_page_range(document: Union[bytes, str], first_page: int, end_page: int) -> list[tuple[int, str, float]]:
+    """
+    Extracts the text of pages [first_page, end_page) the way MarkItDown's PDF converter does
+    (pdfminer's extract_text with default layout parameters). Returns (page number, text, seconds) per page.
+    Runs in a PDF worker process; a document on disk is opened there, so only its path is sent to the worker.
+    """
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+
+    pages = []
+    with _open_document(document) as pdf_file, io.StringIO() as output:
+        resource_manager = PDFResourceManager(caching=True)
+        device = TextConverter(resource_manager, output, codec="utf-8", laparams=LAParams())
+        interpreter = PDFPageInterpreter(resource_manager, device)
+        page_numbers = range(first_page, end_page)
+        for page_number, page in zip(page_numbers, PDFPage.get_pages(pdf_file, page_numbers, caching=True)):
+            started = time.perf_counter()
+            interpreter.process_page(page)
+            pages.append((page_number, output.getvalue(), time.perf_counter() - started))
+            output.seek(0)
+            output.truncate()
+    return pages
+
+
+def _count_pdf_pages(document: Union[bytes, str]) -> int:
+    from pdfminer.pdfpage import PDFPage
+    with _open_document(document) as pdf_file:
+        return sum(1 for _ in PDFPage.get_pages(pdf_file))
+
+
+class _TextNormalizer:
+    """
+    Applies MarkItDown's output normalization (trailing whitespace stripped from every line, runs of three
+    or more newlines collapsed to two) to text that arrives in pieces, so that the joined output is
+    identical to normalizing the whole text at once.
+    """
+    def __init__(self):
+        self._partial_line = ""
+        self._newline_run = 0
+
+    def _emit(self, text: str) -> str:
+        pieces = []
+        for piece in re.split(r'(\n+)', text):
+            if not piece:
+                continue
+            if piece[0] == '\n':
+                # A run of n newlines becomes min(n, 2); the run may have started in an earlier piece
+                pieces.append('\n' * (min(2, self._newline_run + len(piece)) - min(2, self._newline_run)))
+                self._newline_run += len(piece)
+            else:
+                pieces.append(piece)
+                self._newline_run = 0
+        return ''.join(pieces)
+
+    def feed(self, text: str) -> str:
+        lines = re.split(r'\r?\n', self._partial_line + text)
+        # The last line may continue in the next piece (including a '\r' whose '\n' has not arrived yet)
+        self._partial_line = lines.pop()
+        return self._emit(''.join(line.rstrip() + '\n' for line in lines))
+
+    def finish(self) -> str:
+        text, self._partial_line = self._partial_line, ""
+        return self._emit(text.rstrip())
+
+
+def _plan_page_ranges(page_count: int, workers: int, max_pages_per_range: int) -> list[tuple[int, int]]:
+    """Splits the pages into consecutive ranges, at least one per worker and at most `max_pages_per_range` pages each."""
+    pages_per_range = max(1, min(max_pages_per_range, -(-page_count // max(1, workers))))
+    return [(first, min(first + pages_per_range, page_count)) for first in range(0, page_count, pages_per_range)]
+
+
+def iter_pdf_markdown_blocks(document: Union[bytes, str], filename: str = "document.pdf", page_timings: list = None,
+                             workers: int = None, max_pages_per_range: int = None) -> Iterator[str]:
+    """
+    Converts a PDF (its bytes or a path) in page ranges on the PDF worker processes and yields the Markdown in page order, one block
+    per page, as soon as each page and all pages before it are done. Joined, the blocks are identical to
+    MarkItDown's conversion of the whole file (pages keep their form-feed separators).
+    If `page_timings` is given it is filled with {page, seconds, chars} per page; seconds are those of the
+    worker that converted the page.
+    """
+    workers = PDF_CONVERSION_WORKERS if workers is None else workers
+    max_pages_per_range = PDF_MAX_PAGES_PER_RANGE if max_pages_per_range is None else max_pages_per_range
+    page_count = _count_pdf_pages(document)
+    page_ranges = _plan_page_ranges(page_count, workers, max_pages_per_range)
+    pages_span = start_span("conversion.pdf_pages", filename=filename, pages=page_count, ranges=len(page_ranges),
+                            workers=min(workers, len(page_ranges)))
+    normalizer = _TextNormalizer()
+    try:
+        if workers > 1 and len(page_ranges) > 1:
+            pool = _get_pdf_pool()
+            futures = [pool.submit(_extract_pdf_page_range, document, first, end) for first, end in page_ranges]
+            range_results = (future.result() for future in futures)
+        else:
+            futures = []
+            range_results = (_extract_pdf_page_range(document, first, end) for first, end in page_ranges)
+
+        try:
+            for pages in range_results:
+                for page_number, text, seconds in pages:
+                    block = normalizer.feed(text)
+                    if page_timings is not None:
+                        page_timings.append({"page": page_number + 1, "seconds": round(seconds, 4), "chars": len(block)})
+                    yield block
+        finally:
+            # Stopped early (or failed): ranges that have not started are not converted
+            for future in futures:
+                future.cancel()
+        yield normalizer.finish()
+    except BaseException as e:
+        if pages_span is not None:
+            pages_span.status = "ERROR"
+            pages_span.attributes["error"] = str(e)
+        raise
+    finally:
+        end_span(pages_span)
+
+
+def iter_markdown_blocks(document: DocumentSource, filename: str, page_timings: list = None) -> Iterator[str]:
+    """
+    Converts a document to Markdown in blocks that can be consumed while the conversion is still running:
+    PDFs page by page (see iter_pdf_markdown_blocks), other formats as a single block.
+    The blocks joined are the document's Markdown.
+    """
+    with spooled_document(document, filename) as source:
+        if os.path.splitext(filename)[1].lower() == ".pdf" and _pdfminer_is_available():
+            yield from iter_pdf_markdown_blocks(source, filename, page_timings)
+        else:
+            yield _convert_with_markitdown(source, filename)
+
+
+def _pdfminer_is_available() -> bool:
+    try:
+        import pdfminer.high_level  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def convert_file_to_markdown(document: DocumentSource, filename: str, use_cache: bool = True, conversion_info: dict = None) -> str:
+    """
+    Converts a document to Markdown, reusing a cached result for documents that were converted before.
+    The document can be its bytes, a path (converted in place, never read into memory as a whole) or a
+    binary stream (spooled to a temporary file first); `filename` determines the format.
+    If `conversion_info` is given it is filled with the content hash and the cache outcome ('memory', 'disk' or 'miss'),
+    and for converted PDFs with the time of every page ('pageTimings', see iter_pdf_markdown_blocks).
+    """
+    with spooled_document(document, filename) as source:
+        cache_key = get_conversion_cache_key(source, filename)
+        if conversion_info is not None:
+            conversion_info["contentHash"] = cache_key
+            conversion_info["cache"] = "bypass" if not use_cache else "miss"
+
+        if use_cache:
+            cached_markdown, tier = _conversion_cache.get_with_tier(cache_key)
+            if cached_markdown is not None:
+                print(f"  - Conversion cache hit ({tier}) for '{filename}'. Skipping conversion.")
+                if conversion_info is not None:
+                    conversion_info["cache"] = tier
+                return cached_markdown
+
+        print(f"  - Converting '{filename}' using the MarkItDown library...")
+        page_timings = []
+        try:
+            with span("conversion.markitdown", filename=filename, inputBytes=get_document_size(source)) as convert_span:
+                try:
+                    markdown_content = "".join(iter_markdown_blocks(source, filename, page_timings))
+                except BrokenProcessPool as e:
+                    print(f"  - WARNING: The PDF worker processes failed ({e}). Converting '{filename}' in one piece.")
+                    _discard_pdf_pool()
+                    page_timings = []
+                    markdown_content = _convert_with_markitdown(source, filename)
+                if convert_span:
+                    convert_span.set_attributes(outputChars=len(markdown_content), pages=len(page_timings) or None)
         except Exception as e:
             # If something fails, log it and re-raise so the caller can handle it.
             print(f"  - ERROR: The MarkItDown library failed to convert {filename}.")
             print(f"    Reason: {e}")
-            raise e
\ No newline at end of file
+            raise
+
+        print(f"  - Conversion of '{filename}' successful.")
+        if conversion_info is not None and page_timings:
+            conversion_info["pageTimings"] = page_timings
+        if use_cache:
+            _conversion_cache.set(cache_key, markdown_content)
+        return markdown_content
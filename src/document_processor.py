@@ -1,46 +1,117 @@
-import os
 import time
 import re
+import threading
+import contextvars
+from contextlib import nullcontext
+from concurrent.futures import Executor, ThreadPoolExecutor, wait
 from datetime import datetime
-from openai import OpenAI
-from dotenv import load_dotenv
 
-from .ai_client import AIClient
+from .ai_client import AIClient, cancel_calls_on, get_ai_client
+from .llm_usage import UsageRecorder, track_usage, summarize_usage
+from .tracing import Tracer, span, use_tracer
 
 # Import functions this class depends on
-from .document_converter import convert_file_to_markdown
-from .schema_processor import process_template_hierarchically
-from .openai_extractor import extract_data_with_hierarchy
-from .json_transformer import transform_to_dmaze_format_hierarchically
-from .document_classifier import classify_document_type
+from .document_converter import DocumentSource, convert_file_to_markdown, get_document_size
+from .schema_processor import process_template_hierarchically, get_template_hash
+from .openai_extractor import extract_data_windowed, DEFAULT_WINDOW_TOKENS, DEFAULT_WINDOW_OVERLAP_TOKENS
+from .markdown_compactor import compact_markdown, DEFAULT_COMPACTION_RULES
+from .incremental_import import extract_data_incrementally, get_import_key
+from .json_transformer import transform_to_dmaze_format_hierarchically, iter_transform_to_dmaze_format
+from .document_classifier import classify_document_type, analyze_document_structure
 from .document_splitter import split_document_into_items
 
+def summarize_speculation(outcomes: list, totals: dict = None) -> dict:
+    """
+    Adds speculative extraction outcomes (the 'speculativeExtraction' of summaries) to `totals`, a new dict if omitted:
+    documents, kept, discarded, secondsSaved, wastedTokens, wastedCalls, cancelledCalls and wastedCostUsd.
+    """
+    totals = totals if totals is not None else {"documents": 0, "kept": 0, "discarded": 0, "secondsSaved": 0.0, "wastedTokens": 0,
+                                                "wastedCalls": 0, "cancelledCalls": 0, "wastedCostUsd": 0.0}
+    for outcome in outcomes:
+        totals["documents"] += 1
+        totals[outcome["outcome"]] += 1
+        for field in ("secondsSaved", "wastedTokens", "wastedCalls", "cancelledCalls", "wastedCostUsd"):
+            totals[field] += outcome[field]
+    totals["secondsSaved"] = round(totals["secondsSaved"], 3)
+    totals["wastedCostUsd"] = round(totals["wastedCostUsd"], 6)
+    return totals
+
+
+def _new_step_log() -> dict:
+    """A container for step statuses, numeric durations, errors and LLM usage of one unit of work."""
+    return {"processing_log": {}, "step_durations": {}, "errors": [], "llm_usage": UsageRecorder()}
+
+
 class DocumentProcessor:
-    def __init__(self, schema_content: dict, document_bytes: bytes, document_filename: str):
+    def __init__(self, schema_content: dict, document: DocumentSource, document_filename: str, use_conversion_cache: bool = True,
+                 max_chunks_in_flight: int = 4, chunk_executor: Executor = None, ai_client: AIClient = None, schema_package: dict = None,
+                 extraction_window_tokens: int = DEFAULT_WINDOW_TOKENS, extraction_window_overlap_tokens: int = DEFAULT_WINDOW_OVERLAP_TOKENS,
+                 tracer: Tracer = None, incremental: bool = False, compaction_rules: dict = DEFAULT_COMPACTION_RULES,
+                 speculative_extraction: bool = False):
+        """
+        Args:
+            document: The document's bytes, the path of the file (converted in place) or a binary stream such as
+                an upload (spooled to a temporary file). `document_filename` determines the format. The processor
+                drops its reference once the document is converted; later steps only need the Markdown.
+            max_chunks_in_flight: Upper bound on how many chunks of this document are processed at the same time.
+            chunk_executor: Optional shared worker pool for chunk processing. When omitted, a private
+                thread pool of size `max_chunks_in_flight` is created for each run.
+            ai_client: Optional AIClient to use. When omitted, the process-wide client from get_ai_client() is used.
+            schema_package: Optional result of process_template_hierarchically for `schema_content`,
+                so a template shared by many documents is only processed once.
+            extraction_window_tokens: Parts larger than this many tokens are extracted in several overlapping
+                windows (see openai_extractor.extract_data_windowed) instead of one model call.
+            extraction_window_overlap_tokens: How many tokens consecutive extraction windows share.
+            tracer: Optional Tracer that receives a span for the run, every step, chunk, model call and
+                matching/flattening stage, for export as a Chrome or OTLP trace.
+            incremental: Extract section by section and reuse the sections that are unchanged since the previous
+                import of a document with the same file name and template (see incremental_import).
+            compaction_rules: Normalization applied to the converted markdown before classification, splitting and
+                extraction (see markdown_compactor.DEFAULT_COMPACTION_RULES). None leaves the markdown untouched.
+            speculative_extraction: When the document has to be classified by the model, start extracting it as a single
+                item at the same time. The extraction is used if the document is single-item; otherwise its remaining
+                model calls are cancelled and its result is discarded. The summary reports the outcome, the seconds
+                saved and the tokens wasted ('speculativeExtraction'), so the mode can be judged per template.
+        """
         self.schema_content = schema_content
-        self.document_bytes = document_bytes
+        self.document = document
         self.document_filename = document_filename
+        self.use_conversion_cache = use_conversion_cache
+        self.max_chunks_in_flight = max(1, max_chunks_in_flight)
+        self.chunk_executor = chunk_executor
+        self.extraction_window_tokens = extraction_window_tokens
+        self.extraction_window_overlap_tokens = extraction_window_overlap_tokens
+        self.tracer = tracer
+        self.incremental = incremental
+        self.compaction_rules = compaction_rules
+        self.compaction_stats = None
+        self.conversion_page_timings = None
+        self.speculative_extraction = speculative_extraction
+        self.speculation_stats = None
 
-        load_dotenv()
-        # Create an instance of the general AIClient
-        self.ai_client = AIClient(OpenAI(api_key=os.getenv("OPENAI_API_KEY")))
+        # One long-lived client per process keeps its connection pool warm across documents
+        self.ai_client = ai_client or get_ai_client()
 
-        self.schema_package = None
+        self.schema_package = schema_package
         self.markdown_content = None
         self.doc_type = "single_item"
 
-        # Common logging variables
-        self.processing_log = {}
-        self.errors = []
+        # Common logging variables for the document-level steps; chunks get their own step logs
+        self.step_log = _new_step_log()
+        self.processing_log = self.step_log["processing_log"]
+        self.errors = self.step_log["errors"]
 
-    def _log_step(self, step_name: str, function_to_run):
-        """Run a processing step, log duration and status."""
+    def _log_step(self, step_name: str, function_to_run, step_log: dict = None):
+        """Run a processing step, log duration and status into `step_log` (the document-level log by default)."""
+        step_log = self.step_log if step_log is None else step_log
         print(f"\n--- Running Step: {step_name} ---")
-        step_start_time = time.time()
+        step_start_time = time.perf_counter()
         status = "Pending"
         details = ""
         try:
-            result = function_to_run()
+            # Model calls made by the step are recorded in the step log's usage recorder
+            with span(step_name), track_usage(step_log["llm_usage"], step_name):
+                result = function_to_run()
             if isinstance(result, dict) and "error" in result:
                 raise ValueError(result["error"])
             status = "Success"
@@ -49,35 +120,168 @@ class DocumentProcessor:
         except Exception as e:
             status = "Failure"
             details = str(e)
-            self.errors.append(f"Step '{step_name}' failed: {details}")
+            step_log["errors"].append(f"Step '{step_name}' failed: {details}")
             raise
         finally:
-            duration = time.time() - step_start_time
+            duration = time.perf_counter() - step_start_time
             summary = f"{status} ({duration:.2f}s)"
             if status == "Failure":
                 summary += f": {details}"
-            self.processing_log[step_name] = summary
+            step_log["processing_log"][step_name] = summary
+            step_log["step_durations"][step_name] = duration
+
+    def _transform_into_writer(self, nested_data: dict, result_writer) -> dict:
+        """Streams the transformed Dmaze objects into `result_writer` instead of collecting them in memory."""
+        warnings, match_stats = [], {}
+        for dmaze_object in iter_transform_to_dmaze_format(self.ai_client, nested_data, self.schema_package, warnings, match_stats):
+            result_writer.write_object(dmaze_object)
+        return {"dmaze_data": [], "warnings": warnings, "match_stats": match_stats, "object_count": result_writer.object_count}
+
+    def _extract(self, content: str, title: str, window_stats: list, section_stats: dict) -> dict:
+        """Extracts one part of the document: section by section in incremental mode, otherwise in windows."""
+        if self.incremental:
+            import_key = get_import_key(self.document_filename,
+                                        self.schema_package.get("template_hash") or get_template_hash(self.schema_content), title)
+            return extract_data_incrementally(self.ai_client, content, self.schema_package, import_key, self.extraction_window_tokens,
+                                              self.extraction_window_overlap_tokens, self.max_chunks_in_flight, window_stats, section_stats)
+        return extract_data_windowed(self.ai_client, content, self.schema_package, self.extraction_window_tokens,
+                                     self.extraction_window_overlap_tokens, self.max_chunks_in_flight, window_stats)
+
+    def _start_speculative_extraction(self) -> dict:
+        """
+        Starts extracting the whole document as a single item on a thread of its own, with the step log the
+        chunk would have, so the result can be handed to _process_single_chunk if the classification agrees.
+        """
+        speculation = {"step_log": _new_step_log(), "window_stats": [], "section_stats": {} if self.incremental else None,
+                       "cancel_event": threading.Event(), "started_at": time.perf_counter(), "finished_at": None}
+
+        def extract():
+            try:
+                with cancel_calls_on(speculation["cancel_event"]):
+                    return self._log_step("AI Data Extraction ", lambda: self._extract(
+                        self.markdown_content, None, speculation["window_stats"], speculation["section_stats"]), speculation["step_log"])
+            finally:
+                speculation["finished_at"] = time.perf_counter()
+
+        print("  - Starting the single-item extraction speculatively while the document is classified.")
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculative")
+        # Run in a copy of this context so the extraction's spans nest under the current run
+        speculation["future"] = executor.submit(contextvars.copy_context().run, extract)
+        executor.shutdown(wait=False)
+        return speculation
+
+    def _finish_speculation(self, speculation: dict, kept: bool, classified_at: float, reason: str = None) -> dict:
+        """
+        Statistics of a speculative extraction. A kept extraction saved the time it ran alongside the classification;
+        a discarded one is waited for (only calls already sent are still running) and its model usage is counted as wasted.
+        `reason` says why it was discarded, by default the document type.
+        """
+        stats = {"templateHash": self.schema_package.get("template_hash"), "outcome": "kept" if kept else "discarded",
+                 "secondsSaved": 0.0, "wastedTokens": 0, "wastedCalls": 0, "cancelledCalls": 0, "wastedCostUsd": 0.0}
+        if kept:
+            stats["secondsSaved"] = round(min(speculation["finished_at"], classified_at) - speculation["started_at"], 3)
+            self.processing_log["Speculative Extraction"] = f"Kept (saved {stats['secondsSaved']:.2f}s)"
+            return stats
 
-    def _process_single_chunk(self, content: str, title: str) -> dict:
-        """Run AI extraction and transformation for one part of the document."""
+        wait([speculation["future"]])
+        records = speculation["step_log"]["llm_usage"].records
+        totals = summarize_usage(records)["totals"]
+        stats.update(wastedTokens=totals["promptTokens"] + totals["completionTokens"], wastedCalls=totals["calls"],
+                     cancelledCalls=totals["cancelledCalls"], wastedCostUsd=totals["estimatedCostUsd"])
+        # The calls were paid for, so they stay in the document's usage, under a step of their own
+        for record in records:
+            self.step_log["llm_usage"].add({**record, "step": "Speculative Extraction (discarded)"})
+        reason = reason or f"document is {self.doc_type}"
+        self.processing_log["Speculative Extraction"] = (f"Discarded ({reason}; {stats['wastedTokens']} tokens in "
+                                                         f"{stats['wastedCalls']} calls wasted, {stats['cancelledCalls']} calls cancelled)")
+        return stats
+
+    def _process_single_chunk(self, content: str, title: str, result_writer=None, speculation: dict = None) -> dict:
+        """
+        Run AI extraction and transformation for one part of the document, with its own step log.
+        With a `result_writer`, Dmaze objects are written out as they are produced and not kept in the result.
+        With a `speculation` (see _start_speculative_extraction), its extraction is used instead of extracting again.
+        """
         item_log_name_prefix = f"for '{title}'" if title else ""
-        
-        nested_data = self._log_step(f"AI Data Extraction {item_log_name_prefix}", 
-            lambda: extract_data_with_hierarchy(self.ai_client, content, self.schema_package))
-        
-        transformation_result = self._log_step(f"Data Transformation {item_log_name_prefix}", 
-            lambda: transform_to_dmaze_format_hierarchically(self.ai_client, nested_data, self.schema_package))
-        
+        step_log = speculation["step_log"] if speculation else _new_step_log()
+        item_start_time = time.perf_counter()
+        status = "Success"
+        transformation_result = {}
+        window_stats = speculation["window_stats"] if speculation else []
+        section_stats = speculation["section_stats"] if speculation else ({} if self.incremental else None)
+
+        try:
+            with span("Chunk", chunkTitle=title, chunkChars=len(content)):
+                if speculation:
+                    nested_data = speculation["future"].result()
+                else:
+                    nested_data = self._log_step(f"AI Data Extraction {item_log_name_prefix}",
+                        lambda: self._extract(content, title, window_stats, section_stats), step_log)
+
+                if result_writer is not None:
+                    transformation_result = self._log_step(f"Data Transformation {item_log_name_prefix}",
+                        lambda: self._transform_into_writer(nested_data, result_writer), step_log)
+                else:
+                    transformation_result = self._log_step(f"Data Transformation {item_log_name_prefix}",
+                        lambda: transform_to_dmaze_format_hierarchically(self.ai_client, nested_data, self.schema_package), step_log)
+        except Exception as e:
+            # A failing chunk is reported in its own result; the other chunks carry on
+            print(f"\nERROR while processing {item_log_name_prefix or 'the document'}: {e}")
+            status = "Failure"
+
+        dmaze_data = transformation_result.get("dmaze_data", [])
+        warnings = transformation_result.get("warnings", [])
+        if status == "Success":
+            warnings = [f"Extraction window {stats['window']} (characters {stats['startOffset']}-{stats['endOffset']}) failed and was skipped: {stats['error']}"
+                        for stats in window_stats if stats["status"] == "Failure"] + warnings
+            if section_stats and section_stats["failed"]:
+                warnings = [f"{section_stats['failed']} of {section_stats['sections']} sections failed to extract and were skipped."] + warnings
         return {
-            "dmaze_data": transformation_result.get("dmaze_data", []),
-            "warnings": transformation_result.get("warnings", [])
+            "dmaze_data": dmaze_data,
+            "object_count": transformation_result.get("object_count", len(dmaze_data)),
+            "warnings": warnings,
+            "extraction_windows": window_stats,
+            "incremental_sections": section_stats,
+            "match_stats": transformation_result.get("match_stats", {}),
+            "status": status,
+            "step_log": step_log,
+            "wall_clock_seconds": time.perf_counter() - item_start_time
         }
 
+    def _process_chunks_concurrently(self, chunks: list, result_writers: list = None, speculation: dict = None) -> list[dict]:
+        """
+        Processes chunks on a worker pool with at most `max_chunks_in_flight` running at once.
+        Results are returned in the original chunk order. A `speculation` is the extraction of the only chunk.
+        """
+        result_writers = result_writers or [None] * len(chunks)
+        if len(chunks) == 1:
+            return [self._process_single_chunk(chunks[0].item_content, chunks[0].item_title, result_writers[0], speculation)]
+
+        executor = self.chunk_executor or ThreadPoolExecutor(max_workers=self.max_chunks_in_flight, thread_name_prefix="chunk")
+        in_flight = threading.BoundedSemaphore(self.max_chunks_in_flight)
+        futures = []
+        try:
+            for chunk, result_writer in zip(chunks, result_writers):
+                in_flight.acquire()
+                # Run in a copy of this context so the chunk's spans nest under the current run
+                future = executor.submit(contextvars.copy_context().run, self._process_single_chunk,
+                                         chunk.item_content, chunk.item_title, result_writer)
+                future.add_done_callback(lambda _: in_flight.release())
+                futures.append(future)
+            return [future.result() for future in futures]
+        finally:
+            if executor is not self.chunk_executor:
+                executor.shutdown(wait=True)
 
-    def _build_summary(self, item_title, dmaze_data, warnings, overall_status, total_num_chunks: int, item_processing_duration: float) -> dict:
-        """Builds a summary object for a single result."""
+    def _build_summary(self, item_title, dmaze_data, warnings, overall_status, total_num_chunks: int, item_processing_duration: float,
+                       chunk_step_log: dict = None, timing: dict = None, match_stats: dict = None, object_count: int = None,
+                       extraction_windows: list = None, incremental_sections: dict = None) -> dict:
+        """Builds a summary object for a single result from the document-level log and the chunk's own log."""
         root_object_name = self.schema_package['schema_tree']['name'] if self.schema_package else "unknown"
-        
+        chunk_step_log = chunk_step_log or _new_step_log()
+        processing_log = {**self.processing_log, **chunk_step_log["processing_log"]}
+        errors = self.errors + chunk_step_log["errors"]
+
         final_status = overall_status
         if final_status != "Failure":
             final_status = "SuccessWithWarnings" if warnings else "Success"
@@ -88,25 +292,43 @@ class DocumentProcessor:
             "overallStatus": final_status,
             "itemTitle": item_title,
             "processingTimestamp": datetime.now().isoformat(),
-            "processingLog": self.processing_log,
-            "errorsEncountered": self.errors,
+            "processingLog": processing_log,
+            "dmazeObjectCount": object_count if object_count is not None else len(dmaze_data),
+            "timing": timing or {},
+            "entityResolution": match_stats or {},
+            # Calls made for this result only; the document's shared calls (classification, splitting, discarded
+            # speculation) are reported once per document, so summing llmUsage over results does not count them twice
+            "llmUsage": summarize_usage(chunk_step_log["llm_usage"].records),
+            "documentLlmUsage": summarize_usage(self.step_log["llm_usage"].records),
+            "extractionWindows": extraction_windows or [],
+            "markdownCompaction": self.compaction_stats,
+            "errorsEncountered": errors,
             "warningsEncountered": warnings,
         }
-        
+        if incremental_sections is not None:
+            summary_obj["incrementalSections"] = incremental_sections
+        if self.conversion_page_timings:
+            summary_obj["conversionPages"] = self.conversion_page_timings
+        if self.speculation_stats:
+            summary_obj["speculativeExtraction"] = self.speculation_stats
+
         summary_parts = []
         title_text = f"for document part '{item_title}'" if item_title else "for the document"
-        
+
         summary_parts.append(f"Summary of the import process {title_text} from the file '{self.document_filename}'.")
-        
+
         summary_parts.append(f"  - Total parts identified in document: {total_num_chunks}.")
         summary_parts.append(f"  - Status for this part: {final_status} (processed in {item_processing_duration:.2f} seconds).")
-        
-        num_errors = len(self.errors)
+        if incremental_sections:
+            summary_parts.append(f"  - Sections reused from the previous import: {incremental_sections['reused']} of "
+                                 f"{incremental_sections['sections']} ({incremental_sections['reExtracted']} re-extracted).")
+
+        num_errors = len(errors)
         num_warnings = len(warnings)
         summary_parts.append(f"  - Errors encountered for this part: {num_errors}.")
         if num_errors > 0:
-            summary_parts.append(f"    Details: {'; '.join(self.errors)}")
-        
+            summary_parts.append(f"    Details: {'; '.join(errors)}")
+
         summary_parts.append(f"  - Warnings encountered for this part: {num_warnings}.")
         if num_warnings > 0:
             # Limit the number of warnings shown directly in the human-readable summary for readability
@@ -116,61 +338,138 @@ class DocumentProcessor:
             summary_parts.append(f"    Important warnings: {'; '.join(displayed_warnings)}")
             if remaining_warnings > 0:
                 summary_parts.append(f"    ({remaining_warnings} more warnings not listed here. See 'warningsEncountered' for full list.)")
-        
+
         summary_obj["humanReadableSummary"] = "\n".join(summary_parts)
-        
+
         return summary_obj
 
     # Note: run() returns a list of results
-    def run(self) -> list[dict]:
-        """Orchestrates the full processing pipeline and returns a list of results."""
+    def run(self, result_writer_factory=None) -> list[dict]:
+        """
+        Orchestrates the full processing pipeline and returns a list of results.
+        With a `result_writer_factory(index, item_title, num_results)` (see result_writer.ndjson_writer_factory),
+        each result's Dmaze objects are streamed to its writer as they are produced, followed by the summary;
+        the returned results then carry the summary and an empty 'dmaze_data'.
+        """
+        # Without a tracer of its own the run reports to the caller's tracer, if any
+        with use_tracer(self.tracer) if self.tracer else nullcontext():
+            with span("Document Import", inputFile=self.document_filename, inputBytes=get_document_size(self.document)):
+                return self._run(result_writer_factory)
+
+    def _run(self, result_writer_factory=None) -> list[dict]:
         results_list = []
-        
+        result_writers = []
+        speculation = None
+        run_start_time = time.perf_counter()
+
         try:
             # Steps 1-3: Common preparations
-            self.schema_package = self._log_step("Template Processing", lambda: process_template_hierarchically(self.schema_content))
-            self.markdown_content = self._log_step("Document Conversion", lambda: convert_file_to_markdown(self.document_bytes, self.document_filename))
+            if self.schema_package is None:
+                self.schema_package = self._log_step("Template Processing", lambda: process_template_hierarchically(self.schema_content))
+            else:
+                self.processing_log["Template Processing"] = "Reused (0.00s)"
+            conversion_info = {}
+            self.markdown_content = self._log_step("Document Conversion", lambda: convert_file_to_markdown(
+                self.document, self.document_filename, use_cache=self.use_conversion_cache, conversion_info=conversion_info))
+            self.document = None
+            cache_outcome = conversion_info.get("cache")
+            self.processing_log["Document Conversion Cache"] = f"Hit ({cache_outcome})" if cache_outcome in ("memory", "disk") else "Miss" if cache_outcome == "miss" else "Bypassed"
+            self.conversion_page_timings = conversion_info.get("pageTimings")
+            if self.conversion_page_timings:
+                slowest = max(self.conversion_page_timings, key=lambda page: page["seconds"])
+                self.processing_log["Document Conversion Pages"] = (f"{len(self.conversion_page_timings)} pages "
+                                                                    f"(slowest: page {slowest['page']}, {slowest['seconds']:.2f}s)")
+            if self.compaction_rules:
+                self.markdown_content, self.compaction_stats = self._log_step("Markdown Compaction",
+                    lambda: compact_markdown(self.markdown_content, self.compaction_rules))
+                print(f"  - Compaction removed {self.compaction_stats['charsRemoved']} characters "
+                      f"({self.compaction_stats['tokensRemoved']} of {self.compaction_stats['tokensBefore']} tokens).")
             root_name = self.schema_package['schema_tree']['name']
-            
-            # Pass the ai_client instance
-            self.doc_type = self._log_step("Document Classification", lambda: classify_document_type(self.ai_client, self.markdown_content, root_name))
-            
+
+            # Classify locally from the heading structure; only ask the model when the result is uncertain
+            analysis = self._log_step("Structural Pre-classification", lambda: analyze_document_structure(self.markdown_content))
+            if analysis.needs_model:
+                if self.speculative_extraction:
+                    speculation = self._start_speculative_extraction()
+                self.doc_type = self._log_step("Document Classification", lambda: classify_document_type(self.ai_client, self.markdown_content, root_name))
+                self.processing_log["Document Classification Path"] = f"model (local score {analysis.multiple_items_score:.2f} in uncertain band)"
+                classified_at = time.perf_counter()
+                if speculation and self.doc_type == "multiple_items":
+                    # Calls not yet sent are dropped; the discarded work is accounted for once the items are done
+                    speculation["cancel_event"].set()
+            else:
+                self.doc_type = analysis.document_type
+                self.processing_log["Document Classification Path"] = f"local ({analysis.document_type}, confidence {analysis.confidence:.2f})"
+                print(f"  - Document classified locally as: {analysis.document_type}. Reasoning: {analysis.reasoning}")
+
             # Step 4: Build a list of chunks to process
             chunks_to_process = []
             if self.doc_type == "multiple_items":
                 # Pass the ai_client instance
-                chunks_to_process = self._log_step("Document Splitting", 
+                chunks_to_process = self._log_step("Document Splitting",
                     lambda: split_document_into_items(self.ai_client, self.markdown_content, root_name))
             else:
                 class SingleChunk:
                     item_title = None
                     item_content = self.markdown_content
+                    warnings = []
                 chunks_to_process.append(SingleChunk())
 
             total_num_chunks = len(chunks_to_process)
 
-            # Step 5: Process each chunk individually
-            for chunk in chunks_to_process:
-                item_start_time = time.time()
-                chunk_result = self._process_single_chunk(chunk.item_content, chunk.item_title)
-                item_processing_duration = time.time() - item_start_time
+            if result_writer_factory is not None:
+                result_writers = [result_writer_factory(i, chunk.item_title, total_num_chunks) for i, chunk in enumerate(chunks_to_process)]
 
+            # Step 5: Process the chunks on the worker pool, keeping their original order
+            kept_speculation = speculation if speculation and self.doc_type != "multiple_items" else None
+            chunk_results = self._process_chunks_concurrently(chunks_to_process, result_writers, kept_speculation)
+            if speculation:
+                self.speculation_stats = self._finish_speculation(speculation, kept_speculation is not None, classified_at)
+
+            document_wall_clock = time.perf_counter() - run_start_time
+            document_summed_steps = sum(self.step_log["step_durations"].values()) + sum(
+                sum(chunk_result["step_log"]["step_durations"].values()) for chunk_result in chunk_results)
+
+            for chunk, chunk_result in zip(chunks_to_process, chunk_results):
+                timing = {
+                    "itemWallClockSeconds": round(chunk_result["wall_clock_seconds"], 3),
+                    "itemSummedStepSeconds": round(sum(chunk_result["step_log"]["step_durations"].values()), 3),
+                    "documentWallClockSeconds": round(document_wall_clock, 3),
+                    "documentSummedStepSeconds": round(document_summed_steps, 3),
+                }
                 summary = self._build_summary(
                     item_title=chunk.item_title,
                     dmaze_data=chunk_result["dmaze_data"],
-                    warnings=chunk_result["warnings"],
-                    overall_status="Success",
+                    # Splitting problems (e.g. an item merged into this one) come first
+                    warnings=chunk.warnings + chunk_result["warnings"],
+                    overall_status=chunk_result["status"],
                     total_num_chunks=total_num_chunks,
-                    item_processing_duration=item_processing_duration
+                    item_processing_duration=chunk_result["wall_clock_seconds"],
+                    chunk_step_log=chunk_result["step_log"],
+                    timing=timing,
+                    match_stats=chunk_result["match_stats"],
+                    object_count=chunk_result["object_count"],
+                    extraction_windows=chunk_result["extraction_windows"],
+                    incremental_sections=chunk_result["incremental_sections"]
                 )
-                results_list.append({
-                    "summary": summary,
-                    "dmaze_data": chunk_result["dmaze_data"]
-                })
+                result = {"summary": summary, "dmaze_data": chunk_result["dmaze_data"]}
+                if result_writers:
+                    # The summary is the trailing record of a streamed result
+                    result_writer = result_writers[len(results_list)]
+                    result_writer.write_summary(summary)
+                    result["output_path"] = result_writer.output_path
+                results_list.append(result)
 
         except Exception as e:
+            if speculation and self.speculation_stats is None:
+                # Calls already sent are waited for, so none outlive the run and their usage is reported
+                speculation["cancel_event"].set()
+                self.speculation_stats = self._finish_speculation(speculation, False, time.perf_counter(), reason="the import failed")
             print(f"\nCRITICAL ERROR in workflow: {e}")
             summary = self._build_summary(None, [], [], "Failure", total_num_chunks=0, item_processing_duration=0.0)
             return [{"summary": summary, "dmaze_data": []}]
-        
-        return results_list
\ No newline at end of file
+        finally:
+            for result_writer in result_writers:
+                result_writer.close()
+
+        return results_list
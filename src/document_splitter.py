@@ -1,30 +1,171 @@
-from typing import List
+import re
+from typing import List, Optional
 from .ai_client import AIClient
-from .models import MultiItemDocument, DocumentChunk
+from .models import DocumentBoundaries, DocumentChunk, ItemBoundary
+
+_FENCE_PATTERN = re.compile(r'^\s*(```|~~~)')
+
+def find_headings(markdown_content: str, max_level: int = 6) -> List[tuple]:
+    """
+    Returns (start_offset, level, title) for every ATX heading up to `max_level`,
+    ignoring lines inside fenced code blocks. Offsets point at the start of the heading line.
+    """
+    headings = []
+    in_fence = False
+    offset = 0
+    for line in markdown_content.splitlines(keepends=True):
+        if _FENCE_PATTERN.match(line):
+            in_fence = not in_fence
+        elif not in_fence and line.startswith('#'):
+            stripped = line.rstrip()
+            level = len(stripped) - len(stripped.lstrip('#'))
+            if level <= max_level and (len(stripped) == level or stripped[level] in ' \t'):
+                title = stripped[level:].strip().rstrip('#').strip()
+                if title:
+                    headings.append((offset, level, title))
+        offset += len(line)
+    return headings
+
+
+def split_document_by_headings(markdown_content: str) -> Optional[List[DocumentChunk]]:
+    """
+    Splits the document locally at its top-level ('#') headings using character offsets.
+    Any preamble before the first heading is kept with the first item so no content is lost.
+    Returns None when the heading structure is ambiguous (fewer than two top-level headings).
+    """
+    top_level = [(offset, title) for offset, level, title in find_headings(markdown_content, max_level=1)]
+    if len(top_level) < 2:
+        return None
+
+    chunks = []
+    for i, (offset, title) in enumerate(top_level):
+        start = 0 if i == 0 else offset
+        end = top_level[i + 1][0] if i + 1 < len(top_level) else len(markdown_content)
+        chunks.append(DocumentChunk(item_title=title, item_content=markdown_content[start:end], start_offset=start, end_offset=end))
+    return chunks
+
+
+def _find_anchor(markdown_content: str, anchor: str, search_from: int, search_to: int = None, last: bool = False) -> Optional[tuple]:
+    """
+    Finds an anchor verbatim, falling back to a whitespace- and case-insensitive match.
+    With `last=True` the final occurrence within the range is used. Returns (start, end) or None.
+    """
+    anchor = anchor.strip()
+    if not anchor:
+        return None
+    search_to = len(markdown_content) if search_to is None else search_to
+    index = markdown_content.rfind(anchor, search_from, search_to) if last else markdown_content.find(anchor, search_from, search_to)
+    if index != -1:
+        return index, index + len(anchor)
+    pattern = re.compile(r'\s+'.join(re.escape(word) for word in anchor.split()), re.IGNORECASE)
+    match = None
+    for match in pattern.finditer(markdown_content, search_from, search_to):
+        if not last:
+            break
+    return (match.start(), match.end()) if match else None
+
+
+def _find_start(markdown_content: str, boundary: ItemBoundary, search_from: int) -> Optional[tuple]:
+    """
+    Finds where an item starts: its start anchor, then (for anchors the model did not copy exactly) the anchor's
+    words ignoring punctuation, its first five and first three words, and finally the item title.
+    """
+    span = _find_anchor(markdown_content, boundary.start_anchor, search_from)
+    if span:
+        return span
+    words = re.findall(r'\w+', boundary.start_anchor)
+    for count in (len(words), 5, 3):
+        if 0 < count <= len(words):
+            pattern = re.compile(r'\W+'.join(re.escape(word) for word in words[:count]), re.IGNORECASE)
+            match = pattern.search(markdown_content, search_from)
+            if match:
+                return match.start(), match.end()
+    return _find_anchor(markdown_content, boundary.item_title, search_from)
+
+
+def _chunks_from_boundaries(markdown_content: str, boundaries: DocumentBoundaries) -> List[DocumentChunk]:
+    """
+    Resolves the model's anchors to character offsets and slices the items locally. An item that cannot be
+    located is not dropped with its text: the text stays with the item before it (or the first item) and that
+    item's result carries a warning.
+    """
+    starts = []
+    unlocated = {}  # index in `starts` of the item that takes in the text of unlocated items -> their titles
+    leading_unlocated = False
+    cursor = 0
+    for boundary in boundaries.items:
+        start_span = _find_start(markdown_content, boundary, cursor)
+        if not start_span:
+            print(f"  - WARNING: Could not locate start of item '{boundary.item_title}' in the document. Merging it into its neighbour.")
+            leading_unlocated = leading_unlocated or not starts
+            unlocated.setdefault(max(len(starts) - 1, 0), []).append(boundary.item_title)
+            continue
+        starts.append((boundary, start_span[0]))
+        cursor = start_span[1]
+
+    if not starts:
+        if not boundaries.items:
+            return []
+        titles = ", ".join(f"'{boundary.item_title}'" for boundary in boundaries.items)
+        return [DocumentChunk(item_title=boundaries.items[0].item_title, item_content=markdown_content, start_offset=0,
+                              end_offset=len(markdown_content),
+                              warnings=[f"No item could be located in the document ({titles}); it was processed as one item."])]
+
+    chunks = []
+    for i, (boundary, start) in enumerate(starts):
+        next_start = starts[i + 1][1] if i + 1 < len(starts) else len(markdown_content)
+        warnings = [f"Item '{title}' could not be located in the document; its text is part of item '{boundary.item_title}'."
+                    for title in unlocated.get(i, [])]
+        if i == 0 and leading_unlocated:
+            # The unlocated items come before the first located one, so their text does too
+            start = 0
+        # An item ends at its end anchor when found, otherwise where the next item begins; an item that takes in
+        # unlocated items runs up to the next one so that their text is kept
+        end_span = None if warnings else _find_anchor(markdown_content, boundary.end_anchor, start, next_start, last=True)
+        end = end_span[1] if end_span else next_start
+        chunks.append(DocumentChunk(item_title=boundary.item_title, item_content=markdown_content[start:end], start_offset=start,
+                                    end_offset=end, warnings=warnings))
+    return chunks
+
 
 def split_document_into_items(ai_client: AIClient, markdown_content: str, root_object_name: str) -> List[DocumentChunk]:
     """
-    Uses the centralized AIClient to split a document into a list of distinct items.
+    Splits a document into a list of distinct items.
+    Top-level headings are used directly when present; otherwise the AIClient is asked only for
+    item titles and start/end anchors, and the content is sliced locally from `markdown_content`.
     """
+    chunks = split_document_by_headings(markdown_content)
+    if chunks is not None:
+        print(f"  - Split document locally into {len(chunks)} item(s) at top-level headings.")
+        return chunks
+
+    print("  - Heading structure is ambiguous. Asking the model for item boundaries...")
     system_prompt = f"""
-    You are a document analysis and segmentation expert. Your task is to split the following Markdown document into a list of distinct, self-contained '{root_object_name}' items.
-    
-    Each new item almost always starts with a top-level Markdown heading (a single '#').
-    You must capture the title from the heading and all the content that belongs to that item until the next top-level heading or the end of the document.
-    """
-    
-    user_prompt = f"Analyze and split the following document:\n\n{markdown_content}"
-    
+    You are a document analysis and segmentation expert. Your task is to find the boundaries of the distinct, self-contained '{root_object_name}' items in the following Markdown document.
+
+    For each item, in document order, return:
+    1. `item_title`: The title of the item.
+    2. `start_anchor`: The first 5-10 words of the item, copied EXACTLY as they appear in the document.
+    3. `end_anchor`: The last 5-10 words of the item, copied EXACTLY as they appear in the document.
+
+    Do NOT return the content of the items, only the anchors.
+    """
+
+    user_prompt = f"Find the item boundaries in the following document:\n\n{markdown_content}"
+
     try:
         # Use the centralized method with a response_model
-        structured_document = ai_client.get_structured_response(
+        boundaries = ai_client.get_structured_response(
             system_prompt=system_prompt,
             user_prompt=user_prompt,
-            response_model=MultiItemDocument,
+            response_model=DocumentBoundaries,
             model="gpt-4o",
-            max_retries=2
+            max_retries=2,
+            step_name="splitting"
         )
-        return structured_document.items
+        chunks = _chunks_from_boundaries(markdown_content, boundaries)
+        print(f"  - Split document into {len(chunks)} item(s) using model-provided anchors.")
+        return chunks
     except Exception as e:
         print(f"  - ERROR: Document splitting failed: {e}")
-        return []
\ No newline at end of file
+        return []
@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Dict, Iterable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import api_simulator
+
+DEFAULT_TTL_SECONDS = 300
+
+def _content_version(value) -> str:
+    canonical = json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+class EntityCatalogClient:
+    """
+    Client for entity lists (GET /entities) and entity metadata (GET /meta) of the Dmaze API.
+    Responses are kept in an in-process cache for `ttl_seconds`; after that they are revalidated
+    against the server's version tags and only re-downloaded when they changed.
+    Many types are fetched in one bulk request over a pooled keep-alive HTTP session.
+    With no `base_url` the local api_simulator functions are used as the backend instead of HTTP.
+    Returned values are shared with the cache and must be treated as read-only.
+    """
+    def __init__(self, base_url: Optional[str] = None, ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 pool_maxsize: int = 10, timeout: float = 10.0):
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.ttl_seconds = ttl_seconds
+        self.timeout = timeout
+        self._cache = {"entities": {}, "meta": {}}  # resource -> type -> (value, version, fetched_at)
+        self._lock = threading.Lock()
+        self.session = None
+        if self.base_url:
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=2)
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+
+    def get_entities(self, entity_type: str) -> list[dict] | None:
+        if not entity_type: return None
+        return self._get_bulk("entities", [entity_type]).get(entity_type)
+
+    def get_metadata(self, entity_type: str) -> dict | None:
+        if not entity_type: return None
+        return self._get_bulk("meta", [entity_type]).get(entity_type)
+
+    def get_entities_bulk(self, entity_types: Iterable[str]) -> Dict[str, list[dict] | None]:
+        return self._get_bulk("entities", entity_types)
+
+    def get_metadata_bulk(self, entity_types: Iterable[str]) -> Dict[str, dict | None]:
+        return self._get_bulk("meta", entity_types)
+
+    def _get_bulk(self, resource: str, entity_types: Iterable[str]) -> dict:
+        """Returns type -> value, serving fresh entries from the cache and fetching the rest in one request."""
+        entity_types = [t for t in dict.fromkeys(entity_types) if t]
+        now = time.monotonic()
+        results, stale = {}, {}
+        with self._lock:
+            cache = self._cache[resource]
+            for entity_type in entity_types:
+                entry = cache.get(entity_type)
+                if entry and now - entry[2] < self.ttl_seconds:
+                    results[entity_type] = entry[0]
+                else:
+                    stale[entity_type] = entry[1] if entry else None
+
+        if not stale:
+            return results
+
+        fetched, versions, not_modified = self._fetch(resource, stale)
+        with self._lock:
+            cache = self._cache[resource]
+            for entity_type in not_modified:
+                value, version, _ = cache[entity_type]
+                cache[entity_type] = (value, version, now)
+                results[entity_type] = value
+            for entity_type, value in fetched.items():
+                cache[entity_type] = (value, versions.get(entity_type), now)
+                results[entity_type] = value
+        return results
+
+    def _fetch(self, resource: str, known_versions: Dict[str, Optional[str]]) -> tuple:
+        """Fetches the given types. Returns (values, versions, types whose known version is still current)."""
+        if not self.base_url:
+            values, versions, not_modified = {}, {}, []
+            lookup = api_simulator.get_entities_from_api if resource == "entities" else api_simulator.get_entity_schema_from_api
+            for entity_type, known_version in known_versions.items():
+                value = lookup(entity_type)
+                versions[entity_type] = _content_version(value)
+                if known_version and known_version == versions[entity_type]:
+                    not_modified.append(entity_type)
+                else:
+                    values[entity_type] = value
+            return values, versions, not_modified
+
+        known = ",".join(f"{t}:{v}" for t, v in known_versions.items() if v)
+        params = {"types": ",".join(known_versions)}
+        if known:
+            params["known"] = known
+        print(f"  - [CATALOG] GET {resource} for {len(known_versions)} type(s) in one request")
+        response = self.session.get(f"{self.base_url}/{resource}", params=params, timeout=self.timeout)
+        response.raise_for_status()
+        body = response.json()
+        not_modified = [t for t in body.get("notModified", []) if t in self._cache[resource]]
+        return body.get("items", {}), body.get("versions", {}), not_modified
+
+    def clear(self):
+        with self._lock:
+            for cache in self._cache.values():
+                cache.clear()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+def get_catalog_client() -> EntityCatalogClient:
+    """The process-wide catalog client. Uses DMAZE_API_BASE_URL when set, otherwise the local simulator."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = EntityCatalogClient(base_url=os.getenv("DMAZE_API_BASE_URL"))
+        return _default_client
@@ -0,0 +1,128 @@
+import re
+import unicodedata
+from typing import Dict, List, Set, Optional
+
+# Letters that Unicode decomposition does not reduce to an ASCII base letter
+_SPECIAL_LETTERS = str.maketrans({"ø": "o", "æ": "ae", "ß": "ss", "đ": "d", "ł": "l", "þ": "th", "œ": "oe"})
+_NON_WORD = re.compile(r'[^\w]+')
+
+# Minimum fuzzy score needed to accept a match without the model, per entity type.
+DEFAULT_FUZZY_THRESHOLD = 0.8
+FUZZY_THRESHOLDS = {
+    "user": 0.85,
+    "people": 0.85,
+}
+# The best fuzzy candidate must beat the runner-up by this much, otherwise the snippet is ambiguous.
+FUZZY_MARGIN = 0.1
+
+RESOLUTION_TIERS = ("exact", "normalized", "fuzzy")
+
+
+def normalize_text(text: str) -> str:
+    """Casefolds, strips diacritics and punctuation, and collapses whitespace."""
+    text = unicodedata.normalize("NFKD", text.casefold().translate(_SPECIAL_LETTERS))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+def _trigrams(normalized: str) -> Set[str]:
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def fuzzy_score(normalized_a: str, normalized_b: str, trigrams_a: Set[str] = None, trigrams_b: Set[str] = None) -> float:
+    """Best of token-set overlap and character-trigram overlap (both Dice coefficients, 0..1)."""
+    tokens_a, tokens_b = set(normalized_a.split()), set(normalized_b.split())
+    if not tokens_a or not tokens_b:
+        return 0.0
+    token_score = 2 * len(tokens_a & tokens_b) / (len(tokens_a) + len(tokens_b))
+    trigrams_a = trigrams_a if trigrams_a is not None else _trigrams(normalized_a)
+    trigrams_b = trigrams_b if trigrams_b is not None else _trigrams(normalized_b)
+    trigram_score = 2 * len(trigrams_a & trigrams_b) / (len(trigrams_a) + len(trigrams_b))
+    return max(token_score, trigram_score)
+
+
+class _CandidateIndex:
+    """Lookup structures for the candidates of one entity type."""
+    def __init__(self, candidates: List[Dict], display_field: str):
+        self.exact = {}
+        self.normalized = {}
+        self.fuzzy_entries = []
+        for candidate in candidates:
+            display_value = candidate.get(display_field)
+            entity_id = candidate.get("id")
+            if not display_value or not entity_id:
+                continue
+            display_value = str(display_value).strip()
+            normalized = normalize_text(display_value)
+            self.exact.setdefault(display_value, set()).add(entity_id)
+            self.normalized.setdefault(normalized, set()).add(entity_id)
+            self.fuzzy_entries.append((entity_id, display_value, normalized, _trigrams(normalized)))
+
+    def resolve(self, text: str, threshold: float) -> Optional[tuple]:
+        """Returns (tier, record) for a confident local match, or None."""
+        ids = self.exact.get(text.strip())
+        if ids and len(ids) == 1:
+            return "exact", {"id": next(iter(ids)), "confidence": "High", "reasoning": "Exact match"}
+
+        normalized = normalize_text(text)
+        if not normalized:
+            return None
+        ids = self.normalized.get(normalized)
+        if ids:
+            if len(ids) == 1:
+                return "normalized", {"id": next(iter(ids)), "confidence": "High",
+                                      "reasoning": "Exact match after normalizing case, whitespace and diacritics"}
+            # Several candidates share the same normalized name; let the model decide
+            return None
+
+        text_trigrams = _trigrams(normalized)
+        best_id, best_display, best_score, runner_up_score = None, None, 0.0, 0.0
+        for entity_id, display_value, candidate_normalized, candidate_trigrams in self.fuzzy_entries:
+            score = fuzzy_score(normalized, candidate_normalized, text_trigrams, candidate_trigrams)
+            if score > best_score:
+                if entity_id != best_id:
+                    runner_up_score = best_score
+                best_id, best_display, best_score = entity_id, display_value, score
+            elif score > runner_up_score and entity_id != best_id:
+                runner_up_score = score
+
+        if best_id and best_score >= threshold and best_score - runner_up_score >= FUZZY_MARGIN:
+            confidence = "High" if best_score >= 0.95 else "Medium"
+            return "fuzzy", {"id": best_id, "confidence": confidence,
+                             "reasoning": f"Fuzzy match on '{best_display}' (score {best_score:.2f})"}
+        return None
+
+
+def resolve_entities_locally(
+    items_to_match: Dict[str, Set[str]],
+    valid_entities_map: Dict[str, List[Dict]],
+    display_fields: Dict[str, str] = None,
+    thresholds: Dict[str, float] = None
+) -> tuple:
+    """
+    Resolves snippets without the model using exact, normalized and fuzzy matching.
+    Returns (resolved, residual, tier_counts):
+      - resolved: entity_type -> input_text -> {id, confidence, reasoning}
+      - residual: entity_type -> set of snippets that still need the model
+      - tier_counts: number of snippets resolved by each tier
+    """
+    display_fields = display_fields or {}
+    thresholds = {**FUZZY_THRESHOLDS, **(thresholds or {})}
+    resolved = {}
+    residual = {}
+    tier_counts = {tier: 0 for tier in RESOLUTION_TIERS}
+
+    for entity_type, texts in items_to_match.items():
+        index = _CandidateIndex(valid_entities_map.get(entity_type) or [], display_fields.get(entity_type, "name"))
+        threshold = thresholds.get(entity_type, DEFAULT_FUZZY_THRESHOLD)
+        for text in texts:
+            outcome = index.resolve(text, threshold)
+            if outcome:
+                tier, record = outcome
+                resolved.setdefault(entity_type, {})[text] = record
+                tier_counts[tier] += 1
+            else:
+                residual.setdefault(entity_type, set()).add(text)
+
+    return resolved, residual, tier_counts
@@ -0,0 +1,172 @@
+"""
+A local stand-in for the OpenAI chat completions endpoint, for exercising rate limiting and retries
+without network access or cost. Answers are generated from the requested JSON schema (or tool schema),
+with configurable latency and injected 429 responses:
+
+    python -m src.fake_openai_server --port 8765 --throttle-rate 0.3 --latency 0.5
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake python main.py ...
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def example_from_schema(schema: dict, definitions: dict = None):
+    """Builds the smallest value that satisfies a JSON schema (first enum value, nulls where allowed, empty arrays)."""
+    definitions = definitions if definitions is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return example_from_schema(definitions.get(schema["$ref"].split("/")[-1], {}), definitions)
+    for combinator in ("anyOf", "oneOf", "allOf"):
+        if combinator in schema:
+            options = schema[combinator]
+            non_null = [option for option in options if option.get("type") != "null"]
+            return example_from_schema((non_null or options)[0], definitions)
+    if "enum" in schema:
+        return next((value for value in schema["enum"] if value is not None), schema["enum"][0])
+    if "const" in schema:
+        return schema["const"]
+
+    schema_type = schema.get("type", "object")
+    if isinstance(schema_type, list):
+        schema_type = next((t for t in schema_type if t != "null"), "null")
+    if schema_type == "object":
+        properties = schema.get("properties", {})
+        return {name: example_from_schema(prop, definitions) for name, prop in properties.items()}
+    if schema_type == "array":
+        return []
+    if schema_type == "string":
+        return "example"
+    if schema_type in ("integer", "number"):
+        return 0
+    if schema_type == "boolean":
+        return False
+    return None
+
+
+class FakeOpenAIState:
+    """Shared counters and settings of one fake server."""
+    def __init__(self, throttle_rate: float = 0.0, throttle_every: int = 0, retry_after: float = 1.0,
+                 latency: float = 0.0, latency_jitter: float = 0.0, seed: int = None):
+        self.throttle_rate = throttle_rate
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.throttled = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def should_throttle(self) -> bool:
+        with self.lock:
+            self.requests += 1
+            throttle = (self.throttle_every and self.requests % self.throttle_every == 0) or self.random.random() < self.throttle_rate
+            if throttle:
+                self.throttled += 1
+            return bool(throttle)
+
+
+class FakeOpenAIRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive, like the real API
+    protocol_version = "HTTP/1.1"
+    state: FakeOpenAIState = None
+
+    def setup(self):
+        super().setup()
+        with self.state.lock:
+            self.state.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: dict = None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == "/stats":
+            state = self.state
+            return self._send_json(200, {"requests": state.requests, "connections": state.connections, "throttled": state.throttled,
+                                         "maxInFlight": state.max_in_flight})
+        self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith("/chat/completions"):
+            return self._send_json(404, {"error": {"message": "Not found"}})
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        state = self.state
+
+        if state.should_throttle():
+            return self._send_json(429, {"error": {"message": "Rate limit reached (injected by fake server)", "type": "requests",
+                                                   "code": "rate_limit_exceeded"}},
+                                   {"retry-after": f"{state.retry_after:g}"})
+
+        with state.lock:
+            state.in_flight += 1
+            state.max_in_flight = max(state.max_in_flight, state.in_flight)
+        try:
+            time.sleep(max(0.0, state.latency + state.random.uniform(-state.latency_jitter, state.latency_jitter)))
+        finally:
+            with state.lock:
+                state.in_flight -= 1
+
+        message = {"role": "assistant", "content": None}
+        if request.get("tools"):
+            function = request["tools"][0]["function"]
+            arguments = example_from_schema(function.get("parameters", {}))
+            message["tool_calls"] = [{"id": "call_fake", "type": "function",
+                                      "function": {"name": function["name"], "arguments": json.dumps(arguments)}}]
+        else:
+            response_format = request.get("response_format") or {}
+            schema = (response_format.get("json_schema") or {}).get("schema", {"type": "object", "properties": {}})
+            message["content"] = json.dumps(example_from_schema(schema))
+
+        prompt_chars = sum(len(m.get("content") or "") for m in request.get("messages", []))
+        completion_chars = len(message["content"] or message.get("tool_calls", [{}])[0].get("function", {}).get("arguments", ""))
+        usage = {"prompt_tokens": prompt_chars // 4, "completion_tokens": completion_chars // 4}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        self._send_json(200, {
+            "id": f"chatcmpl-fake-{state.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if request.get("tools") else "stop"}],
+            "usage": usage,
+        })
+
+
+def create_fake_openai_server(host: str = "127.0.0.1", port: int = 8765, state: FakeOpenAIState = None) -> ThreadingHTTPServer:
+    """Creates (but does not start) a fake server; serve it with serve_forever(), e.g. on a daemon thread."""
+    handler = type("BoundFakeOpenAIRequestHandler", (FakeOpenAIRequestHandler,), {"state": state or FakeOpenAIState()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat completions server with injected 429s and latency.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Probability of answering a request with 429.")
+    parser.add_argument("--throttle-every", type=int, default=0, help="Answer every Nth request with 429.")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Seconds sent in the retry-after header of a 429.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds each successful request takes.")
+    parser.add_argument("--latency-jitter", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = create_fake_openai_server(args.host, args.port, FakeOpenAIState(
+        args.throttle_rate, args.throttle_every, args.retry_after, args.latency, args.latency_jitter))
+    print(f"Fake OpenAI server listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
@@ -0,0 +1,458 @@
+"""
+A resident import service: documents are uploaded over HTTP, queued and processed by warm worker threads
+that share the converter, the compiled schema packages and the pooled AI client, so the per-document cost
+of interpreter start, imports and template compilation is paid once per process instead of once per document.
+
+    python main.py --serve --port 8080 --service-workers 4
+
+    POST /templates                               template JSON              -> {"templateId": ...}
+    POST /jobs?templateId=<id>&filename=<name>    raw document bytes         -> 202 {"jobId": ...} (spooled to disk, not memory)
+    GET  /jobs/{id}                               status and timing
+    GET  /jobs/{id}/result                        the results, once the job is finished
+    GET  /jobs/{id}/stream                        NDJSON events as they are produced: {"result": i, "object": {...}},
+                                                  {"result": i, "summary": {...}}, then {"status": ..., "job": {...}}
+    GET  /stats                                   queue depth, workers, jobs by status, recent job timings and, with
+                                                  speculative extraction, its outcomes per template
+"""
+import os
+import json
+import time
+import queue
+import uuid
+import argparse
+import threading
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from .ai_client import get_ai_client, load_environment
+from .document_converter import DocumentSource, get_document_size, spool_stream, warm_up_converter
+from .document_processor import DocumentProcessor, summarize_speculation
+from .schema_processor import process_template_hierarchically
+
+DEFAULT_SERVICE_WORKERS = 4
+DEFAULT_MAX_QUEUED_JOBS = 100
+DEFAULT_MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+# Registered templates beyond this many are dropped, least recently used first; their ids then answer 404
+DEFAULT_MAX_TEMPLATES = 256
+# Finished jobs (and their results) are kept for polling until this many newer jobs have finished
+DEFAULT_RETAINED_JOBS = 200
+RECENT_TIMINGS = 50
+
+
+class ImportJob:
+    """One uploaded document and everything produced for it; events are appended as results are streamed."""
+    def __init__(self, template_id: str, template: tuple, document: DocumentSource, document_filename: str, owns_file: bool = False):
+        self.id = uuid.uuid4().hex
+        self.template_id = template_id
+        # (schema content, compiled package), held by the job so it still runs if the template is evicted meanwhile
+        self.template = template
+        self.document = document
+        self.document_filename = document_filename
+        # A spooled upload is removed once the job is finished
+        self.owns_file = owns_file
+        self.input_bytes = get_document_size(document)
+        self.status = "queued"
+        self.error = None
+        self.results = None
+        self.events = []
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.queue_seconds = None
+        self.run_seconds = None
+        self.worker = None
+        self.condition = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def add_event(self, event: dict):
+        with self.condition:
+            self.events.append(event)
+            self.condition.notify_all()
+
+    def describe(self) -> dict:
+        summaries = [result["summary"] for result in self.results or []]
+        return {
+            "jobId": self.id,
+            "status": self.status,
+            "error": self.error,
+            "templateId": self.template_id,
+            "documentFilename": self.document_filename,
+            "inputBytes": self.input_bytes,
+            "worker": self.worker,
+            "submittedAt": self.submitted_at,
+            "queueSeconds": round(self.queue_seconds, 3) if self.queue_seconds is not None else None,
+            "runSeconds": round(self.run_seconds, 3) if self.run_seconds is not None else None,
+            "results": len(summaries) if self.results is not None else None,
+            "statuses": [summary.get("overallStatus") for summary in summaries],
+            "dmazeObjectCount": sum(summary.get("dmazeObjectCount", 0) for summary in summaries),
+        }
+
+
+class JobStreamWriter:
+    """A result writer (see DocumentProcessor.run) that turns one result into events on its job."""
+    output_path = None
+
+    def __init__(self, job: ImportJob, index: int):
+        self.job = job
+        self.index = index
+        self.object_count = 0
+
+    def write_object(self, dmaze_object: dict):
+        self.job.add_event({"result": self.index, "object": dmaze_object})
+        self.object_count += 1
+
+    def write_summary(self, summary: dict):
+        self.job.add_event({"result": self.index, "summary": summary})
+
+    def close(self):
+        pass
+
+
+class ImportService:
+    """
+    A job queue served by `workers` threads. Templates are compiled once when registered and the
+    compiled package is handed to every job that uses it; at most `max_templates` are kept, least recently used
+    (registered or submitted to) dropped first. With `speculative_extraction` (see DocumentProcessor),
+    the time saved and tokens wasted are totalled per template, to show for which templates the mode pays off.
+    """
+    def __init__(self, workers: int = DEFAULT_SERVICE_WORKERS, max_queued_jobs: int = DEFAULT_MAX_QUEUED_JOBS,
+                 retained_jobs: int = DEFAULT_RETAINED_JOBS, ai_client=None, speculative_extraction: bool = False,
+                 max_templates: int = DEFAULT_MAX_TEMPLATES):
+        self.worker_count = max(1, workers)
+        self.max_templates = max(1, max_templates)
+        self.retained_jobs = retained_jobs
+        self.ai_client = ai_client
+        self.speculative_extraction = speculative_extraction
+        self.speculation_by_template = {}
+        self.queue = queue.Queue(maxsize=max_queued_jobs)
+        self.templates = OrderedDict()
+        self.jobs = OrderedDict()
+        self.busy_workers = 0
+        self.completed_jobs = 0
+        self.failed_jobs = 0
+        self.recent_timings = deque(maxlen=RECENT_TIMINGS)
+        self.started_at = None
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        """Warms the shared converter and AI client, then starts the workers."""
+        load_environment()
+        warm_up_converter()
+        if self.ai_client is None:
+            self.ai_client = get_ai_client()
+        self.started_at = time.time()
+        for i in range(self.worker_count):
+            thread = threading.Thread(target=self._work, name=f"import-worker-{i + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def register_template(self, schema_content: dict) -> str:
+        """Compiles (or reuses) a template and returns its id, the template content hash."""
+        package = process_template_hierarchically(schema_content)
+        if "error" in package:
+            raise ValueError(package["error"])
+        template_id = package["template_hash"]
+        with self._lock:
+            self.templates[template_id] = (schema_content, package)
+            self.templates.move_to_end(template_id)
+            while len(self.templates) > self.max_templates:
+                evicted_id, _ = self.templates.popitem(last=False)
+                self.speculation_by_template.pop(evicted_id, None)
+        return template_id
+
+    def submit(self, template_id: str, document: DocumentSource, document_filename: str, owns_file: bool = False) -> ImportJob:
+        """
+        Queues a document: its bytes, a path or a binary stream (spooled to a temporary file right away, since
+        the job runs later). With `owns_file`, `document` is the path of a temporary file that the service removes
+        once the job is finished (or rejected). Raises KeyError for an unknown (or evicted) template and queue.Full
+        when the queue is full.
+        """
+        try:
+            with self._lock:
+                if template_id not in self.templates:
+                    raise KeyError(template_id)
+                self.templates.move_to_end(template_id)
+                template = self.templates[template_id]
+            if not isinstance(document, (bytes, str, os.PathLike)):
+                document = spool_stream(document, os.path.splitext(document_filename)[1].lower())
+                owns_file = True
+            job = ImportJob(template_id, template, document, document_filename, owns_file)
+            with self._lock:
+                self.jobs[job.id] = job
+            try:
+                self.queue.put_nowait(job)
+            except queue.Full:
+                with self._lock:
+                    del self.jobs[job.id]
+                raise
+        except BaseException:
+            if owns_file:
+                os.remove(document)
+            raise
+        return job
+
+    def get_job(self, job_id: str):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            try:
+                self._run_job(job)
+            finally:
+                self.queue.task_done()
+
+    def _run_job(self, job: ImportJob):
+        with self._lock:
+            self.busy_workers += 1
+        schema_content, package = job.template
+        job.started_at = time.time()
+        job.queue_seconds = job.started_at - job.submitted_at
+        job.worker = threading.current_thread().name
+        job.status = "running"
+        print(f"  - [SERVICE] {job.worker} started job {job.id} ('{job.document_filename}')")
+        run_start = time.perf_counter()
+        try:
+            processor = DocumentProcessor(
+                schema_content=schema_content,
+                document=job.document,
+                document_filename=job.document_filename,
+                ai_client=self.ai_client,
+                schema_package=package,
+                speculative_extraction=self.speculative_extraction
+            )
+            results = processor.run(result_writer_factory=lambda index, item_title, num_results: JobStreamWriter(job, index))
+            # Results that were not streamed (e.g. the failure result of an aborted run) are sent as a whole
+            for i, result in enumerate(results):
+                if "output_path" not in result:
+                    for dmaze_object in result.get("dmaze_data", []):
+                        job.add_event({"result": i, "object": dmaze_object})
+                    job.add_event({"result": i, "summary": result.get("summary", {})})
+            job.results = results
+            job.status = "done" if all(r["summary"].get("overallStatus") != "Failure" for r in results) else "failed"
+        except Exception as e:
+            print(f"  - [SERVICE] Job {job.id} failed: {e}")
+            job.error = str(e)
+            job.results = []
+            job.status = "failed"
+        finally:
+            job.run_seconds = time.perf_counter() - run_start
+            job.finished_at = time.time()
+            if job.owns_file:
+                os.remove(job.document)
+            job.document = None
+            job.template = None
+            job.add_event({"status": job.status, "job": job.describe()})
+            self._job_finished(job)
+
+    def _job_finished(self, job: ImportJob):
+        with self._lock:
+            self.busy_workers -= 1
+            if job.status == "done":
+                self.completed_jobs += 1
+            else:
+                self.failed_jobs += 1
+            self.recent_timings.append({"jobId": job.id, "status": job.status, "inputBytes": job.input_bytes,
+                                        "queueSeconds": round(job.queue_seconds, 3), "runSeconds": round(job.run_seconds, 3)})
+            # Every result of a document carries the same document-level outcome
+            speculation = next((result["summary"]["speculativeExtraction"] for result in job.results or []
+                                if "speculativeExtraction" in result["summary"]), None)
+            if speculation:
+                self.speculation_by_template[job.template_id] = summarize_speculation(
+                    [speculation], self.speculation_by_template.get(job.template_id))
+            finished = [job_id for job_id, retained in self.jobs.items() if retained.finished]
+            for job_id in finished[:max(0, len(finished) - self.retained_jobs)]:
+                del self.jobs[job_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            by_status = {}
+            for job in self.jobs.values():
+                by_status[job.status] = by_status.get(job.status, 0) + 1
+            timings = list(self.recent_timings)
+            return {
+                "uptimeSeconds": round(time.time() - self.started_at, 1) if self.started_at else 0.0,
+                "workers": self.worker_count,
+                "busyWorkers": self.busy_workers,
+                "queueDepth": self.queue.qsize(),
+                "queueCapacity": self.queue.maxsize,
+                "templates": len(self.templates),
+                "jobsByStatus": by_status,
+                "completedJobs": self.completed_jobs,
+                "failedJobs": self.failed_jobs,
+                "recentJobs": {
+                    "count": len(timings),
+                    "meanQueueSeconds": round(sum(t["queueSeconds"] for t in timings) / len(timings), 3) if timings else None,
+                    "meanRunSeconds": round(sum(t["runSeconds"] for t in timings) / len(timings), 3) if timings else None,
+                    "maxRunSeconds": max((t["runSeconds"] for t in timings), default=None),
+                    "jobs": timings,
+                },
+                "speculationByTemplate": {template_id: dict(totals) for template_id, totals in self.speculation_by_template.items()},
+            }
+
+
+class ImportServiceRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 for keep-alive and chunked streaming
+    protocol_version = "HTTP/1.1"
+    service: ImportService = None
+    max_upload_bytes = DEFAULT_MAX_UPLOAD_BYTES
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body):
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if length > self.max_upload_bytes:
+            self._send_json(413, {"error": f"Upload exceeds {self.max_upload_bytes} bytes."})
+            self.close_connection = True
+            return None
+        return self.rfile.read(length)
+
+    def _spool_body(self, suffix: str):
+        """Writes the request body to a temporary file without holding it in memory; returns its path."""
+        length = int(self.headers.get("Content-Length", 0))
+        if length > self.max_upload_bytes:
+            self._send_json(413, {"error": f"Upload exceeds {self.max_upload_bytes} bytes."})
+            self.close_connection = True
+            return None
+        return spool_stream(self.rfile, suffix, length)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        query = parse_qs(url.query)
+
+        if parts == ["templates"]:
+            body = self._read_body()
+            if body is None:
+                return
+            try:
+                template_id = self.service.register_template(json.loads(body))
+            except (ValueError, TypeError, KeyError) as e:
+                return self._send_json(400, {"error": f"Invalid template: {e}"})
+            return self._send_json(201, {"templateId": template_id})
+
+        if parts == ["jobs"]:
+            template_id = query.get("templateId", [None])[0]
+            filename = query.get("filename", [None])[0]
+            if not template_id or not filename:
+                return self._send_json(400, {"error": "Both 'templateId' and 'filename' query parameters are required."})
+            document_path = self._spool_body(os.path.splitext(filename)[1].lower())
+            if document_path is None:
+                return
+            try:
+                job = self.service.submit(template_id, document_path, filename, owns_file=True)
+            except KeyError:
+                return self._send_json(404, {"error": f"Unknown template '{template_id}'. Register it with POST /templates."})
+            except queue.Full:
+                return self._send_json(503, {"error": "The job queue is full. Retry later."})
+            return self._send_json(202, {"jobId": job.id, "status": job.status})
+
+        self._send_json(404, {"error": f"Unknown path '{url.path}'"})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+
+        if parts == ["stats"]:
+            return self._send_json(200, self.service.stats())
+
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            job = self.service.get_job(parts[1])
+            if job is None:
+                return self._send_json(404, {"error": f"Unknown job '{parts[1]}'"})
+            if len(parts) == 2:
+                return self._send_json(200, job.describe())
+            if parts[2] == "result":
+                if not job.finished:
+                    return self._send_json(409, {"error": f"Job is {job.status}.", "job": job.describe()})
+                return self._send_json(200, {"job": job.describe(), "results": self._assemble_results(job)})
+            if parts[2] == "stream":
+                return self._stream_events(job)
+
+        self._send_json(404, {"error": f"Unknown path '{url.path}'"})
+
+    @staticmethod
+    def _assemble_results(job: ImportJob) -> list[dict]:
+        results = {}
+        for event in job.events:
+            if "result" in event:
+                result = results.setdefault(event["result"], {"summary": None, "dmaze_data": []})
+                if "object" in event:
+                    result["dmaze_data"].append(event["object"])
+                else:
+                    result["summary"] = event["summary"]
+        return [results[index] for index in sorted(results)]
+
+    def _stream_events(self, job: ImportJob):
+        """Sends the job's events as chunked NDJSON, starting from the first, until the job has finished."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        sent = 0
+        while True:
+            with job.condition:
+                while sent == len(job.events):
+                    job.condition.wait(timeout=15)
+                pending = job.events[sent:]
+            payload = "".join(json.dumps(event, ensure_ascii=False) + "\n" for event in pending).encode('utf-8')
+            self.wfile.write(f"{len(payload):x}\r\n".encode('ascii') + payload + b"\r\n")
+            self.wfile.flush()
+            sent += len(pending)
+            # A finished job's last event is its final status
+            if "status" in pending[-1]:
+                break
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def create_import_service_server(service: ImportService, host: str = "127.0.0.1", port: int = 8080,
+                                 max_upload_bytes: int = DEFAULT_MAX_UPLOAD_BYTES) -> ThreadingHTTPServer:
+    """Creates (but does not start) the HTTP front end of a started ImportService."""
+    handler = type("BoundImportServiceRequestHandler", (ImportServiceRequestHandler,),
+                   {"service": service, "max_upload_bytes": max_upload_bytes})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve(host: str = "127.0.0.1", port: int = 8080, workers: int = DEFAULT_SERVICE_WORKERS,
+          max_queued_jobs: int = DEFAULT_MAX_QUEUED_JOBS, speculative_extraction: bool = False,
+          max_templates: int = DEFAULT_MAX_TEMPLATES):
+    service = ImportService(workers=workers, max_queued_jobs=max_queued_jobs, speculative_extraction=speculative_extraction,
+                            max_templates=max_templates)
+    service.start()
+    server = create_import_service_server(service, host, port)
+    print(f"Import service listening on http://{host}:{port} with {service.worker_count} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resident document import service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=DEFAULT_SERVICE_WORKERS)
+    parser.add_argument("--max-queued-jobs", type=int, default=DEFAULT_MAX_QUEUED_JOBS)
+    parser.add_argument("--speculative-extraction", action="store_true")
+    parser.add_argument("--max-templates", type=int, default=DEFAULT_MAX_TEMPLATES)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.max_queued_jobs, args.speculative_extraction, args.max_templates)
@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import hashlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from .ai_client import AIClient
+from .disk_cache import LruDiskCache
+from .document_splitter import find_headings
+from .openai_extractor import (EXTRACTION_MODEL, EXTRACTION_SYSTEM_PROMPT, DEFAULT_WINDOW_TOKENS, DEFAULT_WINDOW_OVERLAP_TOKENS,
+                               DEFAULT_MAX_WINDOWS_IN_FLIGHT, extract_data_windowed, merge_window_results)
+from .tracing import span
+
+# Bump this when section splitting or the section prompt changes so earlier imports are not reused.
+INCREMENTAL_IMPORT_VERSION = "2"
+
+INCREMENTAL_CACHE_DIR = os.getenv("DMAZE_INCREMENTAL_CACHE_DIR", os.path.join(".cache", "incremental_imports"))
+INCREMENTAL_CACHE_MAX_BYTES = int(os.getenv("DMAZE_INCREMENTAL_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# One record per document (and template and part), replaced by every import of a new revision
+_import_store = LruDiskCache(INCREMENTAL_CACHE_DIR, max_disk_bytes=INCREMENTAL_CACHE_MAX_BYTES, memory_items=0, suffix=".json")
+
+# Sections longer than this are split further at their sub-headings
+DEFAULT_MAX_SECTION_CHARS = 20000
+
+SECTION_PROMPT_NOTE = """
+    The text is one section of a longer document; the other sections are extracted separately.
+    Extract every item that appears in this section. Use `null` for top-level fields that this section does not contain.
+    """
+
+# Added for sections split out of a larger section, which do not repeat the headings they are under
+SECTION_PATH_NOTE = """
+    The section is under these headings of the document: {path}.
+    Content that continues an item named by one of these headings belongs to that item; use its title.
+    """
+
+
+def _section_boundaries(markdown_content: str, start: int, end: int, max_section_chars: int, ancestors: list = None) -> list[tuple]:
+    """
+    (offset, heading, heading path) where sections start within [start, end); sections above `max_section_chars` are
+    split at their sub-headings. The heading path lists the headings a section is under, ending with its own.
+    """
+    ancestors = ancestors or []
+    # Offsets relative to `start`; a heading opening the range belongs to the range itself
+    headings = [heading for heading in find_headings(markdown_content[start:end]) if heading[0] > 0 or start == 0]
+    levels = sorted({level for _, level, _ in headings})
+    level = next((level for level in levels if sum(1 for _, l, _ in headings if l == level) >= 2), None)
+    if level is None:
+        return [(start, None, ancestors)]
+    boundaries = [(start + offset, title, ancestors + [title]) for offset, l, title in headings if l == level]
+    if markdown_content[start:boundaries[0][0]].strip():
+        boundaries.insert(0, (start, None, ancestors))
+
+    result = []
+    for (section_start, title, path), (section_end, _, _) in zip(boundaries, boundaries[1:] + [(end, None, None)]):
+        result.append((section_start, title, path))
+        if section_end - section_start > max_section_chars:
+            # The first nested section is the one just added: the heading and the text before its first sub-heading
+            result.extend(_section_boundaries(markdown_content, section_start, section_end, max_section_chars, path)[1:])
+    return result
+
+
+def _ancestors(heading: str, heading_path: list) -> list:
+    """The headings a section is under, without its own."""
+    return heading_path[:-1] if heading is not None else heading_path
+
+
+def split_into_sections(markdown_content: str, max_section_chars: int = DEFAULT_MAX_SECTION_CHARS) -> list[dict]:
+    """
+    Splits a document at its shallowest heading level that occurs at least twice (any text before the first
+    such heading is a section of its own); sections longer than `max_section_chars` are split the same way at
+    their own sub-headings, so an edit only invalidates a small part of a large document.
+    Returns {heading, headingPath, startOffset, endOffset, contentHash, content} per section; the content hash
+    covers the headings the section is under, since they are part of its prompt.
+    """
+    boundaries = _section_boundaries(markdown_content, 0, len(markdown_content), max_section_chars)
+    sections = []
+    for (start, title, path), (end, _, _) in zip(boundaries, boundaries[1:] + [(len(markdown_content), None, None)]):
+        content = markdown_content[start:end]
+        sections.append({
+            "heading": title,
+            "headingPath": path,
+            "startOffset": start,
+            "endOffset": end,
+            "contentHash": hashlib.sha256("\n".join(_ancestors(title, path) + [content.strip()]).encode('utf-8')).hexdigest(),
+            "content": content,
+        })
+    return sections
+
+
+def _shared_headings(previous: dict, current: dict) -> list:
+    """
+    The headings of `previous` that `current` is under: non-empty only when both come from the same larger section.
+    Sections that merely share a title (e.g. two top-level '## Tiltak') are not under each other's heading.
+    """
+    shared = []
+    for previous_heading, current_heading in zip(previous["headingPath"], _ancestors(current["heading"], current["headingPath"])):
+        if previous_heading != current_heading:
+            break
+        shared.append(previous_heading)
+    return shared
+
+
+def merge_section_results(section_results: list[dict], sections: list[dict], schema_tree: dict) -> dict:
+    """
+    Combines the extractions of consecutive sections (`section_results[i]` is the extraction of `sections[i]`).
+    Top-level sections hold separate items, so their child arrays are concatenated in document order. An item
+    can continue across the sections a large section was split into: an item named by a heading both
+    sections are under is merged by identity (see merge_window_results), the shared headings acting as the overlap text.
+    """
+    overlap_texts = [None] + ["\n".join(_shared_headings(previous, current)) or None
+                              for previous, current in zip(sections, sections[1:])]
+    return merge_window_results(section_results, schema_tree, overlap_texts)
+
+
+def get_import_key(document_filename: str, template_hash: str, item_title: str = None) -> str:
+    """Identifies the previous imports of a document: revisions are uploaded under the same name, for the same template."""
+    identity = json.dumps([INCREMENTAL_IMPORT_VERSION, EXTRACTION_MODEL, document_filename, template_hash, item_title], ensure_ascii=False)
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+
+def extract_data_incrementally(ai_client: AIClient, document_text: str, schema_package: dict, import_key: str,
+                               max_window_tokens: int = DEFAULT_WINDOW_TOKENS, overlap_tokens: int = DEFAULT_WINDOW_OVERLAP_TOKENS,
+                               max_sections_in_flight: int = DEFAULT_MAX_WINDOWS_IN_FLIGHT, window_stats: list = None,
+                               section_stats: dict = None) -> dict:
+    """
+    Extracts a document section by section, reusing the extracted subtree of every section whose content is
+    unchanged since the previous import under `import_key` and re-extracting only new or changed sections
+    (large ones in windows, see extract_data_windowed). The section results are merged in document order
+    and stored for the next import. A failing section is skipped; an error is only returned when every section fails.
+    If `section_stats` is given it is filled with the number of sections, reused, reExtracted, failed and removed.
+    """
+    sections = split_into_sections(document_text)
+    window_stats = window_stats if window_stats is not None else []
+    section_stats = section_stats if section_stats is not None else {}
+
+    previous = _import_store.get(import_key)
+    previous_sections = {}
+    if previous is not None:
+        previous_sections = {section["contentHash"]: section["data"] for section in json.loads(previous)["sections"]}
+    current_hashes = {section["contentHash"] for section in sections}
+
+    def extract_section(section: dict) -> dict:
+        system_prompt = EXTRACTION_SYSTEM_PROMPT + SECTION_PROMPT_NOTE
+        ancestors = _ancestors(section["heading"], section["headingPath"])
+        if ancestors:
+            system_prompt += SECTION_PATH_NOTE.format(path=" > ".join(f"'{heading}'" for heading in ancestors))
+        with span("extraction.section", heading=section["heading"], startOffset=section["startOffset"], endOffset=section["endOffset"]):
+            return extract_data_windowed(ai_client, section["content"], schema_package, max_window_tokens, overlap_tokens,
+                                         1, window_stats, system_prompt=system_prompt)
+
+    changed = [section for section in sections if section["contentHash"] not in previous_sections]
+    started = time.perf_counter()
+    if changed:
+        print(f"  - Incremental import: reusing {len(sections) - len(changed)} of {len(sections)} sections, re-extracting {len(changed)}.")
+        with ThreadPoolExecutor(max_workers=max(1, max_sections_in_flight), thread_name_prefix="section") as executor:
+            # Each section runs in a copy of the caller's context so its usage is accounted to the caller's step
+            futures = {section["contentHash"]: executor.submit(contextvars.copy_context().run, extract_section, section)
+                       for section in changed}
+            extracted = {content_hash: future.result() for content_hash, future in futures.items()}
+    else:
+        print(f"  - Incremental import: all {len(sections)} sections are unchanged. Reusing the previous extraction.")
+        extracted = {}
+
+    section_results, merged_sections, stored_sections, failures = [], [], [], []
+    for section in sections:
+        content_hash = section["contentHash"]
+        data = previous_sections[content_hash] if content_hash in previous_sections else extracted[content_hash]
+        if "error" in data:
+            failures.append(data)
+            print(f"  - WARNING: Section '{section['heading'] or '(preamble)'}' failed and was skipped: {data['error']}")
+            continue
+        section_results.append(data)
+        merged_sections.append(section)
+        stored_sections.append({"heading": section["heading"], "contentHash": content_hash, "data": data})
+
+    section_stats.update({
+        "sections": len(sections),
+        "reused": len(sections) - len(changed),
+        "reExtracted": len(changed),
+        "failed": len(failures),
+        "removed": len(set(previous_sections) - current_hashes),
+        "extractionSeconds": round(time.perf_counter() - started, 3),
+    })
+
+    if not section_results:
+        return failures[0] if failures else {"error": "The document has no content to extract."}
+    # Failed sections are left out of the stored import, so they are extracted again next time
+    _import_store.set(import_key, json.dumps({"sections": stored_sections}, ensure_ascii=False))
+    if len(section_results) == 1:
+        return section_results[0]
+    return merge_section_results(section_results, merged_sections, schema_package['schema_tree'])
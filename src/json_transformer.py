@@ -1,129 +1,173 @@
 import uuid
 import re
+import threading
 from .ai_client import AIClient # Import AIClient
-from .api_simulator import get_entities_from_api, get_entity_schema_from_api
+from .entity_catalog import get_catalog_client
 from .tools import find_best_entity_matches_in_batch
+from .tracing import span, start_span, end_span
 
-def collect_entities_to_match(data_node: dict, schema_node: dict, items_to_match: dict):
-    """Recursively traverses the data and schema to find all unique text values that need an ID lookup."""
+MULTIVALUE_SPLIT_PATTERN = re.compile(r'[,;\n]|(?:\s+og\s+)|(?:\s+and\s+)')
+
+_flatten_plan_cache = {}
+_flatten_plan_cache_lock = threading.Lock()
+
+
+def compile_flatten_plan(schema_node: dict) -> dict:
+    """
+    Compiles the per-field decisions for a schema node (and its children) once:
+    which fields are entity references, whether their text is split into several values,
+    and whether only the first matched ID is kept.
+    """
+    fields = []
     for field_info in schema_node.get('fields', []):
-        entity_type = field_info.get('entitytype')
-        if entity_type:
-            raw_text_value = data_node.get(field_info['fieldname'])
-            
-
-            if raw_text_value is not None and str(raw_text_value).strip().lower() != "null":
-                if entity_type not in items_to_match:
-                    items_to_match[entity_type] = set()
-                
-                texts = re.split(r'[,;\n]|(?:\s+og\s+)|(?:\s+and\s+)', str(raw_text_value)) if field_info.get('type') == "multivalue" else [str(raw_text_value)]
-                for text in texts:
-                    cleaned_text = text.strip()
-                    if cleaned_text:
-                        items_to_match[entity_type].add(cleaned_text)
-
-    for child_schema in schema_node.get('children', []):
-        child_items = data_node.get(child_schema['name'], [])
-        for item in child_items:
-            collect_entities_to_match(item, child_schema, items_to_match)
-
-def flatten_recursively(ai_client: AIClient, data_node: dict, schema_node: dict, parent_id: str, parent_type: str, flat_list: list, detailed_lookup_map: dict, warnings: list):
+        field_type = field_info.get('type')
+        fields.append((
+            field_info['fieldname'],
+            field_info.get('entitytype'),
+            field_type == "multivalue",
+            field_type in ["singlevalue", "entity"],
+        ))
+    children = tuple(
+        (child_schema['name'], child_schema['relationship_field'], compile_flatten_plan(child_schema))
+        for child_schema in schema_node.get('children', [])
+    )
+    entity_types = {entity_type for _, entity_type, _, _ in fields if entity_type}
+    for _, _, child_plan in children:
+        entity_types |= child_plan['entity_types']
+    return {"name": schema_node['name'], "fields": tuple(fields), "children": children, "entity_types": frozenset(entity_types)}
+
+
+def get_flatten_plan(schema_package: dict) -> dict:
+    """Returns the flatten plan for a schema package, compiling it only once per template."""
+    cache_key = schema_package.get('template_hash')
+    if not cache_key:
+        return compile_flatten_plan(schema_package['schema_tree'])
+    with _flatten_plan_cache_lock:
+        plan = _flatten_plan_cache.get(cache_key)
+        if plan is None:
+            plan = _flatten_plan_cache[cache_key] = compile_flatten_plan(schema_package['schema_tree'])
+        return plan
+
+
+def _split_entity_value(raw_text_value, is_multivalue: bool) -> tuple:
+    """Splits an extracted entity value into the cleaned text snippets that are looked up."""
+    if raw_text_value is None or str(raw_text_value).strip().lower() == "null":
+        return ()
+    texts = MULTIVALUE_SPLIT_PATTERN.split(str(raw_text_value)) if is_multivalue else [str(raw_text_value)]
+    return tuple(cleaned for cleaned in (text.strip() for text in texts) if cleaned)
+
+
+def collect_node_records(root_data: dict, plan: dict, items_to_match: dict) -> list:
+    """
+    Walks the nested data once, iteratively and in pre-order (so the root comes first), and returns one
+    record per node: (plan, data_node, node_id, parent_id, parent_type, entity_texts, child_ids).
+    Entity values are split and cleaned here and added to `items_to_match` for the batch matcher.
+    """
+    records = []
+    stack = [(root_data, plan, f"{plan['name']}-{uuid.uuid4()}", None, None)]
+    while stack:
+        data_node, node_plan, node_id, parent_id, parent_type = stack.pop()
+        entity_texts = {}
+        for field_name, entity_type, is_multivalue, _ in node_plan['fields']:
+            if entity_type:
+                texts = _split_entity_value(data_node.get(field_name), is_multivalue)
+                entity_texts[field_name] = texts
+                if texts:
+                    items_to_match.setdefault(entity_type, set()).update(texts)
+
+        child_ids = []
+        pending_children = []
+        for child_name, _, child_plan in node_plan['children']:
+            ids = []
+            for item in data_node.get(child_name) or []:
+                child_id = f"{child_name}-{uuid.uuid4()}"
+                ids.append(child_id)
+                pending_children.append((item, child_plan, child_id, node_id, node_plan['name']))
+            child_ids.append(ids)
+        # Reversed so children are popped, and therefore emitted, in document order
+        stack.extend(reversed(pending_children))
+
+        records.append((node_plan, data_node, node_id, parent_id, parent_type, entity_texts, child_ids))
+    return records
+
+
+def iter_dmaze_objects(records: list, detailed_lookup_map: dict, wrapper_names: dict, warnings: list):
     """
-    Recursively flattens the nested data into a list of Dmaze objects.
+    Yields one Dmaze object per record, in record order (root first).
     It uses a detailed map to look up IDs and generates warnings for low-confidence matches.
     (Note: This function does not generate "not found" warnings itself; that's handled before it's called).
     """
-    object_name = schema_node['name']
-    node_id = f"{object_name}-{uuid.uuid4()}"
-    dmaze_object = {"id": node_id, "objectname": object_name}
-    if parent_id:
-        dmaze_object["parentid"] = parent_id
-        dmaze_object["parenttype"] = parent_type
-
-    for field_info in schema_node['fields']:
-        field_name = field_info['fieldname']
-        raw_text_value = data_node.get(field_name)
-        field_type = field_info.get('type')
-        entity_type = field_info.get('entitytype')
-        if entity_type:
-            # ALLTID forsøk å opprette det strukturerte objektet for entitytype-felter.
-            
-            entity_schema = get_entity_schema_from_api(entity_type)
-            
-            # Bruk entity_type som fallback hvis meta-skjema ikke er funnet eller wrapper er None
-            type_name = entity_type 
-            if entity_schema:
-                type_name = entity_schema.get('dmaze_format_wrapper') or entity_type
-
-            found_ids = []
-            if raw_text_value is not None and str(raw_text_value).strip().lower() != "null":
-                texts_to_match = re.split(r'[,;\n]|(?:\s+og\s+)|(?:\s+and\s+)', str(raw_text_value)) if field_type == "multivalue" else [str(raw_text_value)]
-                for text in texts_to_match:
-                    cleaned_text = text.strip()
-                    if cleaned_text:
-                        # Se kun opp i detailed_lookup_map hvis entity_type ble prosessert for matching
-                        match_details = detailed_lookup_map.get(entity_type, {}).get(cleaned_text)
-                        if match_details:
-                            found_id = match_details['id']
-                            found_ids.append(found_id)
-                            if match_details.get('confidence', 'High') in ["Medium", "Low"]:
-                                warning_msg = f"Lav konfidensmatch for '{cleaned_text}' (Type: {entity_type}): Matchet til ID '{found_id}'. Årsak: {match_details.get('reasoning', 'N/A')}"
-                                warnings.append(warning_msg)
-
-            values_list = found_ids
-            if field_type in ["singlevalue", "entity"] and len(values_list) > 1:
-                values_list = [values_list[0]]
-
-            dmaze_object[field_name] = {"type": type_name, "values": values_list}
-        else:
-            dmaze_object[field_name] = raw_text_value if raw_text_value is not None else ""
+    for node_plan, data_node, node_id, parent_id, parent_type, entity_texts, child_ids in records:
+        dmaze_object = {"id": node_id, "objectname": node_plan['name']}
+        if parent_id:
+            dmaze_object["parentid"] = parent_id
+            dmaze_object["parenttype"] = parent_type
 
-    for child_schema in schema_node.get('children', []):
-        child_name = child_schema['name']
-        child_items = data_node.get(child_name, [])
-        child_ids = []
-        if child_items:
-            for item in child_items:
-                child_id = flatten_recursively(ai_client, item, child_schema, node_id, object_name, flat_list, detailed_lookup_map, warnings)
-                child_ids.append(child_id)
-        
-        relationship_field = child_schema['relationship_field']
-        dmaze_object[relationship_field] = {"type": child_name, "values": child_ids}
+        for field_name, entity_type, _, keep_first_only in node_plan['fields']:
+            if entity_type:
+                # ALLTID forsøk å opprette det strukturerte objektet for entitytype-felter.
+                type_matches = detailed_lookup_map.get(entity_type, {})
+                found_ids = []
+                for cleaned_text in entity_texts[field_name]:
+                    match_details = type_matches.get(cleaned_text)
+                    if match_details:
+                        found_id = match_details['id']
+                        found_ids.append(found_id)
+                        if match_details.get('confidence', 'High') in ["Medium", "Low"]:
+                            warning_msg = f"Lav konfidensmatch for '{cleaned_text}' (Type: {entity_type}): Matchet til ID '{found_id}'. Årsak: {match_details.get('reasoning', 'N/A')}"
+                            warnings.append(warning_msg)
 
-    flat_list.append(dmaze_object)
-    return node_id
+                if keep_first_only and len(found_ids) > 1:
+                    found_ids = [found_ids[0]]
+
+                dmaze_object[field_name] = {"type": wrapper_names.get(entity_type, entity_type), "values": found_ids}
+            else:
+                raw_text_value = data_node.get(field_name)
+                dmaze_object[field_name] = raw_text_value if raw_text_value is not None else ""
+
+        for (child_name, relationship_field, _), ids in zip(node_plan['children'], child_ids):
+            dmaze_object[relationship_field] = {"type": child_name, "values": ids}
+
+        yield dmaze_object
 
 
 # MAIN FUNCTION 
 def transform_to_dmaze_format_hierarchically(ai_client: AIClient, nested_data: dict, schema_package: dict) -> dict:
-    final_list = []
+    """Transforms the nested AI output into a complete list of Dmaze objects (root first)."""
     warnings = []
+    match_stats = {}
+    dmaze_data = list(iter_transform_to_dmaze_format(ai_client, nested_data, schema_package, warnings, match_stats))
+    return {"dmaze_data": dmaze_data, "warnings": warnings, "match_stats": match_stats}
+
+
+def iter_transform_to_dmaze_format(ai_client: AIClient, nested_data: dict, schema_package: dict, warnings: list, match_stats: dict):
+    """
+    Streaming variant of transform_to_dmaze_format_hierarchically: yields Dmaze objects (root first) as they are built.
+    `warnings` and `match_stats` are filled in as a side effect and are only complete once the generator is exhausted.
+    """
     schema_tree = schema_package['schema_tree']
     root_name = schema_tree['name']
 
     if root_name not in nested_data:
-        return {"dmaze_data": [], "warnings": [f"Input from AI is missing the root key '{root_name}'."]}
+        warnings.append(f"Input from AI is missing the root key '{root_name}'.")
+        return
 
     # --- Step 1: Collect all entities to be matched ---
     print("\n--- Step 4a: Collecting all entities to be matched... ---")
-    items_to_match = {}
-    collect_entities_to_match(nested_data[root_name], schema_tree, items_to_match)
-    
-    # --- Step 2: Get valid entities and perform the batch match ---
-    # Ny funksjon for å hente alle entity_types fra skjemaet
-    def get_all_entity_types_from_schema(schema_node: dict, entity_types_set: set):
-        for field_info in schema_node.get('fields', []):
-            entity_type = field_info.get('entitytype')
-            if entity_type:
-                entity_types_set.add(entity_type)
-        for child_schema in schema_node.get('children', []):
-            get_all_entity_types_from_schema(child_schema, entity_types_set)
+    with span("transform.collect_entities") as collect_span:
+        plan = get_flatten_plan(schema_package)
+        items_to_match = {}
+        records = collect_node_records(nested_data[root_name], plan, items_to_match)
+        if collect_span:
+            collect_span.set_attributes(nodes=len(records), snippets=sum(len(texts) for texts in items_to_match.values()))
 
-    all_schema_entity_types = set()
-    get_all_entity_types_from_schema(schema_tree, all_schema_entity_types)
+    # --- Step 2: Get valid entities and perform the batch match ---
+    all_schema_entity_types = set(plan['entity_types'])
 
-    # 2a: Hent entiteter fra api_simulator
-    api_entities_map = { entity_type: get_entities_from_api(entity_type) for entity_type in all_schema_entity_types }
+    # 2a: Hent entiteter fra API-et (én bulk-forespørsel, bufret i katalogklienten)
+    catalog = get_catalog_client()
+    with span("transform.fetch_catalog", entityTypes=len(all_schema_entity_types)):
+        api_entities_map = catalog.get_entities_bulk(all_schema_entity_types)
 
     # 2b: Hent entiteter fra input-skjemaet (schema_package['entity_map'])
     # Konverter skjemaets format {'name': 'id'} til [{'id': '...', 'name': '...'}]
@@ -176,7 +220,15 @@ def transform_to_dmaze_format_hierarchically(ai_client: AIClient, nested_data: d
     to_match = {t: items_to_match[t] for t in items_to_match.keys() if t in matchable_types}
     
     # Pass den kombinerte listen med gyldige entiteter til matcher-funksjonen
-    detailed_lookup_map = find_best_entity_matches_in_batch(ai_client, to_match, combined_valid_entities_map)
+    # Show the model each type's primary display field rather than every candidate field
+    display_fields = {
+        entity_type: (entity_schema or {}).get('primary_display_field') or 'name'
+        for entity_type, entity_schema in catalog.get_metadata_bulk(to_match).items()
+    }
+
+    with span("transform.match_entities", entityTypes=len(to_match)):
+        detailed_lookup_map = find_best_entity_matches_in_batch(ai_client, to_match, combined_valid_entities_map, match_stats,
+                                                                display_fields=display_fields)
 
     # --- STEP 3 Systematically check for "Not Found" errors BEFORE flattening ---
     print("\n--- Step 4c: Verifying all entities and collecting 'Not Found' warnings... ---")
@@ -197,22 +249,16 @@ def transform_to_dmaze_format_hierarchically(ai_client: AIClient, nested_data: d
                 print(f"  - ADVARSEL: {warning_msg}")
 
 
-    # --- Step 4: Flatten the data using your original, working function ---
+    # --- Step 4: Flatten the data; records are in pre-order, so the root object comes first ---
     print("\n--- Step 4d: Transforming data structure... ---")
-    flatten_recursively(
-        ai_client=ai_client,
-        data_node=nested_data[root_name],
-        schema_node=schema_tree,
-        parent_id=None,
-        parent_type=None,
-        flat_list=final_list,
-        detailed_lookup_map=detailed_lookup_map,
-        warnings=warnings
-    )
-
-    root_index = next((i for i, obj in enumerate(final_list) if obj.get('objectname') == root_name), -1)
-    if root_index != -1:
-        root_obj = final_list.pop(root_index)
-        final_list.insert(0, root_obj)
-
-    return {"dmaze_data": final_list, "warnings": warnings}
\ No newline at end of file
+    # Bruk entity_type som fallback hvis meta-skjema ikke er funnet eller wrapper er None
+    wrapper_names = {
+        entity_type: (entity_schema or {}).get('dmaze_format_wrapper') or entity_type
+        for entity_type, entity_schema in catalog.get_metadata_bulk(all_schema_entity_types).items()
+    }
+    # Not made the current span, since the generator yields to the consumer while it is open
+    flatten_span = start_span("transform.flatten", objects=len(records))
+    try:
+        yield from iter_dmaze_objects(records, detailed_lookup_map, wrapper_names, warnings)
+    finally:
+        end_span(flatten_span)
@@ -0,0 +1,115 @@
+import json
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# USD per 1M tokens: (input, cached input, output). Models not listed get no cost estimate.
+MODEL_PRICES_PER_MILLION = {
+    "gpt-5": (1.25, 0.125, 10.00),
+    "gpt-5-mini": (0.25, 0.025, 2.00),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+}
+
+# The recorders and pipeline step of the current unit of work. Context variables follow the code
+# into nested calls on the same thread; work handed to a pool must be run in a copied context.
+_active_recorders: ContextVar[tuple] = ContextVar("llm_usage_recorders", default=())
+_active_step: ContextVar[Optional[str]] = ContextVar("llm_usage_step", default=None)
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> Optional[float]:
+    """Estimated USD cost of one call, or None for models without a known price."""
+    prices = MODEL_PRICES_PER_MILLION.get(model)
+    if prices is None:
+        # Dated snapshots such as 'gpt-4o-2024-08-06' are priced like their base model
+        prices = next((p for name, p in sorted(MODEL_PRICES_PER_MILLION.items(), key=lambda kv: -len(kv[0]))
+                       if model.startswith(f"{name}-")), None)
+    if prices is None:
+        return None
+    input_price, cached_price, output_price = prices
+    uncached_tokens = max(0, prompt_tokens - cached_tokens)
+    return (uncached_tokens * input_price + cached_tokens * cached_price + completion_tokens * output_price) / 1_000_000
+
+
+class UsageRecorder:
+    """A thread-safe collection of LLM call records (see AIClient) with an aggregated view."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = []
+
+    def add(self, record: dict):
+        with self._lock:
+            self._records.append(record)
+
+    @property
+    def records(self) -> list[dict]:
+        with self._lock:
+            return list(self._records)
+
+    def snapshot(self) -> dict:
+        return summarize_usage(self.records)
+
+    def write_snapshot(self, path: str, **metadata) -> dict:
+        """Writes the aggregated usage (plus any metadata) to a JSON file and returns it."""
+        snapshot = {**metadata, **self.snapshot()}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, indent=2, ensure_ascii=False)
+        return snapshot
+
+
+@contextmanager
+def track_usage(recorder: UsageRecorder = None, step_name: str = None):
+    """Routes the records of all calls made inside the block to `recorder` (in addition to outer recorders) and tags them with `step_name`."""
+    recorders_token = _active_recorders.set(_active_recorders.get() + (recorder,)) if recorder is not None else None
+    step_token = _active_step.set(step_name) if step_name is not None else None
+    try:
+        yield
+    finally:
+        if step_token is not None:
+            _active_step.reset(step_token)
+        if recorders_token is not None:
+            _active_recorders.reset(recorders_token)
+
+
+def current_step() -> Optional[str]:
+    return _active_step.get()
+
+
+def record_call(record: dict):
+    """Adds one call record to every recorder active in the current context."""
+    for recorder in _active_recorders.get():
+        recorder.add(record)
+
+
+def _empty_totals() -> dict:
+    return {"calls": 0, "cacheHits": 0, "cacheMisses": 0, "failedCalls": 0, "cancelledCalls": 0, "retries": 0, "throttles": 0, "promptTokens": 0, "completionTokens": 0, "cachedTokens": 0,
+            "latencySeconds": 0.0, "queueWaitSeconds": 0.0, "backoffSeconds": 0.0, "estimatedCostUsd": 0.0}
+
+
+def summarize_usage(records: list[dict]) -> dict:
+    """Aggregates call records into totals and breakdowns by step and by model."""
+    totals, by_step, by_model = _empty_totals(), {}, {}
+    for record in records:
+        for bucket in (totals, by_step.setdefault(record.get("step") or "unlabelled", _empty_totals()),
+                       by_model.setdefault(record.get("model") or "unknown", _empty_totals())):
+            # Calls answered from the response cache, or cancelled before they were sent, never reached the model
+            bucket["calls"] += record.get("cache") != "hit" and record.get("status") != "Cancelled"
+            bucket["cancelledCalls"] += record.get("status") == "Cancelled"
+            bucket["cacheHits"] += record.get("cache") == "hit"
+            bucket["cacheMisses"] += record.get("cache") in ("miss", "bypass")
+            bucket["failedCalls"] += record.get("status") == "Failure"
+            bucket["retries"] += record.get("retries", 0)
+            bucket["throttles"] += record.get("throttles", 0)
+            bucket["promptTokens"] += record.get("promptTokens", 0)
+            bucket["completionTokens"] += record.get("completionTokens", 0)
+            bucket["cachedTokens"] += record.get("cachedTokens", 0)
+            bucket["latencySeconds"] += record.get("latencySeconds", 0.0)
+            bucket["queueWaitSeconds"] += record.get("queueWaitSeconds", 0.0)
+            bucket["backoffSeconds"] += record.get("backoffSeconds", 0.0)
+            bucket["estimatedCostUsd"] += record.get("estimatedCostUsd") or 0.0
+    for bucket in [totals, *by_step.values(), *by_model.values()]:
+        for seconds_field in ("latencySeconds", "queueWaitSeconds", "backoffSeconds"):
+            bucket[seconds_field] = round(bucket[seconds_field], 3)
+        bucket["estimatedCostUsd"] = round(bucket["estimatedCostUsd"], 6)
+    return {"totals": totals, "byStep": by_step, "byModel": by_model}
@@ -0,0 +1,206 @@
+import re
+from collections import Counter
+
+from .token_counter import count_tokens
+
+# Rules in the order they are applied. Every rule can be switched off individually, e.g.
+# DocumentProcessor(compaction_rules={**DEFAULT_COMPACTION_RULES, "dedupe_boilerplate": False})
+DEFAULT_COMPACTION_RULES = {
+    "drop_images": True,                  # image links and embedded image data; meaningful alt text is kept
+    "unlink_internal_references": True,   # '[text](#_bookmark)' links to bookmarks inside the document become 'text'
+    "strip_page_furniture": True,         # header/footer lines repeated at the edges of most pages (form-feed separated PDF text)
+    "collapse_tables": True,              # cell padding, all-empty rows, trailing empty cells and separator dashes
+    "dedupe_boilerplate": True,           # long paragraphs repeated verbatim under the same heading; the first is kept
+    "collapse_whitespace": True,          # trailing spaces, runs of inner spaces and of blank lines, page breaks
+}
+
+# A line at the edge of at least this share of the pages (and of at least 3 pages) is page furniture
+PAGE_FURNITURE_MIN_PAGE_SHARE = 0.5
+PAGE_FURNITURE_EDGE_LINES = 3
+# Only paragraphs this long that occur at least this often are treated as boilerplate. A copy is only removed
+# when an earlier copy is under the same heading: under another heading it may belong to a different item.
+BOILERPLATE_MIN_CHARS = 200
+BOILERPLATE_MIN_REPEATS = 3
+
+_FENCE_PATTERN = re.compile(r'^\s*(```|~~~)')
+_IMAGE_PATTERN = re.compile(r'!\[([^\]]*)\]\((?:[^()]|\([^()]*\))*\)')
+_INTERNAL_LINK_PATTERN = re.compile(r'(?<!!)\[((?:[^\[\]]|\[[^\[\]]*\])*)\]\(#[^)\s]*\)')
+_TABLE_ROW_PATTERN = re.compile(r'^\s*\|.*\|\s*$')
+_TABLE_SEPARATOR_CELL_PATTERN = re.compile(r'^:?-{3,}:?$')
+_HEADING_LINE_PATTERN = re.compile(r'^#{1,6}(\s|$)', re.MULTILINE)
+_PAGE_NUMBER_PATTERN = re.compile(r'^(page|side|s\.)?\s*\d+(\s*(of|av|/)\s*\d+)?$', re.IGNORECASE)
+_INNER_SPACES_PATTERN = re.compile(r'(?<=\S) {2,}(?=\S)')
+_BLANK_RUN_PATTERN = re.compile(r'\n{3,}')
+
+
+def _outside_fences(markdown_content: str, transform_line) -> str:
+    """Applies `transform_line` to every line outside fenced code blocks; it returns the new line or None to drop it."""
+    lines = []
+    in_fence = False
+    for line in markdown_content.split('\n'):
+        if _FENCE_PATTERN.match(line):
+            in_fence = not in_fence
+            lines.append(line)
+            continue
+        new_line = line if in_fence else transform_line(line)
+        if new_line is not None:
+            lines.append(new_line)
+    return '\n'.join(lines)
+
+
+def _drop_images(markdown_content: str) -> str:
+    def replace(match):
+        alt_text = match.group(1).strip()
+        # Alt text that is only a file name or URL carries no content
+        if not alt_text or re.match(r'^(https?://|www\.)\S*$|^\S+\.(png|jpe?g|gif|svg|emf|wmf|bmp|tiff?)$', alt_text, re.IGNORECASE):
+            return ""
+        return alt_text
+    return _outside_fences(markdown_content, lambda line: _IMAGE_PATTERN.sub(replace, line))
+
+
+def _unlink_internal_references(markdown_content: str) -> str:
+    return _outside_fences(markdown_content, lambda line: _INTERNAL_LINK_PATTERN.sub(lambda match: match.group(1), line))
+
+
+def _strip_page_furniture(markdown_content: str) -> str:
+    """
+    Removes lines that repeat at the same position at the top or bottom of most pages (running headers and
+    footers), and bare page numbers on a page's first or last line.
+    """
+    pages = markdown_content.split('\f')
+    if len(pages) < 3:
+        return markdown_content
+
+    def edge_positions(page: str) -> dict:
+        """(edge, position) -> (line index, line) for the first and last few non-empty lines of a page."""
+        lines = [(i, line.strip()) for i, line in enumerate(page.split('\n')) if line.strip()]
+        positions = {("top", i): line for i, line in enumerate(lines[:PAGE_FURNITURE_EDGE_LINES])}
+        positions.update({("bottom", i): line for i, line in enumerate(reversed(lines[-PAGE_FURNITURE_EDGE_LINES:]))})
+        return positions
+
+    page_edges = [edge_positions(page) for page in pages]
+    counts = Counter((position, line) for edges in page_edges for position, (_, line) in edges.items())
+    threshold = max(3, PAGE_FURNITURE_MIN_PAGE_SHARE * len(pages))
+    # Running headers and footers occur only at page edges; a repeated value that also occurs in the body
+    # (e.g. a date or name in a table that spans pages) is content. Lines without letters or digits are layout.
+    line_counts = Counter(line.strip() for line in markdown_content.split('\n') if line.strip())
+    edge_counts = Counter(line for edges in page_edges for _, line in set(edges.values()))
+    furniture = {item for item, count in counts.items()
+                 if count >= threshold and re.search(r'\w', item[1]) and line_counts[item[1]] == edge_counts[item[1]]}
+
+    compacted_pages = []
+    seen = set()
+    for page, edges in zip(pages, page_edges):
+        # Only the matched edge line goes; the same value elsewhere on the page (e.g. a '2' in a table) stays
+        removed = set()
+        for position, (index, line) in edges.items():
+            if (position, line) in furniture:
+                # The first occurrence stays: on the first page a header usually carries the title and date
+                if line in seen:
+                    removed.add(index)
+                seen.add(line)
+            elif position[1] == 0 and _PAGE_NUMBER_PATTERN.match(line):
+                removed.add(index)
+        compacted_pages.append('\n'.join(line for i, line in enumerate(page.split('\n')) if i not in removed))
+    return '\f'.join(compacted_pages)
+
+
+def _collapse_table_row(line: str):
+    if not _TABLE_ROW_PATTERN.match(line):
+        return line
+    cells = [cell.strip() for cell in line.strip()[1:-1].split('|')]
+    if all(_TABLE_SEPARATOR_CELL_PATTERN.match(cell) for cell in cells):
+        return '|' + '|'.join('---' for _ in cells) + '|'
+    # Empty cells keep their position (e.g. the 'X' in a risk matrix) unless no content follows them
+    while len(cells) > 1 and not cells[-1]:
+        cells.pop()
+    return '|' + '|'.join(f' {cell} ' if cell else ' ' for cell in cells) + '|'
+
+
+def _collapse_tables(markdown_content: str) -> str:
+    collapsed = _outside_fences(markdown_content, _collapse_table_row).split('\n')
+    # Rows without any content are dropped, except a header row that the separator row below depends on
+    lines = []
+    for i, line in enumerate(collapsed):
+        if _TABLE_ROW_PATTERN.match(line) and not line.replace('|', '').strip():
+            next_line = collapsed[i + 1] if i + 1 < len(collapsed) else ""
+            if not next_line.startswith('|---'):
+                continue
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def _collapse_whitespace(markdown_content: str) -> str:
+    # Leading indentation is kept: it carries list nesting and code blocks
+    compacted = _outside_fences(markdown_content.replace('\f', '\n\n'), lambda line: _INNER_SPACES_PATTERN.sub(' ', line.rstrip()))
+    return _BLANK_RUN_PATTERN.sub('\n\n', compacted).strip('\n') + ('\n' if markdown_content.endswith('\n') else '')
+
+
+def _dedupe_boilerplate(markdown_content: str) -> str:
+    blocks = re.split(r'(\n\s*\n)', markdown_content)
+    counts = Counter(block.strip() for block in blocks[::2])
+    repeated = {text for text, count in counts.items()
+                if count >= BOILERPLATE_MIN_REPEATS and len(text) >= BOILERPLATE_MIN_CHARS
+                and not _HEADING_LINE_PATTERN.search(text) and not text.startswith('|') and '```' not in text}
+    if not repeated:
+        return markdown_content
+    seen = set()
+    kept = []
+    in_fence = False
+    for i in range(0, len(blocks), 2):
+        text = blocks[i].strip()
+        if text in repeated:
+            if text in seen:
+                continue
+            seen.add(text)
+        kept.append(blocks[i])
+        if i + 1 < len(blocks):
+            kept.append(blocks[i + 1])
+        for line in blocks[i].split('\n'):
+            if _FENCE_PATTERN.match(line):
+                in_fence = not in_fence
+            elif not in_fence and _HEADING_LINE_PATTERN.match(line):
+                # A new section: its copies of a repeated paragraph are kept again
+                seen = set()
+    return ''.join(kept)
+
+
+_RULE_FUNCTIONS = {
+    "drop_images": _drop_images,
+    "unlink_internal_references": _unlink_internal_references,
+    "strip_page_furniture": _strip_page_furniture,
+    "collapse_tables": _collapse_tables,
+    "dedupe_boilerplate": _dedupe_boilerplate,
+    "collapse_whitespace": _collapse_whitespace,
+}
+
+
+def compact_markdown(markdown_content: str, rules: dict = None, model: str = "gpt-4o") -> tuple[str, dict]:
+    """
+    Deterministically removes content that costs prompt tokens without carrying information (see
+    DEFAULT_COMPACTION_RULES). Returns the compacted markdown and statistics: characters and tokens
+    before and after, and the characters removed by each rule.
+    """
+    rules = DEFAULT_COMPACTION_RULES if rules is None else rules
+    compacted = markdown_content
+    removed_by_rule = {}
+    for rule_name in DEFAULT_COMPACTION_RULES:
+        if not rules.get(rule_name):
+            continue
+        before = len(compacted)
+        compacted = _RULE_FUNCTIONS[rule_name](compacted)
+        removed_by_rule[rule_name] = before - len(compacted)
+    if not markdown_content.strip():
+        compacted = markdown_content
+
+    tokens_before, tokens_after = count_tokens(markdown_content, model), count_tokens(compacted, model)
+    stats = {
+        "charsBefore": len(markdown_content),
+        "charsAfter": len(compacted),
+        "charsRemoved": len(markdown_content) - len(compacted),
+        "tokensBefore": tokens_before,
+        "tokensAfter": tokens_after,
+        "tokensRemoved": tokens_before - tokens_after,
+        "charsRemovedByRule": removed_by_rule,
+    }
+    return compacted, stats
@@ -7,10 +7,32 @@ class DocumentAnalysis(BaseModel):
     document_type: DocumentStructureType
     reasoning: str
 
+class StructuralAnalysis(BaseModel):
+    document_type: DocumentStructureType
+    confidence: float
+    multiple_items_score: float
+    needs_model: bool
+    top_level_headings: int
+    repeated_heading_share: float
+    section_size_cv: float
+    reasoning: str
+
 
 class DocumentChunk(BaseModel):
     item_title: str
     item_content: str
+    start_offset: int = 0
+    end_offset: int = 0
+    # Problems found while splitting that concern this item, reported with its result
+    warnings: List[str] = Field(default_factory=list)
+
+class ItemBoundary(BaseModel):
+    item_title: str = Field(..., description="The title of the item, usually taken from its heading.")
+    start_anchor: str = Field(..., description="The first 5-10 words of the item, copied verbatim from the document.")
+    end_anchor: str = Field(..., description="The last 5-10 words of the item, copied verbatim from the document.")
+
+class DocumentBoundaries(BaseModel):
+    items: List[ItemBoundary]
 
 class MultiItemDocument(BaseModel):
     items: List[DocumentChunk]
\ No newline at end of file
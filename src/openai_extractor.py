@@ -1,11 +1,24 @@
 import json
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from .ai_client import AIClient
+from .document_splitter import find_headings
+from .entity_resolver import normalize_text
+from .token_counter import count_tokens
+from .tracing import span
 
-def extract_data_with_hierarchy(ai_client: AIClient, document_text: str, schema_package: dict) -> dict:
-    """Extracts structured data from text using the centralized AIClient."""
-    json_schema = schema_package['json_schema_for_api']
+EXTRACTION_MODEL = "gpt-5"
+
+# Documents above this size are extracted in several overlapping windows instead of one call
+DEFAULT_WINDOW_TOKENS = 60000
+DEFAULT_WINDOW_OVERLAP_TOKENS = 1500
+DEFAULT_MAX_WINDOWS_IN_FLIGHT = 4
 
-    system_prompt = """
+# Fields used, in order of preference, to recognize the same item extracted from two overlapping windows
+IDENTITY_FIELDS = ("title", "name")
+
+EXTRACTION_SYSTEM_PROMPT = """
     You are an expert assistant who analyzes documents and extracts key information.
     Structure the extracted content into the JSON format specified by the provided schema.
     If you cannot find information for a field, use `null`. Do not invent information.
@@ -15,10 +28,16 @@ def extract_data_with_hierarchy(ai_client: AIClient, document_text: str, schema_
     you MUST extract ONLY their full name.
     """
 
-    user_prompt = f"Please extract the data from the following document based on the required schema.\n\nDOCUMENT TEXT:\n---\n{document_text}\n---"
+WINDOW_PROMPT_NOTE = """
+    The text is window {number} of {total} of a longer document; consecutive windows overlap slightly.
+    Extract every item that appears in this window, including items that are cut off at its start or end.
+    Use `null` for top-level fields that this window does not contain.
+    """
 
+
+def _build_response_format(json_schema: dict) -> dict:
     # Define the response format for OpenAI's native JSON schema mode
-    response_format = {
+    return {
         "type": "json_schema",
         "json_schema": {
             "name": "dmaze_import_schema",
@@ -27,13 +46,259 @@ def extract_data_with_hierarchy(ai_client: AIClient, document_text: str, schema_
         }
     }
 
+
+def extract_data_with_hierarchy(ai_client: AIClient, document_text: str, schema_package: dict, system_prompt: str = EXTRACTION_SYSTEM_PROMPT) -> dict:
+    """Extracts structured data from text using the centralized AIClient."""
+    json_schema = schema_package['json_schema_for_api']
+
+    user_prompt = f"Please extract the data from the following document based on the required schema.\n\nDOCUMENT TEXT:\n---\n{document_text}\n---"
+
     try:
         # Use the single, unified method from AIClient
         return ai_client.get_structured_response(
             system_prompt=system_prompt,
             user_prompt=user_prompt,
-            response_format_options=response_format,
-            model="gpt-5" # Assuming this model supports the advanced JSON mode
+            response_format_options=_build_response_format(json_schema),
+            model=EXTRACTION_MODEL, # Assuming this model supports the advanced JSON mode
+            step_name="extraction"
         )
     except Exception as e:
-        return {"error": f"An unexpected error occurred during the AI call: {e}"}
\ No newline at end of file
+        return {"error": f"An unexpected error occurred during the AI call: {e}"}
+
+
+def _block_boundaries(markdown_content: str) -> list[int]:
+    """Offsets where a window may start: every heading line and every paragraph (blank line) break."""
+    boundaries = {0, len(markdown_content)}
+    boundaries.update(offset for offset, _, _ in find_headings(markdown_content))
+    position = markdown_content.find("\n\n")
+    while position != -1:
+        boundaries.add(position + 2)
+        position = markdown_content.find("\n\n", position + 2)
+    return sorted(b for b in boundaries if b <= len(markdown_content))
+
+
+def _split_oversized_block(markdown_content: str, start: int, end: int, max_tokens: int, model: str) -> list[tuple]:
+    """Cuts a single block larger than a window at line breaks, or at fixed character positions as a last resort."""
+    pieces = []
+    piece_start = start
+    piece_tokens = 0
+    line_start = start
+    while line_start < end:
+        line_end = markdown_content.find("\n", line_start, end)
+        line_end = end if line_end == -1 else line_end + 1
+        line_tokens = count_tokens(markdown_content[line_start:line_end], model)
+        if line_tokens > max_tokens:
+            if piece_start < line_start:
+                pieces.append((piece_start, line_start, piece_tokens))
+            step = max(1, (line_end - line_start) * max_tokens // line_tokens)
+            for cut in range(line_start, line_end, step):
+                cut_end = min(cut + step, line_end)
+                pieces.append((cut, cut_end, count_tokens(markdown_content[cut:cut_end], model)))
+            piece_start, piece_tokens = line_end, 0
+        elif piece_tokens + line_tokens > max_tokens and piece_start < line_start:
+            pieces.append((piece_start, line_start, piece_tokens))
+            piece_start, piece_tokens = line_start, line_tokens
+        else:
+            piece_tokens += line_tokens
+        line_start = line_end
+    if piece_start < end:
+        pieces.append((piece_start, end, piece_tokens))
+    return pieces
+
+
+def split_into_windows(markdown_content: str, max_window_tokens: int = DEFAULT_WINDOW_TOKENS,
+                       overlap_tokens: int = DEFAULT_WINDOW_OVERLAP_TOKENS, model: str = EXTRACTION_MODEL) -> list[tuple]:
+    """
+    Splits the document into windows of at most `max_window_tokens`, cut at heading and paragraph
+    boundaries. Each window after the first repeats up to `overlap_tokens` of whole blocks from the end
+    of the previous one. Returns (start_offset, end_offset, token_count) per window.
+    """
+    overlap_tokens = max(0, min(overlap_tokens, max_window_tokens // 2))
+    boundaries = _block_boundaries(markdown_content)
+    blocks = []
+    for start, end in zip(boundaries, boundaries[1:]):
+        tokens = count_tokens(markdown_content[start:end], model)
+        if tokens > max_window_tokens:
+            blocks.extend(_split_oversized_block(markdown_content, start, end, max_window_tokens, model))
+        elif end > start:
+            blocks.append((start, end, tokens))
+    if not blocks:
+        return [(0, len(markdown_content), 0)]
+
+    windows = []
+    first = 0
+    while first < len(blocks):
+        last = first
+        tokens = blocks[first][2]
+        while last + 1 < len(blocks) and tokens + blocks[last + 1][2] <= max_window_tokens:
+            last += 1
+            tokens += blocks[last][2]
+        windows.append((blocks[first][0], blocks[last][1], tokens))
+        if last + 1 >= len(blocks):
+            break
+
+        # Start the next window a few blocks back so items cut at the boundary are seen whole once
+        next_first = last + 1
+        carried = 0
+        while next_first - 1 > first and carried + blocks[next_first - 1][2] <= overlap_tokens:
+            next_first -= 1
+            carried += blocks[next_first][2]
+        first = next_first
+    return windows
+
+
+def _identity_key(item: dict, schema_node: dict):
+    """A normalized key for recognizing duplicates of one item, or None when the item has no usable identity."""
+    for field_name in IDENTITY_FIELDS:
+        value = item.get(field_name)
+        if isinstance(value, str) and normalize_text(value):
+            return field_name, normalize_text(value)
+    scalar_fields = {
+        field['fieldname']: normalize_text(item[field['fieldname']]) if isinstance(item.get(field['fieldname']), str) else item.get(field['fieldname'])
+        for field in schema_node.get('fields', [])
+    }
+    if not any(scalar_fields.values()):
+        return None
+    return "fields", json.dumps(scalar_fields, sort_keys=True, ensure_ascii=False)
+
+
+def _occurs_in(key: tuple, normalized_text: str) -> bool:
+    """Whether the text an identity key was built from occurs (as whole words) in the normalized text."""
+    if key[0] == "fields":
+        values = [value for value in json.loads(key[1]).values() if isinstance(value, str) and value]
+    else:
+        values = [key[1]]
+    padded_text = f" {normalized_text} "
+    return bool(values) and all(f" {value} " in padded_text for value in values)
+
+
+def _merge_node(target: dict, source: dict, schema_node: dict, overlap_text: str):
+    """
+    Merges `source`, the same item seen by the next window, into `target` in place: missing fields are filled in
+    and child lists are merged, de-duplicating only children found in the overlap text.
+    """
+    for field in schema_node.get('fields', []):
+        field_name = field['fieldname']
+        if target.get(field_name) in (None, "") and source.get(field_name) not in (None, ""):
+            target[field_name] = source[field_name]
+    for child in schema_node.get('children', []):
+        children = list(target.get(child['name']) or [])
+        _merge_overlapping_items(children, children, source.get(child['name']) or [], child, overlap_text)
+        target[child['name']] = children
+
+
+def _merge_overlapping_items(merged: list, previous: list, incoming: list, schema_node: dict, overlap_text: str) -> list:
+    """
+    Appends the items of a window (`incoming`) to `merged`. An incoming item is only a duplicate when it occurs in the
+    text the window shares with the previous one and matches a not yet matched item of the previous window (`previous`)
+    that occurs there too; it is merged into that item. Distinct items that share a title, within a window or across
+    the document, are kept. Returns, for every incoming item, the item it ended up as.
+    """
+    candidates = {}
+    if overlap_text:
+        for item in previous:
+            key = _identity_key(item, schema_node)
+            if key is not None and _occurs_in(key, overlap_text):
+                candidates.setdefault(key, []).append(item)
+    resolved = []
+    for item in incoming:
+        key = _identity_key(item, schema_node)
+        if key is not None and candidates.get(key) and _occurs_in(key, overlap_text):
+            target = candidates[key].pop(0)
+            _merge_node(target, item, schema_node, overlap_text)
+            resolved.append(target)
+        else:
+            merged.append(item)
+            resolved.append(item)
+    return resolved
+
+
+def merge_window_results(window_results: list[dict], schema_tree: dict, overlap_texts: list = None) -> dict:
+    """
+    Combines per-window extractions into one result for the root object. Root fields take the first non-empty
+    value in document order and child arrays are concatenated. `overlap_texts[i]` is the text window i repeats
+    from window i - 1; an item of window i found there that matches an item of window i - 1 also found there is
+    the same item seen twice and is merged into it (recursively). Without overlap texts nothing is de-duplicated.
+    """
+    root_name = schema_tree['name']
+    merged_root = {}
+    previous_items = {}
+    for i, window_result in enumerate(window_results):
+        root_data = window_result.get(root_name)
+        if not isinstance(root_data, dict):
+            previous_items = {}
+            continue
+        overlap_text = normalize_text(overlap_texts[i]) if overlap_texts and i > 0 and overlap_texts[i] else ""
+        if not merged_root:
+            merged_root = dict(root_data)
+            for child in schema_tree.get('children', []):
+                merged_root[child['name']] = []
+        for field in schema_tree.get('fields', []):
+            field_name = field['fieldname']
+            if merged_root.get(field_name) in (None, "") and root_data.get(field_name) not in (None, ""):
+                merged_root[field_name] = root_data[field_name]
+        for child in schema_tree.get('children', []):
+            # A window's own items are copied as they are; only those repeated from the previous window are merged
+            previous_items[child['name']] = _merge_overlapping_items(merged_root[child['name']], previous_items.get(child['name'], []),
+                                                                     root_data.get(child['name']) or [], child, overlap_text)
+    return {root_name: merged_root}
+
+
+def extract_data_windowed(ai_client: AIClient, document_text: str, schema_package: dict,
+                          max_window_tokens: int = DEFAULT_WINDOW_TOKENS, overlap_tokens: int = DEFAULT_WINDOW_OVERLAP_TOKENS,
+                          max_windows_in_flight: int = DEFAULT_MAX_WINDOWS_IN_FLIGHT, window_stats: list = None,
+                          system_prompt: str = EXTRACTION_SYSTEM_PROMPT) -> dict:
+    """
+    Extracts structured data, splitting documents larger than `max_window_tokens` into overlapping windows
+    that are extracted concurrently and merged. A document that fits in one window is sent in one call.
+    A failing window is recorded and skipped; an error is only returned when every window fails.
+    If `window_stats` is given, one entry per window (offsets, input tokens, latency, status) is appended to it.
+    """
+    windows = split_into_windows(document_text, max_window_tokens, overlap_tokens)
+    if window_stats is None:
+        window_stats = []
+
+    def extract_window(number: int, window: tuple) -> dict:
+        start, end, tokens = window
+        window_prompt = system_prompt
+        if len(windows) > 1:
+            window_prompt += WINDOW_PROMPT_NOTE.format(number=number + 1, total=len(windows))
+        started = time.perf_counter()
+        with span("extraction.window", window=number + 1, windows=len(windows), startOffset=start, endOffset=end, inputTokens=tokens):
+            result = extract_data_with_hierarchy(ai_client, document_text[start:end], schema_package, system_prompt=window_prompt)
+        stats = {
+            "window": number + 1,
+            "startOffset": start,
+            "endOffset": end,
+            "inputTokens": tokens,
+            "latencySeconds": round(time.perf_counter() - started, 3),
+            "status": "Failure" if "error" in result else "Success",
+        }
+        if "error" in result:
+            stats["error"] = result["error"]
+        return {"result": result, "stats": stats}
+
+    if len(windows) == 1:
+        outcomes = [extract_window(0, windows[0])]
+    else:
+        print(f"  - Document is larger than {max_window_tokens} tokens. Extracting {len(windows)} overlapping windows.")
+        with ThreadPoolExecutor(max_workers=max(1, max_windows_in_flight), thread_name_prefix="window") as executor:
+            # Each window runs in a copy of the caller's context so its usage is accounted to the caller's step
+            futures = [executor.submit(contextvars.copy_context().run, extract_window, number, window)
+                       for number, window in enumerate(windows)]
+            outcomes = [future.result() for future in futures]
+
+    window_stats.extend(outcome["stats"] for outcome in outcomes)
+    succeeded = [outcome["result"] for outcome in outcomes if "error" not in outcome["result"]]
+    if not succeeded:
+        return outcomes[0]["result"]
+    if len(outcomes) == 1:
+        return succeeded[0]
+    for outcome in outcomes:
+        if "error" in outcome["result"]:
+            print(f"  - WARNING: Extraction window {outcome['stats']['window']} failed and was skipped: {outcome['result']['error']}")
+    # The text each succeeded window shares with the one before it (nothing, when a failed window lies in between)
+    succeeded_windows = [outcome["stats"] for outcome in outcomes if "error" not in outcome["result"]]
+    overlap_texts = [None] + [document_text[current["startOffset"]:previous["endOffset"]]
+                              for previous, current in zip(succeeded_windows, succeeded_windows[1:])]
+    return merge_window_results(succeeded, schema_package['schema_tree'], overlap_texts)
@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import random
+import threading
+from typing import Callable, Dict, Optional
+
+import openai
+
+# Requests and tokens per minute per model. Override with DMAZE_RATE_LIMITS, e.g.
+# '{"gpt-5": {"requestsPerMinute": 500, "tokensPerMinute": 500000}}', to match the account's tier.
+DEFAULT_RATE_LIMITS = {
+    "gpt-5": {"requestsPerMinute": 500, "tokensPerMinute": 500_000},
+    "gpt-4o": {"requestsPerMinute": 500, "tokensPerMinute": 450_000},
+    "default": {"requestsPerMinute": 500, "tokensPerMinute": 200_000},
+}
+
+DEFAULT_MAX_ATTEMPTS = 6
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+
+class TokenBucket:
+    """
+    A bucket holding up to `capacity` units, refilled continuously at `capacity` per minute.
+    Reservations may drive the balance negative; the caller then waits until it is repaid.
+    """
+    def __init__(self, capacity: float):
+        self.capacity = float(capacity)
+        self.refill_per_second = self.capacity / 60.0
+        self.available = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def reserve(self, amount: float) -> float:
+        """Takes `amount` units (at most one full bucket) and returns how long to wait before using them."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.available -= min(amount, self.capacity)
+            return 0.0 if self.available >= 0 else -self.available / self.refill_per_second
+
+    def adjust(self, delta: float):
+        """Corrects an earlier reservation once the real amount is known (positive delta = more was used)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.available = min(self.capacity, self.available - delta)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limits requests in flight with an additive-increase/multiplicative-decrease limit: every success
+    raises the limit by 1/limit, every throttling response halves it (at most once per `cooldown_seconds`).
+    """
+    def __init__(self, initial: int = 8, minimum: int = 1, maximum: int = 32, cooldown_seconds: float = 1.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.cooldown_seconds = cooldown_seconds
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        with self._condition:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+    def on_throttled(self):
+        with self._condition:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown_seconds:
+                self.limit = max(self.minimum, self.limit / 2)
+                self._last_decrease = now
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """Reads 'retry-after-ms' or 'retry-after' (seconds) from an API error response, if present."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None  # An HTTP date; fall back to exponential backoff
+    return None
+
+
+def _is_throttled(error: Exception) -> bool:
+    return isinstance(error, openai.RateLimitError)
+
+
+def _is_retryable(error: Exception) -> bool:
+    return isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError))
+
+
+class RequestScheduler:
+    """
+    Shared admission control for model calls. Each call waits for a concurrency slot and for room in the
+    model's request and token buckets (sized from the estimated prompt plus expected output), then runs.
+    Rate limiting (429), server and connection errors are retried with jittered exponential backoff,
+    honoring the server's retry-after hint; throttling also shrinks the concurrency limit.
+    """
+    def __init__(self, rate_limits: Dict[str, dict] = None, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 concurrency: AdaptiveConcurrencyLimiter = None, backoff_base_seconds: float = BACKOFF_BASE_SECONDS,
+                 backoff_max_seconds: float = BACKOFF_MAX_SECONDS):
+        self.rate_limits = rate_limits or DEFAULT_RATE_LIMITS
+        self.max_attempts = max(1, max_attempts)
+        self.concurrency = concurrency or AdaptiveConcurrencyLimiter()
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _get_buckets(self, model: str) -> tuple:
+        with self._lock:
+            if model not in self._buckets:
+                limits = self.rate_limits.get(model) or self.rate_limits.get("default") or DEFAULT_RATE_LIMITS["default"]
+                self._buckets[model] = (TokenBucket(limits["requestsPerMinute"]), TokenBucket(limits["tokensPerMinute"]))
+            return self._buckets[model]
+
+    def _backoff_seconds(self, attempt: int, error: Exception) -> float:
+        retry_after = _retry_after_seconds(error)
+        if retry_after is not None:
+            # A little jitter keeps the clients that were throttled together from retrying together
+            return retry_after + random.uniform(0, self.backoff_base_seconds / 4)
+        # Full jitter: uniform between zero and the exponential ceiling
+        return random.uniform(0, min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** attempt))
+
+    def execute(self, model: str, estimated_tokens: int, call: Callable, stats: dict = None):
+        """
+        Runs `call()` under the model's limits and returns its result. If `stats` is given it is filled with
+        queueWaitSeconds (waiting for a slot or bucket room), backoffSeconds, modelSeconds, attempts and throttles.
+        The tokens of attempts that are retried are refunded here; the last attempt's reservation stays in place
+        until the caller passes the real usage to `settle()`, which it must do whether the call succeeded or not.
+        """
+        stats = stats if stats is not None else {}
+        stats.update({"queueWaitSeconds": 0.0, "backoffSeconds": 0.0, "modelSeconds": 0.0, "attempts": 0, "throttles": 0})
+        request_bucket, token_bucket = self._get_buckets(model)
+
+        for attempt in range(self.max_attempts):
+            queued_at = time.perf_counter()
+            self.concurrency.acquire()
+            try:
+                wait = max(request_bucket.reserve(1), token_bucket.reserve(estimated_tokens))
+                if wait > 0:
+                    time.sleep(wait)
+                started_at = time.perf_counter()
+                stats["queueWaitSeconds"] += started_at - queued_at
+                stats["attempts"] += 1
+                try:
+                    result = call()
+                finally:
+                    stats["modelSeconds"] += time.perf_counter() - started_at
+            except Exception as e:
+                if not _is_retryable(e) or attempt + 1 >= self.max_attempts:
+                    raise
+                if _is_throttled(e):
+                    stats["throttles"] += 1
+                    self.concurrency.on_throttled()
+                token_bucket.adjust(-min(estimated_tokens, token_bucket.capacity))
+                error = e
+            else:
+                self.concurrency.on_success()
+                return result
+            finally:
+                self.concurrency.release()
+
+            delay = self._backoff_seconds(attempt, error)
+            print(f"  - [SCHEDULER] {type(error).__name__} from '{model}' (attempt {attempt + 1}/{self.max_attempts}). "
+                  f"Retrying in {delay:.1f}s with concurrency limit {int(self.concurrency.limit)}.")
+            stats["backoffSeconds"] += delay
+            time.sleep(delay)
+
+    def settle(self, model: str, estimated_tokens: int, actual_tokens: int):
+        """
+        Returns unused tokens to the model's bucket (or takes the overshoot) once a call's real usage is known.
+        A call that failed or was cancelled without usage settles with 0 and gets its whole reservation back.
+        """
+        token_bucket = self._get_buckets(model)[1]
+        token_bucket.adjust(actual_tokens - min(estimated_tokens, token_bucket.capacity))
+
+
+def _load_rate_limits() -> Dict[str, dict]:
+    limits = {model: dict(values) for model, values in DEFAULT_RATE_LIMITS.items()}
+    override = os.getenv("DMAZE_RATE_LIMITS")
+    if override:
+        for model, values in json.loads(override).items():
+            limits.setdefault(model, {}).update(values)
+    return limits
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+def get_request_scheduler() -> RequestScheduler:
+    """The process-wide scheduler shared by every AIClient that is not given its own."""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = RequestScheduler(_load_rate_limits())
+        return _default_scheduler
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, List, Set
+
+from .entity_resolver import normalize_text
+
+RESOLUTION_CACHE_PATH = os.getenv("DMAZE_RESOLUTION_CACHE_PATH", os.path.join(".cache", "entity_resolution.sqlite"))
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 100_000
+
+
+def catalog_hash(candidates: List[Dict]) -> str:
+    """Hash of an entity type's candidate list; any change to the catalog produces a new hash."""
+    ordered = sorted(candidates or [], key=lambda candidate: str(candidate.get("id")))
+    canonical = json.dumps(ordered, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class EntityResolutionCache:
+    """
+    SQLite-backed memo of model-resolved entity matches.
+    Entries are keyed by entity type, normalized snippet and the hash of the candidate catalog they
+    were resolved against, so an entry is never returned once the catalog for that type has changed.
+    Entries expire after `ttl_seconds`; beyond `max_entries` the least recently used are evicted.
+    """
+    def __init__(self, db_path: str = RESOLUTION_CACHE_PATH, ttl_seconds: float = DEFAULT_TTL_SECONDS, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS resolutions (
+                    entity_type TEXT NOT NULL,
+                    snippet TEXT NOT NULL,
+                    catalog_hash TEXT NOT NULL,
+                    entity_id TEXT NOT NULL,
+                    confidence TEXT NOT NULL,
+                    reasoning TEXT,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL,
+                    PRIMARY KEY (entity_type, snippet, catalog_hash)
+                )
+            """)
+            self._connection.execute("CREATE INDEX IF NOT EXISTS idx_resolutions_last_used ON resolutions (last_used_at)")
+
+    def lookup(self, items_to_match: Dict[str, Set[str]], catalog_hashes: Dict[str, str]) -> tuple:
+        """
+        Returns (found, remaining): found maps entity_type -> input_text -> {id, confidence, reasoning};
+        remaining holds the snippets without a valid cache entry.
+        """
+        found, remaining = {}, {}
+        now = time.time()
+        min_created_at = now - self.ttl_seconds
+        with self._lock, self._connection:
+            for entity_type, texts in items_to_match.items():
+                for text in texts:
+                    row = self._connection.execute(
+                        "SELECT entity_id, confidence, reasoning FROM resolutions "
+                        "WHERE entity_type = ? AND snippet = ? AND catalog_hash = ? AND created_at >= ?",
+                        (entity_type, normalize_text(text), catalog_hashes[entity_type], min_created_at)
+                    ).fetchone()
+                    if row:
+                        found.setdefault(entity_type, {})[text] = {"id": row[0], "confidence": row[1], "reasoning": row[2]}
+                        self._connection.execute(
+                            "UPDATE resolutions SET last_used_at = ? WHERE entity_type = ? AND snippet = ? AND catalog_hash = ?",
+                            (now, entity_type, normalize_text(text), catalog_hashes[entity_type]))
+                    else:
+                        remaining.setdefault(entity_type, set()).add(text)
+        return found, remaining
+
+    def store(self, matches: Dict[str, Dict[str, dict]], catalog_hashes: Dict[str, str]):
+        """Stores resolved matches and applies TTL and size-based eviction."""
+        now = time.time()
+        rows = [
+            (entity_type, normalize_text(text), catalog_hashes[entity_type], details["id"], details["confidence"], details.get("reasoning"), now, now)
+            for entity_type, type_matches in matches.items() if entity_type in catalog_hashes
+            for text, details in type_matches.items()
+        ]
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO resolutions VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._evict(now)
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM resolutions")
+
+    def _evict(self, now: float):
+        self._connection.execute("DELETE FROM resolutions WHERE created_at < ?", (now - self.ttl_seconds,))
+        count = self._connection.execute("SELECT COUNT(*) FROM resolutions").fetchone()[0]
+        if count > self.max_entries:
+            self._connection.execute(
+                "DELETE FROM resolutions WHERE rowid IN (SELECT rowid FROM resolutions ORDER BY last_used_at LIMIT ?)",
+                (count - self.max_entries,))
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_resolution_cache() -> EntityResolutionCache:
+    """The process-wide resolution cache, created on first use."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EntityResolutionCache()
+        return _default_cache
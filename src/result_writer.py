@@ -0,0 +1,105 @@
+import os
+import json
+import gzip
+import re
+
+OUTPUT_FORMATS = ("json", "ndjson", "ndjson.gz")
+
+def sanitize_filename(name: str) -> str:
+    """Sanitize a string so it is a valid file name."""
+    if not name:
+        return ""
+    name = re.sub(r'[<>:"/\\|?*]', '', name)
+    return name[:100].strip()
+
+
+def build_output_filename(item_title: str, input_path: str, index: int, num_results: int, extension: str = ".json") -> str:
+    """Builds a unique and safe output filename for result number `index` of a document."""
+    base_name = sanitize_filename(item_title) if item_title else os.path.splitext(os.path.basename(input_path))[0]
+    # Add a counter if there are multiple results or no title
+    if num_results > 1 and not item_title:
+        return f"{base_name}_item_{index + 1}_dmaze_import{extension}"
+    elif num_results > 1:
+        return f"{base_name}_{index + 1}_dmaze_import{extension}"
+    return f"{base_name}_dmaze_import{extension}"
+
+
+def save_results_as_json(results: list[dict], input_path: str, output_dir: str) -> list[str]:
+    """Writes each result to its own pretty-printed JSON file and returns the written paths."""
+    os.makedirs(output_dir, exist_ok=True)
+    output_paths = []
+    for i, result in enumerate(results):
+        item_title = result.get("summary", {}).get("itemTitle")
+        output_path = os.path.join(output_dir, build_output_filename(item_title, input_path, i, len(results)))
+
+        print(f"  - Saving result to '{output_path}'")
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=4, ensure_ascii=False)
+        output_paths.append(output_path)
+    return output_paths
+
+
+class NdjsonResultWriter:
+    """
+    Writes one result as newline-delimited JSON: one Dmaze object per line as it is produced,
+    followed by a trailing {"summary": {...}} record. Optionally gzip-compressed.
+    """
+    def __init__(self, output_path: str, compress: bool = False):
+        self.output_path = output_path
+        self.object_count = 0
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if compress:
+            self._file = gzip.open(output_path, "wt", encoding="utf-8")
+        else:
+            self._file = open(output_path, "w", encoding="utf-8")
+
+    def write_object(self, dmaze_object: dict):
+        self._file.write(json.dumps(dmaze_object, ensure_ascii=False))
+        self._file.write("\n")
+        self.object_count += 1
+
+    def write_summary(self, summary: dict):
+        self._file.write(json.dumps({"summary": summary}, ensure_ascii=False))
+        self._file.write("\n")
+
+    def close(self):
+        self._file.close()
+
+
+def ndjson_writer_factory(input_path: str, output_dir: str, compress: bool = False):
+    """
+    Returns a factory for DocumentProcessor.run(result_writer_factory=...) that opens one NDJSON
+    writer per result, named like the JSON output files.
+    """
+    extension = ".ndjson.gz" if compress else ".ndjson"
+
+    def create_writer(index: int, item_title: str, num_results: int) -> NdjsonResultWriter:
+        output_path = os.path.join(output_dir, build_output_filename(item_title, input_path, index, num_results, extension))
+        print(f"  - Streaming result to '{output_path}'")
+        return NdjsonResultWriter(output_path, compress=compress)
+
+    return create_writer
+
+
+def finish_ndjson_results(results: list[dict], input_path: str, output_dir: str, compress: bool = False) -> list[str]:
+    """
+    Returns the output paths of results that were streamed by DocumentProcessor.run, and writes
+    any result that was not streamed (e.g. the failure result of an aborted run) as NDJSON too.
+    """
+    create_writer = ndjson_writer_factory(input_path, output_dir, compress)
+    output_paths = []
+    for i, result in enumerate(results):
+        if "output_path" in result:
+            output_paths.append(result["output_path"])
+            continue
+        writer = create_writer(i, result.get("summary", {}).get("itemTitle"), len(results))
+        try:
+            for dmaze_object in result.get("dmaze_data", []):
+                writer.write_object(dmaze_object)
+            writer.write_summary(result.get("summary", {}))
+        finally:
+            writer.close()
+        output_paths.append(writer.output_path)
+    return output_paths
@@ -1,21 +1,66 @@
+import os
 import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from .disk_cache import LruDiskCache
+
+# Bump this when the structure of the generated schema package changes so cached packages are rebuilt.
+SCHEMA_COMPILER_VERSION = "1"
+
+SCHEMA_PACKAGE_CACHE_DIR = os.getenv("DMAZE_SCHEMA_CACHE_DIR", os.path.join(".cache", "schema_packages"))
+# Compiled packages kept in memory; the least recently used are dropped first and reloaded from disk when needed
+SCHEMA_PACKAGE_MEMO_ITEMS = 64
+
+_package_disk_cache = LruDiskCache(SCHEMA_PACKAGE_CACHE_DIR, max_disk_bytes=64 * 1024 * 1024, memory_items=0, suffix=".json")
+_package_memo = OrderedDict()
+_package_memo_lock = threading.Lock()
+
+
+class FrozenDict(dict):
+    """A dict that refuses modification. Still a dict, so it serializes with json like any other."""
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Schema packages are immutable; copy the value before modifying it.")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __ior__ = _readonly
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+def freeze(value):
+    """Recursively converts dicts to FrozenDicts and lists to tuples."""
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def build_children_index(relationships: list) -> dict:
+    """Builds a parent -> [relationship, ...] adjacency index in a single pass over the relationships."""
+    children_index = {}
+    for rel in relationships:
+        children_index.setdefault(rel['parent'], []).append(rel)
+    return children_index
+
 
 # Convert flat lists of types and relationships into a hierarchical tree structure.
-def build_schema_tree(object_name: str, types_map: dict, relationships: list, entities: dict) -> dict:
-    """Recursively builds a hierarchical tree from the template's flat relationships."""
+def build_schema_tree(object_name: str, types_map: dict, children_index: dict, entities: dict) -> dict:
+    """Recursively builds a hierarchical tree using the parent -> children index from build_children_index."""
     object_info = types_map.get(object_name)
     if not object_info: return None
 
     node = {"name": object_name, "fields": object_info.get('fields', []), "children": []}
 
-    # Attach children based on explicit relationships
-    for rel in relationships:
-        if rel['parent'] == object_name:
-            child_name = rel['child']
-            child_node = build_schema_tree(child_name, types_map, relationships, entities)
-            if child_node:
-                child_node['relationship_field'] = rel['childfieldname']
-                node['children'].append(child_node)
+    # Attach children based on the relationships of this object
+    for rel in children_index.get(object_name, []):
+        child_name = rel['child']
+        child_node = build_schema_tree(child_name, types_map, children_index, entities)
+        if child_node:
+            child_node['relationship_field'] = rel['childfieldname']
+            node['children'].append(child_node)
     return node
 
 
@@ -60,9 +105,48 @@ def build_json_schema_from_tree(node: dict, entities: dict) -> dict:
     return {"type": "object", "properties": properties, "required": required_fields, "additionalProperties": False}
 
 
+def get_template_hash(schema_content: dict) -> str:
+    """Content hash of a template, independent of key order and formatting."""
+    canonical = json.dumps(schema_content, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(f"{SCHEMA_COMPILER_VERSION}:{canonical}".encode('utf-8')).hexdigest()
+
+
 def process_template_hierarchically(schema_content: dict):
     """
-    Main function to read any template file and generate the artifacts needed by the pipeline:
+    Main function to read any template file and generate the artifacts needed by the pipeline.
+    The compiled package is immutable and memoized in-process (the SCHEMA_PACKAGE_MEMO_ITEMS most recently
+    used) and on disk by template content hash, so a template is only compiled once across documents and runs.
+    """
+    template_hash = get_template_hash(schema_content)
+
+    with _package_memo_lock:
+        if template_hash in _package_memo:
+            _package_memo.move_to_end(template_hash)
+            return _package_memo[template_hash]
+
+    cached_package = _package_disk_cache.get(template_hash)
+    if cached_package is not None:
+        print("  - Loaded compiled schema package from cache.")
+        package = freeze(json.loads(cached_package))
+    else:
+        package = compile_template(schema_content)
+        if "error" in package:
+            return package
+        package["template_hash"] = template_hash
+        _package_disk_cache.set(template_hash, json.dumps(package, ensure_ascii=False))
+        package = freeze(package)
+
+    with _package_memo_lock:
+        package = _package_memo.setdefault(template_hash, package)
+        _package_memo.move_to_end(template_hash)
+        while len(_package_memo) > SCHEMA_PACKAGE_MEMO_ITEMS:
+            _package_memo.popitem(last=False)
+        return package
+
+
+def compile_template(schema_content: dict) -> dict:
+    """
+    Reads any template and generates the artifacts needed by the pipeline, without modifying the input:
       - schema_tree: a hierarchical representation used for traversal/flattening
       - json_schema_for_api: a formal JSON Schema sent to the AI
       - entity_map: a name->id lookup for static entities defined in the template
@@ -84,20 +168,22 @@ def process_template_hierarchically(schema_content: dict):
 
         # Discover relationships: start with explicit ones and add implicit ones based on field entitytypes
         print("  - Discovering relationships...")
-        unified_relationships = schema_content.get('relationships', [])
+        # Copy so the caller's template is never modified
+        unified_relationships = list(schema_content.get('relationships', []))
+        known_pairs = {(r['parent'], r['child']) for r in unified_relationships}
 
         for object_name, object_info in types_map.items():
             for field in object_info.get('fields', []):
                 field_entity_type = field.get('entitytype')
                 if field_entity_type and field_entity_type in types_map:
                     print(f"    - Found implicit relationship: {object_name} -> {field_entity_type}")
-                    new_rel = {
-                        "parent": object_name,
-                        "child": field_entity_type,
-                        "childfieldname": field.get('fieldname')
-                    }
-                    if not any(r['parent'] == new_rel['parent'] and r['child'] == new_rel['child'] for r in unified_relationships):
-                        unified_relationships.append(new_rel)
+                    if (object_name, field_entity_type) not in known_pairs:
+                        known_pairs.add((object_name, field_entity_type))
+                        unified_relationships.append({
+                            "parent": object_name,
+                            "child": field_entity_type,
+                            "childfieldname": field.get('fieldname')
+                        })
 
         entities = schema_content.get('entities', {})
 
@@ -108,7 +194,7 @@ def process_template_hierarchically(schema_content: dict):
         root_name = root_object_info['objectname']
 
         # Build tree and the formal JSON schema
-        schema_tree = build_schema_tree(root_name, types_map, unified_relationships, entities)
+        schema_tree = build_schema_tree(root_name, types_map, build_children_index(unified_relationships), entities)
         formal_json_schema = build_json_schema_from_tree(schema_tree, entities)
         final_schema_for_api = {
             "type": "object",
@@ -0,0 +1,26 @@
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # Optional: fall back to a character-based estimate
+    tiktoken = None
+
+# Rough average for mixed English/Norwegian prose and JSON when no tokenizer is installed.
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Counts tokens with tiktoken when available, otherwise estimates from the character count."""
+    if not text:
+        return 0
+    if tiktoken is not None:
+        return len(_get_encoding(model).encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
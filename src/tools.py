@@ -3,7 +3,13 @@ from openai import OpenAI
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Set, Literal
 import json
+import threading
+from collections import OrderedDict
 from .ai_client import AIClient 
+from .entity_resolver import resolve_entities_locally, RESOLUTION_TIERS
+from .resolution_cache import EntityResolutionCache, catalog_hash, get_resolution_cache
+from .token_counter import count_tokens
+from .tracing import span
 
 # --- MODIFIED MODELS ---
 class BatchMatchResult(BaseModel):
@@ -20,23 +26,79 @@ class BatchMatchResponse(BaseModel):
 def find_best_entity_matches_in_batch(
     ai_client: AIClient,
     items_to_match: Dict[str, Set[str]],
-    valid_entities_map: Dict[str, List[Dict]]
+    valid_entities_map: Dict[str, List[Dict]],
+    match_stats: dict = None,
+    resolution_cache: Optional[EntityResolutionCache] = None,
+    use_resolution_cache: bool = True,
+    display_fields: Dict[str, str] = None
 ) -> Dict[str, Dict[str, dict]]:
     """
-    Find best ID matches for a batch of text snippets in a single AI call.
+    Find best ID matches for a batch of text snippets.
+    Snippets are first resolved locally (exact, normalized and fuzzy matching), then looked up in the
+    persistent resolution cache of earlier model answers. Only what is left is sent to the model in a
+    single AI call, and the call is skipped when nothing is left.
     Returns a dict mapping entity_type -> input_text -> {id, confidence, reasoning}.
     Only successful matches are included; unmatched snippets are logged but not returned.
-    On error, an empty dict is returned.
+    If `match_stats` is given it is filled with per-tier hit counts and the prompt size.
+    `display_fields` maps entity type -> the candidate field shown to the model (default 'name').
     """
     if not items_to_match:
         return {}
 
-    tasks_list = []
-    for entity_type, texts in items_to_match.items():
-        for text in texts:
-            tasks_list.append({"text": text, "entity_type": entity_type})
+    total_snippets = sum(len(texts) for texts in items_to_match.values())
+    with span("matching.local", snippets=total_snippets, entityTypes=",".join(sorted(items_to_match))) as local_span:
+        detailed_lookup_map, residual_items, tier_counts = resolve_entities_locally(items_to_match, valid_entities_map, display_fields)
+        if local_span:
+            local_span.set_attributes(**{f"{tier}Matches": tier_counts[tier] for tier in RESOLUTION_TIERS})
+    residual_count = sum(len(texts) for texts in residual_items.values())
+    for entity_type, matches in detailed_lookup_map.items():
+        for text, details in matches.items():
+            print(f"  - [LOCAL MATCHER] Matched '{text}' ({entity_type}) -> ID: {details['id']} ({details['reasoning']})")
 
-    system_prompt = """
+    memo_matched = 0
+    if residual_items and use_resolution_cache:
+        resolution_cache = resolution_cache or get_resolution_cache()
+        # The cache key includes a hash of each type's candidates, so a changed catalog never yields a stale ID
+        catalog_hashes = {entity_type: catalog_hash(valid_entities_map.get(entity_type)) for entity_type in residual_items}
+        with span("matching.cache", snippets=residual_count) as cache_span:
+            memo_lookup_map, residual_items = resolution_cache.lookup(residual_items, catalog_hashes)
+            if cache_span:
+                cache_span.set_attributes(hits=sum(len(matches) for matches in memo_lookup_map.values()))
+        for entity_type, matches in memo_lookup_map.items():
+            detailed_lookup_map.setdefault(entity_type, {}).update(matches)
+            memo_matched += len(matches)
+
+    llm_matched = 0
+    # The prompt sizes are only measured when the caller collects statistics
+    prompt_stats = {} if match_stats is not None else None
+    sent_to_model = sum(len(texts) for texts in residual_items.values())
+    if residual_items:
+        with span("matching.model", snippets=sent_to_model, entityTypes=",".join(sorted(residual_items))):
+            llm_lookup_map = _match_with_model(ai_client, residual_items, valid_entities_map, display_fields, prompt_stats)
+        for entity_type, matches in llm_lookup_map.items():
+            detailed_lookup_map.setdefault(entity_type, {}).update(matches)
+            llm_matched += len(matches)
+        if use_resolution_cache:
+            resolution_cache.store(llm_lookup_map, catalog_hashes)
+    else:
+        print("  - [BATCH MATCHER] All snippets resolved without the model. Skipping the AI call.")
+
+    hit_rates = ", ".join(f"{tier} {tier_counts[tier]}/{total_snippets}" for tier in RESOLUTION_TIERS)
+    print(f"  - [BATCH MATCHER] Resolution tiers: {hit_rates}, cache {memo_matched}/{residual_count}, model {llm_matched}/{sent_to_model}.")
+    if match_stats is not None:
+        match_stats.update({
+            "totalSnippets": total_snippets,
+            **{f"{tier}Matches": tier_counts[tier] for tier in RESOLUTION_TIERS},
+            "cacheMatches": memo_matched,
+            "sentToModel": sent_to_model,
+            "modelMatches": llm_matched,
+            "modelCalls": 1 if residual_items else 0,
+            **prompt_stats,
+        })
+    return detailed_lookup_map
+
+
+MATCHING_SYSTEM_PROMPT = """
     You are an expert in high-throughput entity resolution. Your task is to process a batch of text snippets and find the single best matching entity for each from a provided database of valid entities.
     The provided lists of entities are the ONLY source of truth.
 
@@ -52,24 +114,90 @@ def find_best_entity_matches_in_batch(
     If no good match is found for a snippet, you MUST return null for `best_match_id` and "Low" for `confidence`.
     """
 
-    user_prompt = f"""
-    Here is the database of all available entities, categorized by type:
-    --- DATABASE OF ENTITIES ---
-    {json.dumps(valid_entities_map, indent=2, ensure_ascii=False)}
-    --- END OF DATABASE ---
+_COMPACT_JSON = {"ensure_ascii": False, "separators": (',', ':')}
+
+
+def build_matching_prompt(
+    items_to_match: Dict[str, Set[str]],
+    valid_entities_map: Dict[str, List[Dict]],
+    display_fields: Dict[str, str] = None
+) -> str:
+    """
+    Builds the user prompt for the matcher with only the entity types that have tasks in this batch.
+    Candidates are reduced to [id, display value] pairs and all JSON is encoded without whitespace.
+    """
+    display_fields = display_fields or {}
+    database = {}
+    for entity_type in items_to_match:
+        display_field = display_fields.get(entity_type, "name")
+        database[entity_type] = [
+            [candidate.get("id"), candidate.get(display_field)]
+            for candidate in valid_entities_map.get(entity_type) or []
+        ]
+    tasks = {entity_type: sorted(texts) for entity_type, texts in items_to_match.items()}
+
+    return (
+        "DATABASE OF ENTITIES (entity type -> list of [id, name] pairs):\n"
+        f"{json.dumps(database, **_COMPACT_JSON)}\n"
+        "TASKS (entity type -> list of text snippets to match against that type):\n"
+        f"{json.dumps(tasks, **_COMPACT_JSON)}\n"
+        "Return a complete list of results for all tasks."
+    )
+
+
+# Tokens of each entity type's catalog in the previous pretty-printed prompt, by (entity type, catalog hash)
+LEGACY_CATALOG_TOKENS_ITEMS = 256
+_legacy_catalog_tokens = OrderedDict()
+_legacy_catalog_tokens_lock = threading.Lock()
 
-    Now, please process the following list of matching tasks:
-    --- TASKS TO PROCESS ---
-    {json.dumps(tasks_list, indent=2, ensure_ascii=False)}
-    --- END OF TASKS ---
 
-    Return a complete list of results for all tasks.
+def _legacy_prompt_tokens(items_to_match: Dict[str, Set[str]], valid_entities_map: Dict[str, List[Dict]]) -> int:
     """
+    Estimated size of the previous full-catalog, pretty-printed prompt, only used to report the token saving.
+    The catalog part is counted per entity type once per catalog version and reused, so reporting the saving
+    does not cost a catalog-sized serialization and tokenization on every matching call.
+    """
+    catalog_tokens = 0
+    for entity_type, candidates in valid_entities_map.items():
+        key = (entity_type, catalog_hash(candidates))
+        with _legacy_catalog_tokens_lock:
+            tokens = _legacy_catalog_tokens.get(key)
+            if tokens is not None:
+                _legacy_catalog_tokens.move_to_end(key)
+        if tokens is None:
+            tokens = count_tokens(json.dumps({entity_type: candidates}, indent=2, ensure_ascii=False))
+            with _legacy_catalog_tokens_lock:
+                _legacy_catalog_tokens[key] = tokens
+                while len(_legacy_catalog_tokens) > LEGACY_CATALOG_TOKENS_ITEMS:
+                    _legacy_catalog_tokens.popitem(last=False)
+        catalog_tokens += tokens
+    tasks_list = [{"text": text, "entity_type": entity_type} for entity_type, texts in items_to_match.items() for text in texts]
+    return catalog_tokens + count_tokens(json.dumps(tasks_list, indent=2, ensure_ascii=False))
+
+
+def _match_with_model(
+    ai_client: AIClient,
+    items_to_match: Dict[str, Set[str]],
+    valid_entities_map: Dict[str, List[Dict]],
+    display_fields: Dict[str, str] = None,
+    prompt_stats: dict = None
+) -> Dict[str, Dict[str, dict]]:
+    """Resolves the given snippets with a single AI call."""
+    system_prompt = MATCHING_SYSTEM_PROMPT
+    user_prompt = build_matching_prompt(items_to_match, valid_entities_map, display_fields)
+
+    if prompt_stats is not None:
+        prompt_tokens = count_tokens(system_prompt) + count_tokens(user_prompt)
+        legacy_prompt_tokens = count_tokens(system_prompt) + _legacy_prompt_tokens(items_to_match, valid_entities_map)
+        print(f"  - [BATCH MATCHER] Prompt size: {prompt_tokens} tokens (full-catalog prompt would be about {legacy_prompt_tokens}).")
+        prompt_stats["promptTokens"] = prompt_tokens
+        prompt_stats["promptTokensBeforeCompaction"] = legacy_prompt_tokens
 
     response = ai_client.get_structured_response(
         response_model=BatchMatchResponse,
         system_prompt=system_prompt,
-        user_prompt=user_prompt
+        user_prompt=user_prompt,
+        step_name="entity_matching"
     )
 
     detailed_lookup_map = {}
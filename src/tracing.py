@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# The tracer and the span of the current unit of work. Like llm_usage, work handed to a pool must be
+# run in a copied context (contextvars.copy_context().run) to stay attached to its parent span.
+_active_tracer: ContextVar[Optional["Tracer"]] = ContextVar("active_tracer", default=None)
+_active_span: ContextVar[Optional["Span"]] = ContextVar("active_span", default=None)
+
+
+class Span:
+    """
+    One timed operation. Times are monotonic nanoseconds; the tracer maps them to wall-clock time on export.
+    CPU time is that of the thread the span was started on, so work handed to other threads is not included.
+    """
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "cpu_start_ns", "cpu_end_ns", "attributes", "status",
+                 "thread_id", "thread_name")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: dict):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = None
+        self.cpu_start_ns = time.thread_time_ns()
+        self.cpu_end_ns = None
+        self.attributes = dict(attributes)
+        self.status = "OK"
+        thread = threading.current_thread()
+        self.thread_id = thread.ident
+        self.thread_name = thread.name
+
+    @property
+    def duration_seconds(self) -> float:
+        end_ns = self.end_ns if self.end_ns is not None else time.perf_counter_ns()
+        return (end_ns - self.start_ns) / 1e9
+
+    @property
+    def cpu_seconds(self) -> float:
+        cpu_end_ns = self.cpu_end_ns if self.cpu_end_ns is not None else time.thread_time_ns()
+        return (cpu_end_ns - self.cpu_start_ns) / 1e9
+
+    def finish(self):
+        self.end_ns = time.perf_counter_ns()
+        self.cpu_end_ns = time.thread_time_ns()
+
+    def set_attributes(self, **attributes):
+        self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+
+
+class Tracer:
+    """
+    Collects finished spans of one trace and exports them as Chrome trace JSON
+    (chrome://tracing, ui.perfetto.dev) or as OTLP-style JSON (resourceSpans/scopeSpans/spans).
+    """
+    def __init__(self, service_name: str = "document-import"):
+        self.service_name = service_name
+        self.trace_id = uuid.uuid4().hex
+        # Anchor for converting monotonic span times to epoch time
+        self._epoch_ns = time.time_ns()
+        self._monotonic_ns = time.perf_counter_ns()
+        self._lock = threading.Lock()
+        self._spans = []
+
+    def _finish(self, span: Span):
+        with self._lock:
+            self._spans.append(span)
+
+    @property
+    def spans(self) -> list[Span]:
+        with self._lock:
+            return sorted(self._spans, key=lambda s: s.start_ns)
+
+    def _to_epoch_ns(self, monotonic_ns: int) -> int:
+        return self._epoch_ns + (monotonic_ns - self._monotonic_ns)
+
+    def to_chrome_trace(self) -> dict:
+        """Complete ('X') events in microseconds, one row per thread, with span attributes as args."""
+        events = []
+        threads = {}
+        for span in self.spans:
+            threads.setdefault(span.thread_id, span.thread_name)
+            events.append({
+                "name": span.name,
+                "cat": span.name.split(".")[0] if "." in span.name else "step",
+                "ph": "X",
+                "ts": (span.start_ns - self._monotonic_ns) / 1000,
+                "dur": ((span.end_ns or span.start_ns) - span.start_ns) / 1000,
+                "pid": os.getpid(),
+                "tid": span.thread_id,
+                "args": {**span.attributes, "cpuMs": round(span.cpu_seconds * 1000, 3), "spanId": span.span_id,
+                         "parentSpanId": span.parent_id, "status": span.status},
+            })
+        for thread_id, thread_name in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread_id, "args": {"name": thread_name}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def to_otlp_json(self) -> dict:
+        """The trace in the OTLP/JSON layout used by OpenTelemetry collectors."""
+        def attribute(key, value):
+            if isinstance(value, bool):
+                return {"key": key, "value": {"boolValue": value}}
+            if isinstance(value, int):
+                return {"key": key, "value": {"intValue": str(value)}}
+            if isinstance(value, float):
+                return {"key": key, "value": {"doubleValue": value}}
+            return {"key": key, "value": {"stringValue": str(value)}}
+
+        spans = [{
+            "traceId": self.trace_id,
+            "spanId": span.span_id,
+            **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+            "name": span.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self._to_epoch_ns(span.start_ns)),
+            "endTimeUnixNano": str(self._to_epoch_ns(span.end_ns or span.start_ns)),
+            "attributes": [attribute(key, value) for key, value in {**span.attributes, "thread.name": span.thread_name}.items()],
+            "status": {"code": 1 if span.status == "OK" else 2},
+        } for span in self.spans]
+        return {"resourceSpans": [{
+            "resource": {"attributes": [attribute("service.name", self.service_name)]},
+            "scopeSpans": [{"scope": {"name": "dmaze.document_import"}, "spans": spans}],
+        }]}
+
+    def export(self, directory: str, base_name: str) -> dict:
+        """Writes '<base_name>.trace.json' (Chrome) and '<base_name>.otlp.json' to `directory` and returns their paths."""
+        os.makedirs(directory, exist_ok=True)
+        paths = {
+            "chrome": os.path.join(directory, f"{base_name}.trace.json"),
+            "otlp": os.path.join(directory, f"{base_name}.otlp.json"),
+        }
+        with open(paths["chrome"], 'w', encoding='utf-8') as f:
+            json.dump(self.to_chrome_trace(), f, ensure_ascii=False)
+        with open(paths["otlp"], 'w', encoding='utf-8') as f:
+            json.dump(self.to_otlp_json(), f, ensure_ascii=False)
+        return paths
+
+
+@contextmanager
+def use_tracer(tracer: Optional[Tracer]):
+    """Makes `tracer` the destination of all spans started in this context."""
+    token = _active_tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _active_tracer.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Times the block as a child of the current span. Yields the Span (to add attributes), or None when
+    no tracer is active, in which case tracing costs nothing beyond a context variable lookup.
+    """
+    tracer = _active_tracer.get()
+    if tracer is None:
+        yield None
+        return
+    parent = _active_span.get()
+    current = Span(name, parent.span_id if parent else None, {k: v for k, v in attributes.items() if v is not None})
+    token = _active_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "ERROR"
+        current.attributes["error"] = str(e)
+        raise
+    finally:
+        current.finish()
+        _active_span.reset(token)
+        tracer._finish(current)
+
+
+def start_span(name: str, **attributes) -> Optional[Span]:
+    """
+    Starts a child of the current span without making it the current span, for work that cannot be
+    wrapped in a `with` block (e.g. a generator that yields while the work is in progress). Finish it with end_span.
+    """
+    tracer = _active_tracer.get()
+    if tracer is None:
+        return None
+    parent = _active_span.get()
+    return Span(name, parent.span_id if parent else None, {k: v for k, v in attributes.items() if v is not None})
+
+
+def end_span(detached_span: Optional[Span]):
+    tracer = _active_tracer.get()
+    if detached_span is not None and tracer is not None:
+        detached_span.finish()
+        tracer._finish(detached_span)
+
+
+def set_span_attributes(**attributes):
+    """Adds attributes to the current span, if any."""
+    current = _active_span.get()
+    if current is not None:
+        current.set_attributes(**attributes)